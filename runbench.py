@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+
+"""
+Timing benchmarks for smof commands on synthetic FASTA input.
+
+Usage:
+    ./runbench.py                  # run every benchmark
+    ./runbench.py grep_gapped      # run only the named benchmarks
+    ./runbench.py -s 10            # multiply input sizes by 10
+"""
+
+import smof.ui as smof
+import smof.functions as smof_base
+import argparse
+import random
+import sys
+import time
+
+
+class NullOut:
+    def write(self, x):
+        pass
+
+
+def run(entries, argv):
+    """
+    Run a smof subcommand over a list of (header, sequence) pairs, discarding
+    the output, and return the elapsed time in seconds
+    """
+    args = smof.parse([str(s) for s in argv])
+    # as in runtest.py, stand the entries in for the input files
+    args.fh = [entries]
+    gen = smof_base._stream_entries(iter(entries))
+    t0 = time.perf_counter()
+    args.func(args, gen, out=NullOut())
+    return time.perf_counter() - t0
+
+
+def random_seq(n, alphabet="ACGT"):
+    return "".join(random.choice(alphabet) for _ in range(n))
+
+
+def report(name, desc, seconds):
+    print("{:<24} {:<48} {:>9.3f}s".format(name, desc, seconds))
+
+
+# ==========
+# Benchmarks
+# ==========
+
+
+def bench_grep_gapped(scale):
+    """
+    Aligned sequences with thousands of gap runs and many hits
+    """
+    nseqs = 20 * scale
+    entries = []
+    for i in range(nseqs):
+        s = random_seq(20000)
+        s = "".join(c if random.random() > 0.2 else "--" + c for c in s)
+        entries.append(("seq{}".format(i), s))
+    desc = "{} x 20kb aligned, ~4000 gaps each".format(nseqs)
+    report("grep_gapped", "-qgo " + desc, run(entries, ["grep", "-qgo", "AC"]))
+    report("grep_gapped", "--gff " + desc, run(entries, ["grep", "-qg", "--gff", "AC"]))
+
+
+def bench_grep_jobs(scale):
+    """
+    Serial versus process pool regex search over many short records, in a
+    file whose byte ranges the workers read and parse themselves. The pool
+    has no more workers than there are CPUs.
+    """
+    import os
+    import tempfile
+
+    nseqs = 50000 * scale
+    f = tempfile.NamedTemporaryFile(mode="w", suffix=".fa", delete=False)
+    for i in range(nseqs):
+        f.write(">seq{}\n{}\n".format(i, random_seq(300)))
+    f.close()
+    desc = "{} x 300bp, {} CPUs".format(nseqs, smof_base._pool_size(nseqs))
+    for jobs in (1, 2, 4):
+        args = smof.parse(
+            ["grep", "-qP", "--gff", "-j", str(jobs), "A[CG]{3}T", f.name]
+        )
+        t0 = time.perf_counter()
+        args.func(args, smof_base._stream_entries(args.fh), out=NullOut())
+        seconds = time.perf_counter() - t0
+        report("grep_jobs", "--gff -j {} {}".format(jobs, desc), seconds)
+    # the CPU time left in the parent process when the pool does the work
+    # bounds the wall time on a machine with CPUs to spare
+    for pattern in ("A[CG]{3}T", "GATTACAG"):
+        args = smof.parse(["grep", "-qP", "--gff", "-j", "2", pattern])
+        searcher = smof_base.GrepSearch(args)
+        t0 = time.process_time()
+        for row in searcher._run([f.name], 1):
+            pass
+        seconds = time.process_time() - t0
+        label = "parent CPU, pool, {} {}".format(pattern, desc)
+        report("grep_jobs", label, seconds)
+    os.unlink(f.name)
+
+
+def bench_grep_count(scale):
+    """
+    Counting matches over many short reads, through FastaEntry objects and
+    straight from the header or sequence fields of a file
+    """
+    import os
+    import tempfile
+
+    nseqs = 200000 * scale
+    f = tempfile.NamedTemporaryFile(mode="w", suffix=".fa", delete=False)
+    for i in range(nseqs):
+        f.write(">read{}\n{}\n".format(i, random_seq(100)))
+    f.close()
+    desc = "{} x 100bp".format(nseqs)
+    for opts in (["-qc"], ["-qm"], ["-c"]):
+        argv = ["grep"] + opts + ["GATTACA"]
+        searcher = smof_base.GrepSearch(smof.parse(argv))
+        gen = smof_base._stream_entries([f.name])
+        t0 = time.perf_counter()
+        for x in searcher.search(gen):
+            pass
+        entries = time.perf_counter() - t0
+        args = smof.parse(argv + [f.name])
+        t0 = time.perf_counter()
+        args.func(args, None, out=NullOut())
+        fields = time.perf_counter() - t0
+        report("grep_count", "{} entries {}".format(" ".join(opts), desc), entries)
+        report("grep_count", "{} fields {}".format(" ".join(opts), desc), fields)
+    os.unlink(f.name)
+
+
+def bench_grep_iupac(scale):
+    """
+    -G IUPAC patterns (the bitmask engine, where it is used) versus the
+    equivalent regular expression, on a genome and on short reads
+    """
+    genome = [("chr1", random_seq(5000000 * scale))]
+    reads = [("read{}".format(i), random_seq(150)) for i in range(30000 * scale)]
+    for entries, desc in (
+        (genome, "{}Mb genome".format(5 * scale)),
+        (reads, "{} x 150bp".format(len(reads))),
+    ):
+        for pattern in ("TATAWAWR", "GGNCCNNNNNNNNGGNCC", "NNNNNNNN"):
+            regex = smof_base.IUPACPattern(pattern).regex().pattern
+            for opts, p in (("-qG", pattern), ("-qP", regex)):
+                argv = ["grep", opts, "--gff", p]
+                label = "{} --gff {} {}".format(opts, pattern, desc)
+                report("grep_iupac", label, run(entries, argv))
+
+
+def bench_grep_index(scale):
+    """
+    Repeated literal searches through a prebuilt suffix array index versus
+    rescanning the input each time
+    """
+    import os
+    import tempfile
+
+    nseqs = 200 * scale
+    entries = [("seq{}".format(i), random_seq(5000)) for i in range(nseqs)]
+    desc = "{} x 5kb".format(nseqs)
+    f = tempfile.NamedTemporaryFile(suffix=".smi", delete=False)
+    f.close()
+    t0 = time.perf_counter()
+    smof_base.FastaIndex.build(smof_base._stream_entries(iter(entries))).write(f.name)
+    report("grep_index", "build {}".format(desc), time.perf_counter() - t0)
+    patterns = [random_seq(12) for _ in range(20)]
+    for opts in (["--gff"], ["-m"]):
+        label = "{} x20 {}".format(" ".join(opts), desc)
+        scan = sum(run(entries, ["grep", "-q"] + opts + [p]) for p in patterns)
+        argv = ["grep", "--index", f.name] + opts
+        index = sum(run([], argv + [p]) for p in patterns)
+        report("grep_index", "scan " + label, scan)
+        report("grep_index", "index " + label, index)
+    os.unlink(f.name)
+
+
+def bench_grep_matcher(scale):
+    """
+    Per-entry cost of the compiled grep matcher over the option matrix, on
+    short records where call overhead rather than regex search dominates
+    """
+    nseqs = 50000 * scale
+    entries = [("seq{} gene=abc".format(i), random_seq(60)) for i in range(nseqs)]
+    seqs = list(smof_base._stream_entries(iter(entries)))
+    for opts, pattern in (
+        (["-q"], "GATTA"),
+        (["-qb"], "GATTA"),
+        (["-qg"], "GATTA"),
+        (["-q", "--gff"], "GATTA"),
+        (["-qb", "--gff"], "GATTA"),
+        (["-q", "--gff", "-A", 3], "GATTA"),
+        (["-qg", "--gff"], "GATTA"),
+        (["-qx"], "GATTA"),
+        (["-q", "-w", "(A.)T"], "AC"),
+        ([], "gene="),
+        (["-o"], "gene="),
+    ):
+        argv = ["grep", "-y"] + opts + [pattern]
+        matcher = smof_base.GrepSearch(smof.parse([str(x) for x in argv])).matcher
+        t0 = time.perf_counter()
+        for seq in seqs:
+            matcher(seq)
+        seconds = time.perf_counter() - t0
+        us = 1e6 * seconds / nseqs
+        label = " ".join(str(x) for x in opts + [pattern])
+        report("grep_matcher", "{} ({:.2f}us/entry)".format(label, us), seconds)
+
+
+def bench_stat_counts(scale):
+    """
+    Character composition of many short reads, summed and per sequence
+    """
+    nseqs = 200000 * scale
+    entries = [("read{}".format(i), random_seq(100, "ACGTN")) for i in range(nseqs)]
+    desc = "{} x 100bp".format(nseqs)
+    for opts in (["-c"], ["-p"], ["-C"], ["-qc"], ["-qp"]):
+        label = "{} {}".format(" ".join(opts), desc)
+        report("stat_counts", label, run(entries, ["stat"] + opts))
+
+
+def bench_stat_lengths(scale):
+    """
+    Length summary (5-number summary, mean, sd, N50) of 10^6 x scale
+    sequences, e.g. `-s 1000` for 10^9 (needs 8 bytes per sequence, twice)
+    """
+    from array import array
+
+    nseqs = 1000000 * scale
+    g = smof_base.FastaStat()
+    g.lengths = array("q", (random.randint(50, 20000) for _ in range(nseqs)))
+    desc = "{} lengths, {}MB".format(nseqs, len(g.lengths) * 8 // 2**20)
+    t0 = time.perf_counter()
+    g.get_length()
+    report("stat_lengths", desc, time.perf_counter() - t0)
+
+
+def bench_stat_approx(scale):
+    """
+    Exact versus sketched length summary of 10^6 x scale sequences, with the
+    peak memory of each (traced Python allocations)
+    """
+    import tracemalloc
+
+    nseqs = 1000000 * scale
+    lengths = [random.randint(50, 20000) for _ in range(nseqs)]
+    for approx in (False, True):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        g = smof_base.FastaStat(approx=approx)
+        for i in range(0, nseqs, 1000):
+            g._add_lengths(lengths[i : i + 1000])
+        g.get_length()
+        seconds = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        label = "{} {} lengths, peak {:.1f}MB".format(
+            "--approx" if approx else "exact", nseqs, peak / 2**20
+        )
+        report("stat_approx", label, seconds)
+
+
+def bench_stat_jobs(scale):
+    """
+    Serial versus process pool stat and sniff of a file, which the workers
+    read in byte ranges. The pool has no more workers than there are CPUs.
+    """
+    import os
+    import tempfile
+
+    nseqs = 100000 * scale
+    f = tempfile.NamedTemporaryFile(mode="w", suffix=".fa", delete=False)
+    for i in range(nseqs):
+        f.write(">read{}\n{}\n".format(i, random_seq(200)))
+    f.close()
+    desc = "{} x 200bp, {} CPUs".format(nseqs, smof_base._pool_size(nseqs))
+    for cmd in (["stat"], ["stat", "-c"], ["sniff"]):
+        for jobs in (1, 2, 4):
+            args = smof.parse(cmd + ["-j", str(jobs), f.name])
+            t0 = time.perf_counter()
+            args.func(args, smof_base._stream_entries(args.fh), out=NullOut())
+            seconds = time.perf_counter() - t0
+            label = "{} -j {} {}".format(" ".join(cmd), jobs, desc)
+            report("stat_jobs", label, seconds)
+    os.unlink(f.name)
+
+
+def bench_sniff_distinct(scale):
+    """
+    Exact versus approximate distinct sequence and header counts in sniff,
+    with the memory of the two hash tables (or HyperLogLog registers)
+    """
+    nseqs = 200000 * scale
+    entries = [("read{}".format(i), random_seq(50)) for i in range(nseqs)]
+    seqs = list(smof_base._stream_entries(iter(entries)))
+    for approx in (False, True):
+        t0 = time.perf_counter()
+        g = smof_base.sniff(seqs, approx=approx)
+        seconds = time.perf_counter() - t0
+        if approx:
+            size = len(g.seqs.registers) + len(g.headers.registers)
+        else:
+            size = 8 * (len(g.seqs.table) + len(g.headers.table))
+        label = "{} {} x 50bp, {:.0f}kB".format(
+            "--approx" if approx else "exact", nseqs, size / 1024
+        )
+        report("sniff_distinct", label, seconds)
+
+
+def bench_guess_type(scale):
+    """
+    Sequence type classification of short records from their character
+    counts versus from the ASCII lookup tables
+    """
+    from collections import Counter
+
+    nseqs = 100000 * scale
+    seqs = [
+        random_seq(100, random.choice(("ACGT", "ACGU", "ACDEFGHIKLMNPQRSTVWY")))
+        for _ in range(nseqs)
+    ]
+    desc = "{} x 100 chars".format(nseqs)
+    t0 = time.perf_counter()
+    for s in seqs:
+        smof_base._guess_type(Counter(s))
+    report("guess_type", "counts " + desc, time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    for s in seqs:
+        smof_base._guess_type(s)
+    report("guess_type", "tables " + desc, time.perf_counter() - t0)
+
+
+def bench_sniff_sample(scale):
+    """
+    Full versus sampled sniff of a file
+    """
+    import os
+    import tempfile
+
+    nseqs = 100000 * scale
+    f = tempfile.NamedTemporaryFile(mode="w", suffix=".fa", delete=False)
+    for i in range(nseqs):
+        f.write(">read{}\n{}\n".format(i, random_seq(200)))
+    f.close()
+    desc = "{} x 200bp".format(nseqs)
+    for opts in ([], ["--sample", "1000"], ["--bytes", "1M"]):
+        args = smof.parse(["sniff"] + opts + [f.name])
+        t0 = time.perf_counter()
+        args.func(args, smof_base._stream_entries(args.fh), out=NullOut())
+        seconds = time.perf_counter() - t0
+        report("sniff_sample", "{} {}".format(" ".join(opts) or "full", desc), seconds)
+    os.unlink(f.name)
+
+
+def bench_stat_cache(scale):
+    """
+    stat, sniff and wc of a file with a cold and then a warm --cache
+    """
+    import os
+    import tempfile
+
+    nseqs = 50000 * scale
+    d = tempfile.TemporaryDirectory()
+    filename = os.path.join(d.name, "a.fa")
+    with open(filename, "w") as f:
+        for i in range(nseqs):
+            f.write(">read{}\n{}\n".format(i, random_seq(200)))
+    desc = "{} x 200bp".format(nseqs)
+    for cmd in (["stat", "-c"], ["sniff"], ["wc"]):
+        for state in ("cold", "warm"):
+            args = smof.parse(cmd + ["--cache", filename])
+            t0 = time.perf_counter()
+            args.func(args, smof_base._stream_entries(args.fh), out=NullOut())
+            seconds = time.perf_counter() - t0
+            report("stat_cache", "{} {} {}".format(" ".join(cmd), state, desc), seconds)
+    d.cleanup()
+
+
+def bench_stat_hist(scale):
+    """
+    Length summary without and with both histograms (-gG), exact and --approx
+    """
+    nseqs = 200000 * scale
+    entries = [
+        ("read{}".format(i), "A" * random.randint(50, 20000)) for i in range(nseqs)
+    ]
+    desc = "{} x 50-20000bp".format(nseqs)
+    for opts in ([], ["-gG"], ["--approx"], ["--approx", "-gG"]):
+        label = "{} {}".format(" ".join(opts) or "plain", desc)
+        report("stat_hist", label, run(entries, ["stat"] + opts))
+
+
+def bench_sniff_features(scale):
+    """
+    sniff of transcript-like nucleotide sequences (open reading frames of
+    2kb) and of proteins, where the case, gap and codon tests dominate
+    """
+    import itertools
+
+    nseqs = 20000 * scale
+    codons = [
+        "".join(c)
+        for c in itertools.product("ACGT", repeat=3)
+        if "".join(c) not in smof_base.Alphabet.STOP
+    ]
+    orfs = [
+        (
+            "t{}".format(i),
+            "ATG" + "".join(random.choice(codons) for _ in range(665)) + "TAA",
+        )
+        for i in range(nseqs)
+    ]
+    prots = [
+        ("p{}".format(i), "M" + random_seq(700, "ACDEFGHIKLMNPQRSTVWY") + "*")
+        for i in range(nseqs)
+    ]
+    for entries, desc in ((orfs, "2kb ORFs"), (prots, "700aa proteins")):
+        label = "{} x {}".format(nseqs, desc)
+        report("sniff_features", label, run(entries, ["sniff"]))
+
+
+def bench_stat_table(scale):
+    """
+    Per-sequence metrics table, as text and as a .npz column bundle, against
+    the per-sequence character counts it replaces (stat -qcm)
+    """
+    import os
+    import tempfile
+
+    nseqs = 50000 * scale
+    entries = [
+        ("read{}".format(i), random_seq(1000, "ACGTNacgt")) for i in range(nseqs)
+    ]
+    desc = "{} x 1000bp".format(nseqs)
+    d = tempfile.TemporaryDirectory()
+    npz = os.path.join(d.name, "table.npz")
+    for opts in (["-qcm"], ["--table"], ["--table-file", npz]):
+        label = "{} {}".format(opts[0], desc)
+        report("stat_table", label, run(entries, ["stat"] + opts))
+    d.cleanup()
+
+
+def bench_uniq(scale):
+    """
+    uniq of 1kb entries, a quarter of them repeats, with the memory of the
+    digest index it holds in place of the entries (or, for -f, the headers)
+    """
+    nseqs = 100000 * scale
+    entries = [("s{}".format(i), random_seq(1000)) for i in range(nseqs * 3 // 4)]
+    entries += random.sample(entries, nseqs - len(entries))
+    random.shuffle(entries)
+    seqs = list(smof_base._stream_entries(iter(entries)))
+    index = smof_base.DigestIndex()
+    for seq in seqs:
+        index.add(smof_base._digest128(seq.header, seq.seq))
+    size = 8 * (len(index.high) + len(index.low)) + 4 * len(index.slots)
+    desc = "{} x 1000bp ({}MB), index {:.1f}MB".format(
+        nseqs, nseqs * 1000 // 2**20, size / 2**20
+    )
+    for opts in ([], ["-c"], ["-d"], ["-f"]):
+        label = "{} {}".format(" ".join(opts) or "default", desc)
+        report("uniq", label, run(entries, ["uniq"] + opts))
+
+
+def bench_uniq_external(scale):
+    """
+    uniq and pack in memory versus partitioned through temporary files
+    (--memory), for 200bp entries, a quarter of them repeated sequences
+    """
+    nseqs = 100000 * scale
+    seqs = [random_seq(200) for _ in range(nseqs * 3 // 4)]
+    seqs += random.sample(seqs, nseqs - len(seqs))
+    entries = [("s{}".format(i), seq) for i, seq in enumerate(seqs)]
+    desc = "{} x 200bp".format(nseqs)
+    for opts in (["-c"], ["-p"]):
+        for memory in ([], ["--memory", "4M"]):
+            label = "{} {}".format(" ".join(opts + memory), desc)
+            report("uniq_external", label, run(entries, ["uniq"] + opts + memory))
+
+
+def bench_sort_external(scale):
+    """
+    sort by header and by length in memory versus through sorted runs in
+    temporary files (--memory), for 100-300bp entries
+    """
+    nseqs = 100000 * scale
+    entries = [
+        ("s{}".format(random.randrange(nseqs)), random_seq(random.randint(100, 300)))
+        for _ in range(nseqs)
+    ]
+    desc = "{} x 100-300bp".format(nseqs)
+    for opts in ([], ["-l"]):
+        for memory in ([], ["--memory", "4M"]):
+            label = "{} {}".format(" ".join(opts + memory), desc).strip()
+            report("sort_external", label, run(entries, ["sort"] + opts + memory))
+
+
+def bench_sort_file(scale):
+    """
+    sort -l of a file of contigs, reading all the entries into memory (from
+    a stream) versus holding only their keys and offsets (from the file),
+    with the peak memory allocated by Python
+    """
+    import os
+    import tempfile
+    import tracemalloc
+
+    nseqs = 200 * scale
+    f = tempfile.NamedTemporaryFile(mode="w", suffix=".fa", delete=False)
+    for i in range(nseqs):
+        seq = random_seq(1000) * random.randint(20, 120)
+        f.write(">ctg{}\n".format(i))
+        for j in range(0, len(seq), 60):
+            f.write(seq[j : j + 60] + "\n")
+    f.close()
+    desc = "{} x 20-120kb".format(nseqs)
+    for source in ("stream", "file"):
+        args = smof.parse(["sort", "-l", f.name])
+        fh = open(f.name)
+        if source == "stream":
+            args.fh = [fh]
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        args.func(args, smof_base._stream_entries(fh), out=NullOut())
+        seconds = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        fh.close()
+        label = "{} {} ({:.1f}MB)".format(source, desc, peak / 2**20)
+        report("sort_file", label, seconds)
+    os.unlink(f.name)
+
+
+BENCHMARKS = {
+    "grep_gapped": bench_grep_gapped,
+    "grep_jobs": bench_grep_jobs,
+    "grep_count": bench_grep_count,
+    "grep_iupac": bench_grep_iupac,
+    "grep_index": bench_grep_index,
+    "grep_matcher": bench_grep_matcher,
+    "stat_counts": bench_stat_counts,
+    "stat_lengths": bench_stat_lengths,
+    "stat_approx": bench_stat_approx,
+    "stat_jobs": bench_stat_jobs,
+    "sniff_distinct": bench_sniff_distinct,
+    "guess_type": bench_guess_type,
+    "sniff_sample": bench_sniff_sample,
+    "stat_cache": bench_stat_cache,
+    "stat_hist": bench_stat_hist,
+    "sniff_features": bench_sniff_features,
+    "stat_table": bench_stat_table,
+    "uniq": bench_uniq,
+    "uniq_external": bench_uniq_external,
+    "sort_external": bench_sort_external,
+    "sort_file": bench_sort_file,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time smof on synthetic input")
+    parser.add_argument("names", nargs="*", help="benchmarks to run (default: all)")
+    parser.add_argument("-s", "--scale", type=int, default=1, help="size multiplier")
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    args = parser.parse_args()
+
+    for name in args.names:
+        if name not in BENCHMARKS:
+            sys.exit("Unknown benchmark '{}'".format(name))
+
+    random.seed(args.seed)
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name](args.scale)
@@ -7,6 +7,11 @@ import argparse
 import sys
 import tempfile
 import math
+import bisect
+import functools
+import json
+import random
+import itertools
 import os
 from collections import Counter
 from io import StringIO
@@ -349,6 +354,8 @@ class TestFastaDescription(unittest.TestCase):
         self.assertFalse(sense("CCCTAACCCAAA"))
         self.assertFalse(sense("ATGTAACCCAAA"))
         self.assertFalse(sense("ATGCCCTAATAA"))
+        self.assertFalse(sense("AUGUAACCCAAA"))
+        self.assertTrue(sense("CTAACTAAGTAA"))
 
     def test_is_triple(self):
         triple = lambda s: smof.FastaDescription._is_triple(s)
@@ -376,6 +383,11 @@ class TestUtilities(unittest.TestCase):
         self.assertEqual(smof_base._counter_caser(Counter("Aaa")), {"A": 3})
         self.assertEqual(smof_base._counter_caser(Counter("Aaa"), True), {"a": 3})
 
+    def test_char_set(self):
+        for text in ("", "ACGT", "acgT-.*", "ACéGT\udcff"):
+            self.assertEqual(smof_base._char_set(text * 200), set(text))
+            self.assertEqual(smof_base._char_set(text, short=0), set(text))
+
     def test_sum_lower(self):
         self.assertEqual(smof_base._sum_lower(Counter("AaaFf")), 3)
         self.assertEqual(smof_base._sum_lower(Counter("AAAFF")), 0)
@@ -434,6 +446,18 @@ class TestUtilities(unittest.TestCase):
         # But if one unambiguous aa is added ('F')
         self.assertEqual(smof_base._guess_type("FRYSWKMDBHV"), "prot")
 
+    def test_guess_type_tables(self):
+        # the ASCII fast path classifies as the character counts do
+        r = random.Random(0)
+        alphabet = "ACGTUNacgtun.-_RYSWKMDBHVrysEFILQPXJZ*efilqpxjz BO!"
+        for _ in range(5000):
+            chars = r.sample(alphabet, r.randint(1, 8))
+            s = "".join(r.choice(chars) for _ in range(r.randint(0, 30)))
+            self.assertEqual(
+                smof_base._guess_type(s), smof_base._guess_type(Counter(s))
+            )
+        self.assertEqual(smof_base._guess_type("GATÉ"), "illegal")
+
     def test_counting_number(self):
         import argparse
 
@@ -625,6 +649,20 @@ class TestFasta(unittest.TestCase):
     def test_no_sequence(self):
         self.assertTrue(self.is_valid(self.no_sequence))
 
+    def test_read_fields(self):
+        for lines in (
+            self.good,
+            self.spaced,
+            self.interspersed_comments,
+            self.empty_seq,
+            self.empty_last_seq,
+        ):
+            seqs = list(smof_base.read_fasta_str(lines))
+            headers = smof_base._read_fasta_fields(lines)
+            self.assertEqual([f.text for f in headers], [s.header for s in seqs])
+            residues = smof_base._read_fasta_fields(lines, sequence=True)
+            self.assertEqual([f.text for f in residues], [s.seq for s in seqs])
+
 
 class TestMd5sum(unittest.TestCase):
     def setUp(self):
@@ -871,6 +909,71 @@ class TestHeaderGrep(unittest.TestCase):
             get_output(self.headers, ["grep", "-X", "gg sco 12"]), [">gg sco 12", "A"]
         )
 
+    def test_max_count(self):
+        self.assertEqual(
+            get_output(self.headers, ["grep", "-y", "--max-count", 1, "g"]),
+            [">gg sco 12", "A"],
+        )
+        self.assertEqual(
+            get_output(self.headers, ["grep", "-yv", "--max-count", 1, "sco"]),
+            [">gg bob 48a", "A"],
+        )
+
+    def test_files_with_matches(self):
+        filenames = []
+        for text in (">a\nGAT\n>b\nGAT\n", ">c\nCCC\n", ">d\nGAT\n"):
+            f = tempfile.NamedTemporaryFile(mode="w", delete=False)
+            f.write(text)
+            f.close()
+            filenames.append(f.name)
+
+        def search(**kwargs):
+            gen = smof_base.open_fasta(filenames)
+            return list(
+                smof_base.grep(gen, pattern="GAT", match_sequence=True, **kwargs)
+            )
+
+        self.assertEqual(search(files_with_matches=True), [filenames[0], filenames[2]])
+        self.assertEqual(search(files_without_match=True), [filenames[1]])
+        self.assertEqual(
+            search(count_matches=True, max_count=1),
+            ["{}\t{}".format(n, f) for n, f in zip((1, 0, 1), filenames)],
+        )
+        for filename in filenames:
+            os.unlink(filename)
+
+    def test_preserve_color_files(self):
+        f = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        f.write(">a\nAC\033[1;31mGT\033[0mAA\n")
+        f.close()
+
+        def run(argv):
+            args = smof.parse(argv + [f.name])
+            out = StringIO()
+            args.func(args, None, out=out)
+            return out.getvalue().split("\n")[:2]
+
+        # the color is stripped before matching
+        self.assertEqual(run(["grep", "-qS", "CGT"]), [">a", "ACGTAA"])
+        self.assertEqual(run(["grep", "-qS", "-c", "CGT"]), ["1", ""])
+        self.assertEqual(run(["grep", "-qS", "-m", "CGT"]), ["1", ""])
+        os.unlink(f.name)
+
+    def test_settled_files_not_read(self):
+        read = []
+
+        def entries(filename):
+            for i in range(5):
+                read.append((filename, i))
+                yield smof.FastaEntry("s%d" % i, "GAT", filename=filename)
+
+        for opts in ({"max_count": 2}, {"files_with_matches": True}):
+            del read[:]
+            inputs = [entries("x"), entries("y")]
+            list(smof_base.grep(inputs, pattern="GAT", match_sequence=True, **opts))
+            n = opts.get("max_count", 1)
+            self.assertEqual(read, [(f, i) for f in "xy" for i in range(n)])
+
 
 class TestSequenceGrep(unittest.TestCase):
     def setUp(self):
@@ -917,6 +1020,46 @@ class TestSequenceGrep(unittest.TestCase):
                     get_output([">{}".format(h), compl], ["grep", "-qyG", h]), [""]
                 )
 
+    def test_ambiguous_nucl_target(self):
+        # ambiguity codes in the sequence are honoured for plain IUPAC patterns
+        self.assertEqual(
+            get_output([">a", "GANNCA"], ["grep", "-qyG", "GATACA"]), [">a", "GANNCA"]
+        )
+        self.assertEqual(
+            get_output([">a", "GARYCA"], ["grep", "-qyG", "--gff", "RTM"])[0].split(
+                "\t"
+            )[3:5],
+            ["3", "5"],
+        )
+        self.assertEqual(get_output([">a", "GARYCA"], ["grep", "-qyG", "GTT"]), [""])
+
+    def test_iupac_pattern(self):
+        p = smof.IUPACPattern("RYN")
+        self.assertEqual([m.span() for m in p.finditer("AATGCAcgtT")], [(1, 4), (5, 8)])
+        self.assertEqual(p.search("GGGACN").span(), (3, 6))
+        self.assertEqual(p.match("GGGACN"), None)
+        self.assertEqual(p.search("GGG-CC"), None)
+        # long sequences use the bitmask engine (given numpy), which must
+        # agree with the equivalent regex
+        rng = random.Random(3)
+        text = "".join(rng.choice("ACGTNRYwsu-X") for _ in range(5000))
+        for pattern in ("RYN", "GATACA", "CANNTGWW", "N"):
+            p = smof.IUPACPattern(pattern)
+            self.assertEqual(
+                [m.span() for m in p.finditer(text)],
+                [m.span() for m in p.regex().finditer(text)],
+            )
+            self.assertEqual(p.search(text).span(), p.regex().search(text).span())
+            hits = p.hits(text)
+            self.assertEqual(
+                [i for i in range(len(text)) if hits >> i & 1],
+                [i for i in range(len(text)) if p.regex().match(text, i)],
+            )
+        self.assertFalse(smof.IUPACPattern("RYN").bitmask)
+        self.assertTrue(smof.IUPACPattern.is_iupac("acgtuRYN"))
+        self.assertFalse(smof.IUPACPattern.is_iupac("R{4}Y"))
+        self.assertFalse(smof.IUPACPattern.is_iupac(""))
+
     def test_ambiguous_nucl_regex(self):
         self.assertEqual(
             get_output(self.seqs, ["grep", "-qyG", "R{4}Y"]), [">a", "AAGATACA"]
@@ -1044,6 +1187,25 @@ class TestSequenceGrep(unittest.TestCase):
             get_output([">a", "G--ACF-ADE"], ["grep", "-qgyo", "ACF"])[1], "ACF"
         )
 
+    def test_gapped_search_gff(self):
+        self.assertEqual(
+            [
+                x.split("\t")[3:5]
+                for x in get_output(
+                    [">a", "-AC--AC-A--C-"], ["grep", "-qg", "--gff", "AC"]
+                )
+            ],
+            [["2", "3"], ["6", "7"], ["9", "12"]],
+        )
+
+    def test_gapped_span(self):
+        table = smof_base._gap_table("--GA--C-F-ADE")
+        self.assertEqual(table, ([0, 2, 3, 4], [2, 4, 5, 6]))
+        self.assertEqual(smof_base._gapped_span(table, 0, 1), (2, 3))
+        self.assertEqual(smof_base._gapped_span(table, 1, 4), (3, 9))
+        self.assertEqual(smof_base._gapped_span(table, 4, 7), (10, 13))
+        self.assertEqual(smof_base._gap_table("GATACA"), ([], []))
+
     def test_gapped_search_only_revcom(self):
         self.assertEqual(
             get_output([">a", "GATA-CA"], ["grep", "-qyorg", "GTA"])[1], "TA-C"
@@ -1069,6 +1231,131 @@ class TestSequenceGrep(unittest.TestCase):
             get_output(self.seqs, ["grep", "-qX", "GAACATAACAT"]), [">b", "GAACATAACAT"]
         )
 
+    def test_count_fields(self):
+        f = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        f.write("\n".join(self.seqs))
+        f.close()
+        for opts in (["-c"], ["-m"], ["-cm"], ["-cb"], ["-cmr"], ["-cv"]):
+            args = smof.parse(["grep", "-q"] + opts + ["aa"])
+            searcher = smof_base.GrepSearch(args)
+            fields = smof_base._stream_fields(f.name, sequence=True)
+            self.assertEqual(
+                [str(x) for x in searcher.count(fields)],
+                get_output(self.seqs, ["grep", "-q"] + opts + ["aa"]),
+            )
+        os.unlink(f.name)
+
+    def test_index(self):
+        gen = smof_base._stream_entries(smof_base.read_fasta_str(self.seqs))
+        index = smof_base.FastaIndex.build(gen)
+        text = bytes(index.text)
+        self.assertEqual(
+            [text[i:] for i in index.sa], sorted(text[i:] for i in range(len(text)))
+        )
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.close()
+        index.write(f.name)
+        for opts in (
+            ["--gff"],
+            ["-c"],
+            ["-cm"],
+            ["-b", "--gff"],
+            ["-r", "-m"],
+            ["-b", "--gff", "-A", 2, "-B", 1],
+        ):
+            for pattern in ("aa", "ACAT", "TT", "GATTACA"):
+                self.assertEqual(
+                    get_output(
+                        self.seqs, ["grep", "--index", f.name] + opts + [pattern]
+                    ),
+                    get_output(self.seqs, ["grep", "-q"] + opts + [pattern]),
+                )
+        os.unlink(f.name)
+
+    def test_index_source(self):
+        d = tempfile.TemporaryDirectory()
+        fasta = os.path.join(d.name, "a.fa")
+        with open(fasta, "w") as f:
+            f.write(">a\nGATTACA\n")
+        index = os.path.join(d.name, "a.fa.smi")
+        smof_base.FastaIndex.build(smof_base.read_fasta(fasta), source=fasta).write(
+            index
+        )
+
+        def run(argv):
+            args = smof.parse(argv)
+            out = StringIO()
+            args.func(args, None, out=out)
+            return out.getvalue().split("\n")[0]
+
+        self.assertEqual(run(["grep", "-c", "--index", index, "TTA"]), "1")
+        # the input is not read, so it cannot be given
+        self.assertRaises(
+            SystemExit, run, ["grep", "-c", "--index", index, "TTA", fasta]
+        )
+        # and the index is refused once its source has changed
+        with open(fasta, "a") as f:
+            f.write(">b\nTTA\n")
+        self.assertRaises(SystemExit, run, ["grep", "-c", "--index", index, "TTA"])
+        d.cleanup()
+
+    def test_suffix_array(self):
+        rng = random.Random(4)
+        texts = [b"", b"A", b"AAAA", b"A\x00\x00", b"\x00\x00A\x00\x00\xff"]
+        for _ in range(50):
+            n = rng.randint(0, 80)
+            texts.append(bytes(rng.choice(b"AAC\x00") for _ in range(n)))
+        texts.append(bytes(rng.choice(b"ACGT") for _ in range(500)) * 3)
+        for text in texts:
+            expected = smof_base._suffix_array_lists(text)
+            for block in (1, 7, 2**20):
+                sa = smof_base._suffix_array(text, block=block)
+                self.assertEqual(list(sa), expected)
+
+    def test_jobs(self):
+        batch_size = smof_base.GrepSearch.batch_size
+        smof_base.GrepSearch.batch_size = 2
+        try:
+            for opts in (["-q"], ["--gff"], ["-qo"], ["-qc"], ["-qm"], ["-qcm"]):
+                self.assertEqual(
+                    get_output(self.seqs, ["grep", "-y", "-j", 2] + opts + ["aa"]),
+                    get_output(self.seqs, ["grep", "-y"] + opts + ["aa"]),
+                )
+        finally:
+            smof_base.GrepSearch.batch_size = batch_size
+
+    def test_jobs_files(self):
+        filenames = []
+        for seqs in (self.seqs, self.seqs[4:], [">x", "CCC"]):
+            f = tempfile.NamedTemporaryFile(mode="w", delete=False)
+            f.write("\n".join(seqs))
+            f.close()
+            filenames.append(f.name)
+
+        def show(x):
+            return (x.header, x.seq) if isinstance(x, smof.FastaEntry) else x
+
+        for opts in (
+            ["-q"],
+            ["-qv"],
+            ["--gff"],
+            ["-qc"],
+            ["-qcv"],
+            ["-qm"],
+            ["-l"],
+            ["-L"],
+            ["-q", "--max-count", 1],
+        ):
+            argv = [str(x) for x in ["grep", "-y", "-j", 2] + opts + ["aa"]]
+            searcher = smof_base.GrepSearch(smof.parse(argv))
+            serial = searcher.search([smof_base._stream_entries(x) for x in filenames])
+            # the workers read byte ranges of the files, here in a pool of
+            # one whatever the number of CPUs
+            ranges = searcher._run(filenames, len(filenames))
+            self.assertEqual(list(map(show, ranges)), list(map(show, serial)))
+        for filename in filenames:
+            os.unlink(filename)
+
     def test_fastain(self):
         f = tempfile.NamedTemporaryFile(delete=False)
         f.write(b">a\nGAT")
@@ -1116,6 +1403,11 @@ class TestGrepBadCombinations(unittest.TestCase):
     def test_only_matching_incompatible_options(self):
         self.assertRaises(SystemExit, get_output, self.seq, ["grep", "-ov", "a"])
 
+    def test_index_incompatible_options(self):
+        for opts in (["-cP"], ["-cG"], ["-cI"], ["-cv"], ["-cx"], ["-q"]):
+            argv = ["grep", "--index", "x.smi"] + opts + ["a"]
+            self.assertRaises(SystemExit, get_output, self.seq, argv)
+
     def test_exact_incompatible_options(self):
         self.assertRaises(SystemExit, get_output, self.seq, ["grep", "-PX", "a"])
         self.assertRaises(SystemExit, get_output, self.seq, ["grep", "-GX", "a"])
@@ -1328,6 +1620,57 @@ class TestSort(unittest.TestCase):
             self.regex_numeric,
         )
 
+    def test_external_sort(self):
+        for opts, expected in [
+            ([], self.default),
+            (["-r"], self.default_reverse),
+            (["-l"], self.length),
+            (["-x", "d=(\d+)", "-n"], self.regex_numeric),
+        ]:
+            self.assertEqual(
+                get_output(self.unsorted, ["sort", "--memory", "8"] + opts), expected
+            )
+        # enough runs for _merge_runs to merge a level, with ties kept in
+        # input order both ways
+        seqs = [smof_base.FastaEntry("s%d" % i, "A" * (i % 7)) for i in range(300)]
+        for reverse in (False, True):
+            out = smof_base.sort_entries(
+                iter(seqs), key=lambda x: len(x.seq), reverse=reverse, memory=40
+            )
+            self.assertEqual(
+                [s.header for s in out],
+                [
+                    s.header
+                    for s in sorted(seqs, key=lambda x: len(x.seq), reverse=reverse)
+                ],
+            )
+
+    def test_file_sort(self):
+        # the entries are located in the files and read back from them
+        lines = ["# comment", ">", ">b", "AC", "", "GT", " >a x", "TTT", ">", "A"]
+        lines += self.unsorted + [">", "#", ">c", ">"]
+        files = []
+        for text in ("\n".join(lines), "\r\n".join(self.unsorted), ""):
+            f = tempfile.NamedTemporaryFile(mode="w", delete=False, newline="")
+            f.write(text)
+            f.close()
+            files.append(f.name)
+        for opts in ([], ["-r"], ["-l"], ["-lr"]):
+            outputs = []
+            for fh in (files, [lines]):
+                args = smof.parse(["sort"] + opts + files)
+                args.fh = fh
+                gen = itertools.chain(
+                    smof_base.read_fasta_str(lines),
+                    smof_base.read_fasta_str(self.unsorted),
+                )
+                out = StringIO()
+                args.func(args, gen, out=out)
+                outputs.append(out.getvalue())
+            self.assertEqual(outputs[0], outputs[1])
+        for name in files:
+            os.unlink(name)
+
 
 class TestStatSeqFun(unittest.TestCase):
     def setUp(self):
@@ -1362,6 +1705,103 @@ class TestStatSeqFun(unittest.TestCase):
             ],
         )
 
+    def test_char_counts(self):
+        texts = ["ACGTNacgt--", "", "PÉPTIDE"]
+        for subset in (texts, texts[:2]):
+            chars, table = smof_base._char_counts(subset)
+            self.assertEqual(chars, sorted(set("".join(subset))))
+            for text, row in zip(subset, table.tolist()):
+                self.assertEqual(Counter(dict(zip(chars, row))), Counter(text))
+            chars, table = smof_base._char_counts(subset, by_entry=False)
+            self.assertEqual(dict(zip(chars, table.tolist())), Counter("".join(subset)))
+
+    def test_stat_seq_unicode(self):
+        self.assertEqual(
+            get_output([">a", "aÉé", ">b", "É"], ["stat", "-qcm", "-d", ","]),
+            ["seqid,masked,A,É", "a,1,1,2", "b,0,0,1"],
+        )
+
+    def test_stat_table(self):
+        fna = [">a x", "ACGTNNNacgt", ">b", "", ">c", "NNNNgg", ">e", "--AC"]
+        self.assertEqual(
+            get_output(fna, ["stat", "--table", "-d", ","]),
+            [
+                "seqid,length,gc,n_fraction,masked,entropy,max_n_run",
+                "a,11,0.5,0.2727272727272727,0.36363636363636365,2.2998963911678914,3",
+                "b,0,nan,nan,nan,nan,0",
+                "c,6,1.0,0.6666666666666666,0.3333333333333333,0.9182958340544896,4",
+                "e,4,0.5,0.0,0.0,1.5,0",
+            ],
+        )
+        # the same metrics from the table _char_counts makes without numpy
+        texts = fna[1::2]
+        chars = sorted(set("".join(texts)))
+        table = [[text.count(c) for c in chars] for text in texts]
+        for metric in smof_base.TABLE_METRICS:
+            expected = smof_base._table_metric(
+                metric, texts, *smof_base._char_counts(texts)
+            )
+            got = smof_base._table_metric(metric, texts, chars, table)
+            if not isinstance(expected, list):
+                expected = expected.tolist()
+            # str, since nan != nan
+            self.assertEqual(str(got), str(expected))
+        for opts in (["-q"], ["--cache"], ["--cache-dir", "cache"]):
+            self.assertRaises(SystemExit, get_output, fna, ["stat", "--table"] + opts)
+
+    def test_stat_table_file(self):
+        import numpy
+
+        fna = [">a", "ACGTNNNacgt", ">b", "GC"]
+        d = tempfile.TemporaryDirectory()
+        for ext in (".npy", ".npz"):
+            path = os.path.join(d.name, "table" + ext)
+            get_output(fna, ["stat", "--table-file", path, "--metrics", "length,gc"])
+            table = numpy.load(path)
+            self.assertEqual(table["seqid"].tolist(), ["a", "b"])
+            self.assertEqual(table["length"].tolist(), [11, 2])
+            self.assertEqual(table["gc"].tolist(), [0.5, 1.0])
+            if ext == ".npz":
+                self.assertEqual(table.files, ["seqid", "length", "gc"])
+                table.close()
+        d.cleanup()
+
+    def test_stat_seq_alphabet(self):
+        self.assertEqual(
+            get_output(self.fna, ["stat", "-qc", "--alphabet", "dna", "-d", ","]),
+            [
+                "seqid,-,.,A,B,C,D,G,H,K,M,N,R,S,T,U,V,W,Y,_,other",
+                "A,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0",
+                "B,0,0,2,0,2,0,2,0,0,0,0,0,0,2,0,0,0,0,0,0",
+                "C,0,0,1,0,0,0,0,0,0,0,1,0,0,1,0,0,0,1,0,0",
+            ],
+        )
+        header, row = get_output([">a", "ACJ-x"], ["stat", "-qcI", "--alphabet", "dna"])
+        row = dict(zip(header.split("\t"), row.split("\t")))
+        self.assertEqual([row[c] for c in "AC-a"], ["1", "1", "1", "0"])
+        self.assertEqual(row["other"], "2")
+
+    def test_stat_seq_spill(self):
+        seqs = [smof_base.FastaEntry(str(i), "ACGTa"[: i % 5 + 1]) for i in range(2500)]
+        for opts in ({"counts": True}, {"proportion": True, "count_lower": True}):
+            self.assertEqual(
+                list(smof_base.stat_seq(seqs, spill=10, **opts)),
+                list(smof_base.stat_seq(seqs, **opts)),
+            )
+
+    def test_add_batch(self):
+        seqs = [
+            smof_base.FastaEntry("a", "ACGTNacgt--"),
+            smof_base.FastaEntry("b", "PÉPTIDE"),
+            smof_base.FastaEntry("c", "GATACA"),
+        ]
+        g = smof_base.FastaStat()
+        g.add_batch(seqs[:1])
+        g.add_batch(seqs[1:])
+        g.add_seq(smof_base.FastaEntryStat(seqs[2]))
+        self.assertEqual(g.counts, Counter("".join(s.seq for s in seqs + seqs[2:])))
+        self.assertEqual(list(g.lengths), [11, 7, 6, 6])
+
 
 class TestStatFileFun(unittest.TestCase):
     def setUp(self):
@@ -1379,6 +1819,365 @@ class TestStatFileFun(unittest.TestCase):
             ],
         )
 
+    def test_stat_file_approx(self):
+        # small inputs fit in the sketch uncompacted, so nothing is estimated
+        self.assertEqual(
+            get_output(self.fna, ["stat", "--approx"]),
+            get_output(self.fna, ["stat"]),
+        )
+        self.assertEqual(get_output([], ["stat", "--approx"]), ["nchars:"])
+        self.assertEqual(
+            get_output(self.fna, ["stat", "--approx", "-gG"]),
+            get_output(self.fna, ["stat", "-gG"]),
+        )
+
+    def test_stat_file_hist(self):
+        fna = self.fna + [">D", ""]
+        g = smof_base.stat_file(smof_base.read_fasta(StringIO("\n".join(fna))))
+        # lengths 0, 1, 4 and 8 in columns of width 2; zero has no log2
+        self.assertEqual(
+            g.get_hist(height=2, width=4).split("\n"), ["|O   |", "|O OO|"]
+        )
+        self.assertEqual(g.get_hist(height=1, width=3, log=True).split("\n"), ["|* O|"])
+        self.assertEqual(
+            smof_base.FastaStat().get_hist(height=1, width=3).split("\n"), ["|   |"]
+        )
+
+    def test_length_histogram(self):
+        lengths = [0, 1, 1023, 1024, 1025, 2047, 2048, 4099, 10**6, 2**40 + 5]
+        hist = smof_base.LengthHistogram()
+        for i in range(30):
+            hist.update(lengths)
+        self.assertEqual(sum(c for i, c in hist.items()), len(lengths) * 30)
+        ranges = [hist.bucket_range(i) for i, c in hist.items()]
+        for x in lengths:
+            ((a, b),) = [(a, b) for a, b in ranges if a <= x <= b]
+            self.assertTrue(x < 1024 and a == b or (b - a + 1) / a <= 1 / 512)
+        copy = smof_base.LengthHistogram.from_dict(
+            json.loads(json.dumps(hist.to_dict()))
+        )
+        self.assertEqual(
+            copy.merge(hist).items(), [(i, 2 * c) for i, c in hist.items()]
+        )
+
+    def test_stat_file_merge(self):
+        fna = self.fna + [">D", "GATACA", ">E", "GGGGCC"]
+        parts = (fna[:4], fna[4:])
+        for opts in ([], ["-c"], ["--approx"], ["-cp", "--approx"]):
+            paths = []
+            for part in parts:
+                f = tempfile.NamedTemporaryFile(mode="w", delete=False)
+                f.write(get_output(part, ["stat", "--partial"] + opts)[0])
+                f.close()
+                paths.append(f.name)
+            merged = smof.parse(["stat", "--merge"] + opts + paths)
+            out = StringIO()
+            merged.func(merged, None, out=out)
+            self.assertEqual(
+                out.getvalue().strip().split("\n"), get_output(fna, ["stat"] + opts)
+            )
+            if not opts:
+                merged = smof.parse(["stat", "--merge", "-c"] + paths)
+                self.assertRaises(SystemExit, merged.func, merged, None, out=out)
+            for path in paths:
+                os.unlink(path)
+
+    def test_stat_file_jobs(self):
+        fna = self.fna + [">", ">D", "", "# comment", " >E", "GAT", "ACA", ">"]
+        f = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        f.write("\n".join(fna))
+        f.close()
+        expected = [(s.header, s.seq) for s in smof_base.read_fasta(f.name)]
+        size = os.path.getsize(f.name)
+        for step in (1, 3, 10, size):
+            observed = []
+            for start in range(0, size, step):
+                end = min(start + step, size)
+                observed += smof_base._read_fasta_range(f.name, start, end)
+            self.assertEqual([(s.header, s.seq) for s in observed], expected)
+        for opts in ([], ["-c"], ["-cp", "--approx"]):
+            args = smof.parse(["stat", "-j", "2", f.name] + opts)
+            out = StringIO()
+            args.func(args, None, out=out)
+            self.assertEqual(
+                out.getvalue().strip().split("\n"), get_output(fna, ["stat"] + opts)
+            )
+            self.assertEqual(
+                get_output(fna, ["stat", "-j", 2] + opts),
+                get_output(fna, ["stat"] + opts),
+            )
+        # a file this small is summarized without a pool, so run one directly
+        worker = functools.partial(smof_base.stat_file, count_characters=True)
+        g = smof_base.FastaStat()
+        for part in smof_base._parallel_parts(worker, [f.name, f.name], 2):
+            g.merge(part)
+        serial = smof_base.stat_file(
+            smof_base.read_fasta(f.name), count_characters=True
+        )
+        self.assertEqual(g.nseqs, 2 * serial.nseqs)
+        self.assertEqual(g.counts, serial.counts + serial.counts)
+        self.assertEqual(smof_base._pool_size(4, f.name), 1)
+        self.assertEqual(smof_base._pool_size(1), 1)
+        self.assertLessEqual(smof_base._pool_size(1000), os.cpu_count())
+        os.unlink(f.name)
+
+    def test_sniff_merge(self):
+        fna = self.fna + [">A", "ATNY", ">D", "MPEPTIDE*"]
+        a = smof_base.sniff(smof_base.read_fasta_str(fna[:4]))
+        b = smof_base.sniff(smof_base.read_fasta_str(fna[4:]))
+        b = smof_base.FastaDescription.from_dict(json.loads(json.dumps(b.to_dict())))
+        self.assertEqual(
+            str(a.merge(b)), str(smof_base.sniff(smof_base.read_fasta_str(fna)))
+        )
+
+
+class TestDistinctCounts(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(1)
+        hashes = [r.getrandbits(64) for _ in range(20000)]
+        self.hashes = hashes + hashes[:5000] + [0, 1]
+
+    def test_compact_hash_set(self):
+        hashes = smof_base.CompactHashSet(capacity=4)
+        for h in self.hashes:
+            hashes.add(h)
+        # zero is stored as one
+        self.assertEqual(len(hashes), len(set(self.hashes) | {1}) - 1)
+        self.assertEqual(set(hashes), set(self.hashes) - {0})
+        copy = smof_base.CompactHashSet.from_dict(hashes.to_dict())
+        self.assertEqual(set(copy.merge(hashes)), set(hashes))
+
+    def test_hyperloglog(self):
+        a = smof_base.HyperLogLog()
+        b = smof_base.HyperLogLog()
+        for h in self.hashes[:12000]:
+            a.add(h)
+        for h in self.hashes[12000:]:
+            b.add(h)
+        b = smof_base.HyperLogLog.from_dict(json.loads(json.dumps(b.to_dict())))
+        n = len(set(self.hashes))
+        self.assertAlmostEqual(len(a.merge(b)) / n, 1, delta=0.03)
+        small = smof_base.HyperLogLog()
+        for h in self.hashes[:100]:
+            small.add(h)
+        self.assertAlmostEqual(len(small), 100, delta=2)
+
+    def test_sniff_approx(self):
+        fna = [">a", "ACGT", ">b", "ACGT", ">a", "GGTT"]
+        self.assertEqual(
+            get_output(fna, ["sniff", "--approx"])[:2],
+            ["about 2 uniq sequences (3 total)", "about 2 uniq headers"],
+        )
+        self.assertEqual(
+            get_output(fna, ["sniff"])[:2],
+            ["2 uniq sequences (3 total)", "WARNING: headers are not unique (2/3)"],
+        )
+        self.assertEqual(
+            get_output([">é", "ACéGT", ">é", "ACéGT"], ["sniff"])[:2],
+            ["1 uniq sequences (2 total)", "WARNING: headers are not unique (1/2)"],
+        )
+
+
+class TestSniffSample(unittest.TestCase):
+    def setUp(self):
+        self.fna = []
+        for i in range(200):
+            self.fna += [">s{}".format(i), "ACGT" * (i % 7) or "MPEP"]
+        f = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        f.write("\n".join(self.fna))
+        f.close()
+        self.filename = f.name
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_sample_whole_file(self):
+        full = smof_base.sniff(smof_base.read_fasta(self.filename))
+        sample = smof_base.sniff_sample(self.filename, nbytes=10**6)
+        for name in ("ntype", "ncase", "nfeat", "pfeat", "ufeat"):
+            self.assertEqual(getattr(sample, name), getattr(full, name))
+
+    def test_sample_offsets(self):
+        headers = [h[1:] for h in self.fna[0::2]]
+        seqs = list(smof_base._sample_files([self.filename], nseqs=50))
+        self.assertEqual(len(seqs), 50)
+        self.assertEqual(len(set(s.header for s in seqs)), 50)
+        # more offsets than entries gives each entry once
+        seqs = list(smof_base._sample_files([self.filename], nseqs=5000))
+        self.assertEqual([s.header for s in seqs], headers)
+        seqs = list(smof_base._sample_files([self.filename], nbytes=300, block=100))
+        self.assertTrue(0 < len(seqs) < 60)
+        self.assertEqual(len(set(s.header for s in seqs)), len(seqs))
+
+    def test_sample_long_entries(self):
+        with tempfile.NamedTemporaryFile(mode="w", delete=False) as f:
+            f.write(
+                ">a\n"
+                + "ACGT" * 100
+                + "\n>b\n"
+                + "T" * 20
+                + "\n>c\n"
+                + "\n".join(["GGCC"] * 100)
+            )
+        try:
+            seqs = list(smof_base._sample_files([f.name], nseqs=20, block=100))
+            self.assertEqual([s.header for s in seqs], ["a", "b", "c"])
+            # the block limits only the search for headers, not the entries
+            self.assertEqual(
+                [s.seq for s in seqs], ["ACGT" * 100, "T" * 20, "GGCC" * 100]
+            )
+            seqs = list(smof_base._sample_files([f.name], nbytes=800, block=100))
+            self.assertEqual([len(s.seq) for s in seqs], [400, 20, 400])
+        finally:
+            os.unlink(f.name)
+
+    def test_sample_stream(self):
+        entries = smof_base.read_fasta_str(self.fna)
+        sample = smof_base.sniff_sample(entries, nseqs=20)
+        self.assertEqual(sample.get_nseqs(), 20)
+        self.assertTrue(str(sample).startswith("Sampled 20 sequences"))
+        self.assertEqual(
+            len(list(smof_base._first_bytes(smof_base.read_fasta_str(self.fna), 30))),
+            4,
+        )
+
+    def test_wilson_interval(self):
+        lo, hi = smof_base._wilson_interval(5, 10)
+        self.assertAlmostEqual(lo, 0.2366, places=4)
+        self.assertAlmostEqual(hi, 0.7634, places=4)
+        self.assertEqual(smof_base._wilson_interval(0, 10)[0], 0)
+
+
+class TestStatCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, "a.fa")
+        with open(self.filename, "w") as f:
+            f.write(">a\nACGT\n>b\nGGG\n")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def run_smof(self, argv):
+        args = smof.parse(argv + [self.filename])
+        out = StringIO()
+        args.func(args, smof_base._stream_entries(args.fh), out=out)
+        return out.getvalue().strip().split("\n")
+
+    def test_sidecar(self):
+        self.assertEqual(self.run_smof(["wc", "--cache"]), ["2\t7"])
+        cache = smof_base.StatCache()
+        self.assertTrue(os.path.exists(self.filename + ".smof.json"))
+        self.assertEqual(cache.get(self.filename, "stat-approx")["total"], 7)
+        self.assertEqual(cache.get(self.filename, "wc"), {"nseqs": 2, "total": 7})
+        # the cached summary is used while the file is unchanged, and wc
+        # takes its counts from any stat summary
+        g = smof_base.stat_file(smof_base.read_fasta_str([">x", "A"]))
+        identity, summaries = cache.load(self.filename)
+        cache.save(self.filename, identity, {"stat": g.to_dict()})
+        self.assertEqual(self.run_smof(["wc", "--cache"]), ["1\t1"])
+        self.assertEqual(cache.get(self.filename, "wc"), {"nseqs": 1, "total": 1})
+        self.assertEqual(self.run_smof(["stat", "--cache"]), ["nchars: 1"])
+        # but not once it has changed, even to the same size
+        with open(self.filename, "w") as f:
+            f.write(">a\nACGT\n>b\nGGA\n")
+        self.assertEqual(self.run_smof(["wc", "--cache"]), ["2\t7"])
+
+    def test_cache_dir(self):
+        cache_dir = os.path.join(self.dir.name, "cache")
+        for _ in range(2):
+            self.assertEqual(
+                self.run_smof(["stat", "-c", "--cache-dir", cache_dir]),
+                self.run_smof(["stat", "-c"]),
+            )
+            self.assertEqual(
+                self.run_smof(["sniff", "--cache-dir", cache_dir]),
+                self.run_smof(["sniff"]),
+            )
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertFalse(os.path.exists(self.filename + ".smof.json"))
+        # summaries without character counts are recomputed when needed
+        self.run_smof(["stat", "--cache"])
+        self.assertEqual(
+            self.run_smof(["stat", "-c", "--cache"]), self.run_smof(["stat", "-c"])
+        )
+
+    def test_finished(self):
+        # exact summaries are cached without their lengths and hashes
+        for argv in (["stat", "--hist"], ["stat", "-l"], ["sniff"]):
+            for _ in range(2):
+                self.assertEqual(self.run_smof(argv + ["--cache"]), self.run_smof(argv))
+        with open(self.filename + ".smof.json") as f:
+            summaries = json.load(f)["summaries"]
+        self.assertNotIn("lengths", summaries["stat"])
+        self.assertNotIn("hashes", summaries["sniff"]["seqs"])
+        # so they are not used to merge several files, nor for partials
+        other = os.path.join(self.dir.name, "b.fa")
+        with open(other, "w") as f:
+            f.write(">c\nAAAAAAAAAA\n")
+        for argv in (["stat"], ["stat", "--partial"], ["sniff"]):
+            self.assertEqual(
+                self.run_smof(argv + ["--cache", other]), self.run_smof(argv + [other])
+            )
+        self.assertFalse(os.path.exists(other + ".smof.json"))
+
+
+class TestQuantileSketch(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(1)
+        self.xs = [int(r.lognormvariate(6, 1)) for _ in range(20000)]
+
+    def assertRankClose(self, xs, q, estimate, tolerance=0.01):
+        xs = sorted(xs)
+        lo = bisect.bisect_left(xs, estimate)
+        hi = bisect.bisect_right(xs, estimate)
+        self.assertTrue(
+            lo - tolerance * len(xs) <= q * len(xs) <= hi + tolerance * len(xs)
+        )
+
+    def test_quantiles(self):
+        sketch = smof_base.QuantileSketch()
+        for x in self.xs:
+            sketch.update(x)
+        self.assertEqual(sketch.n, len(self.xs))
+        self.assertLess(sum(len(level) for level in sketch.levels), 1000)
+        for q in (0.1, 0.25, 0.5, 0.75, 0.9):
+            self.assertRankClose(self.xs, q, sketch.quantile(q))
+
+    def test_merge(self):
+        a = smof_base.QuantileSketch()
+        b = smof_base.QuantileSketch()
+        a.extend(self.xs[:5000])
+        b.extend(self.xs[5000:])
+        a.merge(b)
+        self.assertEqual(a.n, len(self.xs))
+        for q in (0.25, 0.5, 0.75):
+            self.assertRankClose(self.xs, q, a.quantile(q))
+
+    def test_approx_stat(self):
+        seqs = [smof_base.FastaEntry(str(i), "A" * x) for i, x in enumerate(self.xs)]
+        exact = smof_base.stat_file(seqs)._summary()
+        approx = smof_base.stat_file(seqs, approx=True)._summary()
+        for key in ("min", "max", "total"):
+            self.assertEqual(exact[key], approx[key])
+        for key in ("mean", "sd"):
+            self.assertAlmostEqual(exact[key], approx[key])
+        for key, q in (("1st_qu", 0.25), ("median", 0.5), ("3rd_qu", 0.75)):
+            self.assertRankClose(self.xs, q, approx[key])
+        self.assertLessEqual(abs(approx["N50"] - exact["N50"]), 0.002 * exact["N50"])
+
+    def test_approx_N50(self):
+        r = random.Random(2)
+        # a few long sequences hold most of the length
+        heavy = [int(100 * r.paretovariate(1.2)) for _ in range(20000)]
+        for xs in (self.xs, heavy, [5, 5000, 5001], list(range(1, 3000))):
+            hist = smof_base.LengthHistogram()
+            hist.update(xs)
+            N50 = smof_base._N50(xs)
+            self.assertLessEqual(abs(hist.N50() - N50), 0.002 * N50)
+            if N50 < 1024:
+                self.assertEqual(hist.N50(), N50)
+
 
 class TestSubseq(unittest.TestCase):
     def setUp(self):
@@ -1539,6 +2338,79 @@ class TestUniq(unittest.TestCase):
             get_output(self.repeated, ["uniq", "-c"]), ["1\ta", "2\tb", "2\tc"]
         )
 
+    def test_streaming(self):
+        # the first entries are written before the (endless) input ends
+        entries = (
+            smof.FastaEntry(str(i % 2), "ACGT" * (i % 3)) for i in itertools.count()
+        )
+        first = itertools.islice(smof_base.uniq(entries), 6)
+        self.assertEqual(
+            [(seq.header, seq.seq) for seq in first],
+            [("0", ""), ("1", "ACGT"), ("0", "ACGTACGT")]
+            + [("1", ""), ("0", "ACGT"), ("1", "ACGTACGT")],
+        )
+
+    def test_external(self):
+        rng = random.Random(1)
+        fna = []
+        for i in range(300):
+            seq = "".join(rng.choice("AC") for _ in range(rng.randint(0, 3)))
+            fna += [">{}".format(rng.randint(0, 60)), seq]
+        for opts in ([], ["-c"], ["-d"], ["-u"], ["-p", "-z", "|"], ["-f"]):
+            self.assertEqual(
+                get_output(fna, ["uniq", "--memory", "400"] + opts),
+                get_output(fna, ["uniq"] + opts),
+            )
+        # two-way partitions and merges, many levels deep
+        entries = list(smof_base.read_fasta(StringIO("\n".join(fna))))
+        self.assertEqual(
+            list(
+                smof_base._external(
+                    entries,
+                    smof_base._uniq_part,
+                    key=lambda x: x[1] + "\n" + x[2],
+                    memory=40,
+                    fanout=2,
+                )
+            ),
+            [
+                result
+                for i, result in smof_base._uniq_part(
+                    (i, s.header, s.seq) for i, s in enumerate(entries)
+                )
+            ],
+        )
+
+    def test_first_header_removed(self):
+        fna = self.repeated_header + [">d", "HAT"]
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "removed.fa")
+            for memory in ([], ["--memory", "16"]):
+                args = smof.parse(["uniq", "-f", "--removed", path] + memory)
+                out = StringIO()
+                gen = smof_base._stream_entries(smof_base.read_fasta_str(fna))
+                args.func(args, gen, out=out)
+                # argparse opened the --removed file
+                args.removed.close()
+                self.assertEqual(
+                    out.getvalue().strip().split("\n"), [">a", "MATH", ">d", "HAT"]
+                )
+                with open(path) as f:
+                    self.assertEqual(f.read(), ">a\nCAT\n>d\nHAT\n")
+        # the first entries are written before the (endless) input ends
+        entries = (smof.FastaEntry(str(i % 3), "A") for i in itertools.count())
+        first = itertools.islice(smof_base.uniq_headers(entries), 3)
+        self.assertEqual([seq.header for seq in first], ["0", "1", "2"])
+
+    def test_digest_index(self):
+        index = smof_base.DigestIndex(capacity=2)
+        digests = [bytes([i % 7, i % 11]) * 8 for i in range(200)]
+        for i, digest in enumerate(digests):
+            self.assertEqual(
+                index.add(digest), (i, True) if i < 77 else (i % 77, False)
+            )
+        self.assertEqual(len(index), 77)
+
     def test_pack(self):
         # pack does not guarantee conservation of order, so I compare sets
         self.assertEqual(
@@ -4,6 +4,8 @@ from smof.functions import (
     FastaDescription,
     FastaStat,
     FastaEntryStat,
+    FastaIndex,
+    StatCache,
     # data classes
     Alphabet,
     ColorAA,
@@ -12,6 +14,12 @@ from smof.functions import (
     # utility classes
     GrepOptions,
     GrepSearch,
+    IUPACPattern,
+    CompactHashSet,
+    HyperLogLog,
+    DigestIndex,
+    QuantileSketch,
+    LengthHistogram,
     # function exports
     to_pair,
     ambiguous2perl,
@@ -28,8 +36,12 @@ from smof.functions import (
     permute,
     reverse,
     sniff,
+    sniff_sample,
+    sort_entries,
+    sort_files,
     stat_file,
     stat_seq,
+    stat_table,
     subseq,
     translate,
     translate_dna,
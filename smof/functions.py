@@ -7,6 +7,16 @@ import io
 import hashlib
 import collections
 import itertools
+import bisect
+import heapq
+import functools
+import operator
+import pickle
+import tempfile
+import json
+import mmap
+import struct
+from array import array
 from smof.version import __version__
 
 
@@ -69,6 +79,37 @@ def read_fasta_str(lines, *args, **kwargs):
             yield FastaEntry(header, "", *args, **kwargs)
 
 
+def _read_fasta_fields(lines, filename=None, sequence=False):
+    """
+    Parse FASTA text into _TextField records holding either the header or the
+    sequence of each entry, without building FastaEntry objects. Entries are
+    delimited exactly as in read_fasta_str.
+    """
+    seq_list = []
+    has_seq = False
+    header = None
+
+    for line in lines:
+        line = line.strip()
+        if line == "" or line[0] == "#":
+            continue
+        if line[0] == ">":
+            if has_seq or header:
+                yield _TextField(filename, "".join(seq_list) if sequence else header)
+            seq_list = []
+            has_seq = False
+            header = line[1:]
+        elif header is not None:
+            has_seq = True
+            if sequence:
+                seq_list.append(line)
+        else:
+            _err("First fasta line must begin with '>'")
+
+    if header is not None:
+        yield _TextField(filename, "".join(seq_list) if sequence else header)
+
+
 def read_fasta(fastafile, *args, **kwargs):
     """
     fastafile may be a filename or a file object
@@ -78,10 +119,12 @@ def read_fasta(fastafile, *args, **kwargs):
     else:
         f = fastafile
 
-    for seq in read_fasta_str(f, *args, **kwargs):
-        yield seq
-
-    f.close()
+    # the file is closed even if the reader stops early (e.g. grep -l)
+    try:
+        for seq in read_fasta_str(f, *args, **kwargs):
+            yield seq
+    finally:
+        f.close()
 
 
 # ========
@@ -234,6 +277,9 @@ class GrepOptions:
         gff=False,
         gff_type="regex_match",
         fastain=None,
+        jobs=1,
+        max_count=None,
+        index=None,
     ):
         self.pattern = pattern
         self.match_sequence = match_sequence
@@ -263,6 +309,9 @@ class GrepOptions:
         self.gff = gff
         self.gff_type = gff_type
         self.fastain = fastain
+        self.jobs = jobs
+        self.max_count = max_count
+        self.index = index
 
 
 def grep(gen, **kwargs):
@@ -340,13 +389,177 @@ def reverse(gen, complement=False, no_validate=False):
         yield func(seq)
 
 
-def sniff(gen):
-    seqsum = FastaDescription()
+def sniff(gen, jobs=1, approx=False):
+    """
+    Describe a stream of entries. With jobs > 1, the entries are described in
+    worker processes and their descriptions merged; if gen is a filename or
+    a list of filenames, the workers read byte ranges of the files
+    themselves.
+    """
+    seqsum = FastaDescription(approx=approx)
+    jobs = _pool_size(jobs, gen)
+    if jobs > 1:
+        worker = functools.partial(sniff, approx=approx)
+        for part in _parallel_parts(worker, gen, jobs):
+            seqsum.merge(part)
+        return seqsum
+    if _file_names(gen):
+        gen = _stream_entries(gen)
     for seq in gen:
         seqsum.add_seq(seq)
     return seqsum
 
 
+def sniff_sample(entries, nseqs=None, nbytes=None, block=2**16, seed=42):
+    """
+    Describe a sample of the input, either about nseqs entries or the entries
+    in about nbytes of it. Files are sampled at evenly spaced byte offsets:
+    for nseqs, the first entry beginning after each of nseqs offsets, and for
+    nbytes, all entries beginning within blocks of (at most) block bytes.
+    Streams are sampled with a reservoir of nseqs entries or by reading the
+    first nbytes.
+    """
+    if isinstance(entries, str):
+        entries = [entries]
+    if (
+        isinstance(entries, list)
+        and entries
+        and all(isinstance(x, str) and os.path.isfile(x) for x in entries)
+    ):
+        sample = _sample_files(entries, nseqs, nbytes, block)
+    elif nseqs:
+        sample = _reservoir(_stream_entries(entries), nseqs, seed)
+    else:
+        sample = _first_bytes(_stream_entries(entries), nbytes)
+    seqsum = FastaDescription()
+    for seq in sample:
+        seqsum.add_seq(seq)
+    seqsum.sampled = True
+    return seqsum
+
+
+def _sample_files(paths, nseqs=None, nbytes=None, block=2**16):
+    sizes = [os.path.getsize(path) for path in paths]
+    total = sum(sizes)
+    if nbytes and nbytes >= total:
+        for path in paths:
+            for seq in read_fasta(path, filename=path):
+                yield seq
+        return
+    if nseqs:
+        offsets = [total * i // nseqs for i in range(nseqs)]
+    else:
+        nblocks = max(1, nbytes // block)
+        block = min(block, nbytes)
+        offsets = [total * i // nblocks for i in range(nblocks)]
+    # map the offsets across all files to offsets within each
+    starts = list(itertools.accumulate([0] + sizes))
+    for i, path in enumerate(paths):
+        local = [x - starts[i] for x in offsets if starts[i] <= x < starts[i + 1]]
+        if not local:
+            continue
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for start in _sample_headers(data, local, nseqs, block):
+                    for seq in _read_entry(data, start, path):
+                        yield seq
+
+
+def _sample_headers(data, offsets, nseqs=None, block=2**16):
+    """
+    The offsets of the sampled headers in a fasta buffer: for nseqs, the
+    first header beginning at or after each offset, and otherwise all the
+    headers beginning within block bytes of each offset. Each header is given
+    once, and offsets landing in the same entry share one search.
+    """
+    found = -1
+    for offset in offsets:
+        if nseqs:
+            if offset <= found:
+                # the entry of the last header found
+                continue
+            start = _next_header(data, offset)
+            if start is None:
+                return
+            found = start
+            yield start
+        else:
+            end = min(offset + block, len(data))
+            start = _next_header(data, max(offset, found + 1), end)
+            while start is not None:
+                found = start
+                yield start
+                start = _next_header(data, start + 1, end)
+
+
+def _next_header(data, offset, end=None):
+    """
+    The offset of the first header line of a fasta buffer beginning at or
+    after offset (and before end), or None
+    """
+    if offset == 0 and data[:1] == b">":
+        return 0
+    if end is None:
+        end = len(data)
+    pos = data.find(b"\n>", max(offset - 1, 0), end)
+    return None if pos == -1 else pos + 1
+
+
+def _read_entry(data, start, filename=None):
+    """
+    Read the entry whose header line begins at start in a fasta buffer
+    """
+    stop = _next_header(data, start + 1)
+    if stop is None:
+        stop = len(data)
+    # the text may hold more entries, after headers indented by whitespace
+    for seq in itertools.islice(_read_span(data, start, stop, filename), 1):
+        if seq.header or seq.seq or stop == len(data):
+            # read_fasta skips an empty entry unless it ends the file
+            yield seq
+
+
+def _reservoir(gen, size, seed=42):
+    """
+    A uniform random sample of size items of a stream (Algorithm R)
+    """
+    import random
+
+    r = random.Random(seed)
+    sample = []
+    for i, item in enumerate(gen):
+        if i < size:
+            sample.append(item)
+        else:
+            j = r.randrange(i + 1)
+            if j < size:
+                sample[j] = item
+    return sample
+
+
+def _first_bytes(gen, nbytes):
+    """
+    The entries of a stream up to (and including) the one that reaches
+    nbytes of header and sequence text
+    """
+    total = 0
+    for seq in gen:
+        yield seq
+        total += len(seq.header) + len(seq.seq)
+        if total >= nbytes:
+            return
+
+
+def _wilson_interval(k, n, z=1.96):
+    """
+    The Wilson score interval of a proportion of k in n
+    """
+    p = k / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z / (1 + z * z / n) * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return max(0, center - half), min(1, center + half)
+
+
 def stat_seq(
     gen,
     length=False,
@@ -354,48 +567,420 @@ def stat_seq(
     proportion=False,
     case_sensitive=False,
     count_lower=False,
+    alphabet=None,
+    spill=100000,
 ):
+    """
+    Yield a header and then a row of statistics for each sequence. If an
+    alphabet (a string of characters) is given, the character columns are
+    fixed in advance, with an 'other' column for characters outside it, and
+    rows are yielded as the sequences are read. Otherwise there is a column
+    for every character in the input, so no row can be written until the
+    input has been read; rows are held in memory, or in a temporary file once
+    there are more than `spill` sequences.
+    """
     if not (counts or proportion or case_sensitive or count_lower):
         length = True
 
-    seqlist = []
-    charset = set()
     if length and not (counts or proportion):
         for seq in gen:
             seqid = _parse_header_firstword(seq.header)
             yield [seqid, len(seq.seq)]
+        return
+
+    ignorecase = not case_sensitive
+    kwargs = {"masked": count_lower, "length": length, "ignorecase": ignorecase}
+    options = {
+        "length": length,
+        "count_lower": count_lower,
+        "proportion": proportion and not counts,
+    }
+
+    def key(c):
+        return c.upper() if ignorecase else c
+
+    def columns(charset):
+        # the character columns, as in FastaEntryStat.getheader
+        chars = set("".join(charset).upper()) if ignorecase else charset
+        return {c: i for i, c in enumerate(sorted(chars))}
+
+    # each batch is (chars, table, seqids), see _char_counts
+    batches = (
+        _char_counts([seq.seq for seq in batch])
+        + ([_parse_header_firstword(seq.header) for seq in batch],)
+        for batch in _batches(gen, 1000)
+    )
+
+    if alphabet:
+        charset = set(alphabet) if ignorecase else set(alphabet + alphabet.lower())
+        yield FastaEntryStat.getheader(charset, **kwargs) + ["other"]
+        column = columns(charset)
+        for chars, table, seqids in batches:
+            target = [column.get(key(c), len(column)) for c in chars]
+            ncol = len(column) + 1
+            for row in _stat_seq_rows(seqids, chars, table, target, ncol, **options):
+                yield row
+        return
+
+    charset = set()
+    held = []
+    nheld = 0
+    spilled = None
+    for batch in batches:
+        charset.update(batch[0])
+        if spilled:
+            pickle.dump(batch, spilled)
+            continue
+        held.append(batch)
+        nheld += len(batch[2])
+        if nheld > spill:
+            spilled = tempfile.TemporaryFile()
+            for item in held:
+                pickle.dump(item, spilled)
+            held = []
+
+    yield FastaEntryStat.getheader(charset, **kwargs)
+
+    if spilled:
+        held = _unpickle_all(spilled)
+    column = columns(charset)
+    for chars, table, seqids in held:
+        target = [column.get(key(c)) for c in chars]
+        ncol = len(column)
+        for row in _stat_seq_rows(seqids, chars, table, target, ncol, **options):
+            yield row
+
+
+def _stat_seq_rows(seqids, chars, table, target, ncol, length, count_lower, proportion):
+    """
+    Make the stat_seq rows for a batch of sequences counted by _char_counts,
+    adding the count of chars[i] to column target[i] (or dropping it if
+    target[i] is None)
+    """
+    lower = [i for i, c in enumerate(chars) if c in string.ascii_lowercase]
+    columns = [seqids]
+    if isinstance(table, list):
+        values = []
+        for row in table:
+            out = [0] * ncol
+            for j, n in zip(target, row):
+                if j is not None:
+                    out[j] += n
+            if proportion:
+                total = sum(out)
+                out = [c / total if total else float("nan") for c in out]
+            values.append(out)
+        if length:
+            columns.append([sum(row) for row in table])
+        if count_lower:
+            columns.append([sum(row[i] for i in lower) for row in table])
     else:
-        for seq in gen:
-            seqstat = FastaEntryStat(seq)
-            seqlist.append(seqstat)
-            charset.update(seqstat.counts)
+        import numpy
+
+        fold = numpy.zeros((len(target), ncol), dtype=table.dtype)
+        for i, j in enumerate(target):
+            if j is not None:
+                fold[i, j] = 1
+        values = table @ fold
+        if proportion:
+            with numpy.errstate(invalid="ignore"):
+                values = values / values.sum(axis=1, keepdims=True)
+        values = values.tolist()
+        if length:
+            columns.append(table.sum(axis=1).tolist())
+        if count_lower:
+            columns.append(table[:, lower].sum(axis=1).tolist())
+    for row in zip(*columns, values):
+        yield list(row[:-1]) + row[-1]
 
-        ignorecase = not case_sensitive
-        kwargs = {"masked": count_lower, "length": length, "ignorecase": ignorecase}
 
-        yield FastaEntryStat.getheader(charset, **kwargs)
+TABLE_METRICS = ("length", "gc", "n_fraction", "masked", "entropy", "max_n_run")
 
-        count_offset = length + count_lower + 1
-        for q in seqlist:
-            line = q.aslist(
-                charset=charset, header_fun=_parse_header_firstword, **kwargs
-            )
-            if counts:
-                out = line
-            elif proportion:
-                total = sum(line[count_offset:])
-                props = [c / total for c in line[count_offset:]]
-                out = itertools.chain(line[0:count_offset], props)
-            yield out
 
+def stat_table(gen, metrics=TABLE_METRICS, size=1000):
+    """
+    Yield (seqids, columns) for each batch of `size` sequences, where
+    columns[i] holds metrics[i] of every sequence in the batch, as a numpy
+    array if numpy is installed, otherwise as a list. The metrics are
+
+        length      the number of characters
+        gc          the proportion of G and C among the A, C, G, T and U
+        n_fraction  the proportion of N
+        masked      the proportion of lowercase (soft-masked) characters
+        entropy     the Shannon entropy of the case-folded characters, in bits
+        max_n_run   the length of the longest run of N
+
+    All but max_n_run are computed from one _char_counts table of the batch.
+    Proportions and the entropy of an empty sequence are nan.
+    """
+    for batch in _batches(gen, size):
+        texts = [seq.seq for seq in batch]
+        chars, table = _char_counts(texts)
+        seqids = [_parse_header_firstword(seq.header) for seq in batch]
+        yield seqids, [_table_metric(m, texts, chars, table) for m in metrics]
 
-def stat_file(gen, count_characters=False):
-    g = FastaStat()
-    for seq in gen:
-        g.add_seq(FastaEntryStat(seq, count=count_characters))
+
+def _table_metric(metric, texts, chars, table):
+    """
+    Compute one stat_table metric for a batch of texts counted by _char_counts
+    """
+    if metric == "max_n_run":
+        if isinstance(table, list):
+            return [
+                max(map(len, re.findall("[Nn]+", text)), default=0) for text in texts
+            ]
+        return _max_n_runs(texts)
+
+    # the characters in each case-folded column
+    folded = collections.defaultdict(list)
+    for j, c in enumerate(chars):
+        folded[c.upper()].append(j)
+
+    if isinstance(table, list):
+
+        def sums(columns):
+            return [sum(row[j] for j in columns) for row in table]
+
+        def ratio(x, y):
+            return [a / b if b else float("nan") for a, b in zip(x, y)]
+
+        lengths = [sum(row) for row in table]
+    else:
+        import numpy
+
+        def sums(columns):
+            return table[:, columns].sum(axis=1)
+
+        def ratio(x, y):
+            with numpy.errstate(invalid="ignore", divide="ignore"):
+                return x / y
+
+        lengths = table.sum(axis=1)
+
+    def columns(alphabet):
+        return [j for j, c in enumerate(chars) if c in alphabet]
+
+    if metric == "length":
+        return lengths
+    if metric == "gc":
+        return ratio(sums(columns("GCgc")), sums(columns("ACGTUacgtu")))
+    if metric == "n_fraction":
+        return ratio(sums(columns("Nn")), lengths)
+    if metric == "masked":
+        return ratio(sums(columns(string.ascii_lowercase)), lengths)
+    if metric == "entropy":
+        counts = [sums(js) for js in folded.values()]
+        if isinstance(table, list):
+            rows = list(zip(*counts)) or [()] * len(table)
+            return [
+                0.0 - sum(x / n * math.log2(x / n) for x in row if x) if n else math.nan
+                for n, row in zip(lengths, rows)
+            ]
+        counts = numpy.stack(counts, axis=1) if counts else table
+        p = ratio(counts, lengths[:, None])
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            terms = numpy.where(counts > 0, p * numpy.log2(p), 0.0)
+        return numpy.where(lengths > 0, 0.0 - terms.sum(axis=1), numpy.nan)
+    _err("Unknown metric '{}'".format(metric))
+
+
+def _max_n_runs(texts):
+    """
+    The length of the longest run of N in each text, from the runs in the
+    newline-joined batch (as UTF-8, where no other character encodes a byte
+    of 'N' or 'n')
+    """
+    import numpy
+
+    codes = numpy.frombuffer(
+        "\n".join(texts).encode("utf-8", "surrogatepass"), dtype=numpy.uint8
+    )
+    isn = numpy.zeros(len(codes) + 2, dtype=bool)
+    isn[1:-1] = (codes == ord("N")) | (codes == ord("n"))
+    # runs begin and end alternately where isn changes
+    edges = numpy.flatnonzero(isn[1:] != isn[:-1])
+    starts = edges[0::2]
+    runs = edges[1::2] - starts
+    # the text of each run, by the newlines before it (so in sorted order)
+    owner = numpy.searchsorted(numpy.flatnonzero(codes == ord("\n")), starts)
+    longest = numpy.zeros(len(texts), dtype=numpy.int64)
+    if len(runs):
+        first = numpy.flatnonzero(numpy.diff(owner, prepend=-1))
+        longest[owner[first]] = numpy.maximum.reduceat(runs, first)
+    return longest
+
+
+def _unpickle_all(f):
+    """
+    Yield the objects pickled to a file, in order, and close it
+    """
+    with f:
+        f.seek(0)
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+
+
+def stat_file(gen, count_characters=False, approx=False, jobs=1):
+    """
+    Summarize a stream of entries. With jobs > 1, the entries are summarized
+    in worker processes, as in sniff.
+    """
+    g = FastaStat(approx=approx)
+    jobs = _pool_size(jobs, gen)
+    if jobs > 1:
+        worker = functools.partial(stat_file, count_characters=count_characters)
+        parts = _parallel_parts(worker, gen, jobs)
+        if not approx:
+            for part in parts:
+                g.merge(part)
+            return g
+        # The workers keep exact lengths, so that they can be sketched here
+        # in the same batches of 1000 as in a serial run, for the same result
+        lengths = array("q")
+        for part in parts:
+            g.counts.update(part.counts)
+            lengths.extend(part.lengths)
+            for i in range(0, len(lengths) - 999, 1000):
+                g._add_lengths(lengths[i : i + 1000])
+            del lengths[: len(lengths) - len(lengths) % 1000]
+        g._add_lengths(lengths)
+        return g
+    if _file_names(gen):
+        gen = _stream_entries(gen)
+    for batch in _batches(gen, 1000):
+        g.add_batch(batch, count=count_characters)
     return g
 
 
+def _parallel_parts(func, gen, jobs):
+    """
+    Apply func, which aggregates a stream of entries, to parts of the input
+    in a pool of worker processes, yielding the aggregates in input order. If
+    gen names files, each part is a byte range read by the worker, otherwise
+    it is a batch of 1000 entries read here.
+    """
+    paths = _file_names(gen)
+    if paths:
+        tasks = _byte_ranges(paths, jobs)
+    else:
+        tasks = _batches(_stream_entries(gen), 1000)
+    worker = functools.partial(_parallel_worker, func)
+    for task, part in _pool_imap(worker, tasks, jobs):
+        yield part
+
+
+def _file_names(gen):
+    """
+    The list of filenames that gen names (a filename or a list of them), or
+    None if it is anything else
+    """
+    if isinstance(gen, str):
+        return [gen]
+    if isinstance(gen, list) and gen and all(isinstance(x, str) for x in gen):
+        return gen
+    return None
+
+
+def _pool_size(jobs, gen=None, smallest=2**20):
+    """
+    The number of worker processes worth starting for up to jobs of them: no
+    more than the available CPUs, and just 1 (no pool) if gen names files
+    too small to split into two byte ranges (see _byte_ranges), since
+    starting and feeding the workers would then cost more than it saves
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    jobs = min(jobs, cpus)
+    paths = _file_names(gen)
+    if jobs > 1 and paths and sum(os.path.getsize(x) for x in paths) < 2 * smallest:
+        return 1
+    return jobs
+
+
+def _parallel_worker(func, task):
+    if isinstance(task, tuple):
+        task = _read_fasta_range(*task)
+    return func(task)
+
+
+def _pool_imap(func, tasks, jobs, initializer=None, initargs=()):
+    """
+    Call func on each task in a pool of worker processes, yielding (task,
+    result) pairs in input order. At most two tasks per worker are in flight
+    at any time, so memory stays bounded on large inputs.
+    """
+    import multiprocessing
+
+    pending = collections.deque()
+    with multiprocessing.Pool(jobs, initializer=initializer, initargs=initargs) as pool:
+        for task in tasks:
+            pending.append((task, pool.apply_async(func, (task,))))
+            if len(pending) > 2 * jobs:
+                task, result = pending.popleft()
+                yield task, result.get()
+        while pending:
+            task, result = pending.popleft()
+            yield task, result.get()
+
+
+def _byte_ranges(paths, jobs, smallest=2**20, largest=2**26):
+    """
+    Split files into (path, start, end) byte ranges, about eight per job,
+    but no smaller than 1MB or larger than 64MB
+    """
+    sizes = [os.path.getsize(path) for path in paths]
+    size = min(largest, max(smallest, sum(sizes) // (8 * jobs)))
+    ranges = []
+    for path, total in zip(paths, sizes):
+        for start in range(0, max(total, 1), size):
+            ranges.append((path, start, min(start + size, total)))
+    return ranges
+
+
+def _read_fasta_range(path, start, end):
+    """
+    Read the entries of a fasta file whose header lines begin within the
+    byte range [start, end), exactly as read_fasta would read them
+    """
+    stopped = []
+
+    def lines():
+        with open(path, "rb") as f:
+            if start > 0:
+                # skip to the first line beginning in the range
+                f.seek(start - 1)
+                f.readline()
+            pos = f.tell()
+            # lines before the first header belong to the previous range
+            inside = start == 0
+            for line in f:
+                if line.lstrip().startswith(b">"):
+                    if pos >= end:
+                        # a final header, so that the last entry in the range
+                        # is read as it would be in the whole file
+                        stopped.append(True)
+                        yield ">"
+                        return
+                    inside = True
+                if inside:
+                    yield line.decode()
+                pos += len(line)
+
+    previous = None
+    for seq in read_fasta_str(lines(), filename=path):
+        if previous is not None:
+            yield previous
+        previous = seq
+    # the entry of the final header is not part of this range
+    if previous is not None and not stopped:
+        yield previous
+
+
 def subseq(gen, a, b, color=None, annotate=False):
     for seq in gen:
         start, end = sorted([a, b])
@@ -508,39 +1093,98 @@ def translate(gen, all_frames=False, from_start=False, cds=False):
         yield FastaEntry(header=seq.header, seq=orf)
 
 
-def uniq(gen, repeated=False, uniq=False, count=False):
-    seqs = collections.OrderedDict()
-    for seq in gen:
-        try:
-            seqs[seq] += 1
-        except KeyError:
-            seqs[seq] = 1
-
-    if repeated:
-        sgen = ((k, v) for k, v in seqs.items() if v > 1)
-    elif uniq:
-        sgen = ((k, v) for k, v in seqs.items() if v == 1)
+def uniq(gen, repeated=False, uniq=False, count=False, memory=None, tmpdir=None):
+    """
+    Yield the first of each set of equal entries (equal headers and
+    sequences) as soon as it is seen. Only a 128-bit digest of each distinct
+    entry is held (see DigestIndex). If repeated or uniq is set, yield only
+    the entries seen more than once or only once; if count is set, yield
+    "count\theader" lines. These need the counts of the whole input, so the
+    first occurrences are spilled to a temporary file until it has been read.
+
+    With a memory limit (in bytes), the entries are first partitioned into
+    temporary files in tmpdir, so the distinct entries need not fit in memory
+    (see _external).
+    """
+    if memory:
+        groups = _external(
+            gen,
+            _uniq_part,
+            key=lambda x: x[1] + "\n" + x[2],
+            memory=memory,
+            tmpdir=tmpdir,
+        )
+    elif not (repeated or uniq or count):
+        index = DigestIndex()
+        for seq in gen:
+            if index.add(_digest128(seq.header, seq.seq))[1]:
+                yield seq
+        return
     else:
-        sgen = seqs.items()
+        counts = array("Q")
+        spilled = tempfile.TemporaryFile(dir=tmpdir)
+        index = DigestIndex()
+        for seq in gen:
+            k, new = index.add(_digest128(seq.header, seq.seq))
+            if new:
+                counts.append(1)
+                pickle.dump((seq.header, "" if count else seq.seq), spilled)
+            else:
+                counts[k] += 1
+        groups = (
+            (header, sequence, n)
+            for (header, sequence), n in zip(_unpickle_all(spilled), counts)
+        )
 
-    if count:
-        for k, v in sgen:
-            yield "{}\t{}".format(v, k.header)
-    else:
-        for k, v in sgen:
-            yield k
+    for header, sequence, n in groups:
+        if count:
+            yield "{}\t{}".format(n, header)
+        elif (n > 1) if repeated else (n == 1) if uniq else True:
+            yield FastaEntry(header=header, seq=sequence)
+
+
+def _uniq_part(part):
+    """
+    Yield (ordinal, (header, seq, count)) for the first of each set of equal
+    entries in a part, given as (ordinal, header, seq) in input order
+    """
+    index = DigestIndex()
+    firsts = []
+    counts = array("Q")
+    for ordinal, header, seq in part:
+        k, new = index.add(_digest128(header, seq))
+        if new:
+            firsts.append((ordinal, header, seq))
+            counts.append(1)
+        else:
+            counts[k] += 1
+    for (ordinal, header, seq), n in zip(firsts, counts):
+        yield ordinal, (header, seq, n)
 
 
-def pack(gen, sep):
+def pack(gen, sep, memory=None, tmpdir=None):
+    """
+    Merge the entries with equal sequences into one, joining their headers
+    with sep, in the order the sequences are first seen. With a memory limit
+    (in bytes), the entries are partitioned by sequence into temporary files
+    in tmpdir (see _external).
+    """
+    part = functools.partial(_pack_part, sep=sep)
+    for header, seq in _external(
+        gen, part, key=operator.itemgetter(2), memory=memory, tmpdir=tmpdir
+    ):
+        yield FastaEntry(header=header, seq=seq)
+
+
+def _pack_part(part, sep):
     seqs = collections.OrderedDict()
-    for seq in gen:
-        if seq.seq in seqs:
-            seqs[seq.seq].append(seq.header)
+    for ordinal, header, seq in part:
+        if seq in seqs:
+            seqs[seq][1].append(header)
         else:
-            seqs[seq.seq] = [seq.header]
-    for q, h in seqs.items():
-        seq = FastaEntry(header=sep.join(h), seq=q)
-        yield seq
+            seqs[seq] = (ordinal, [header])
+    for seq, (ordinal, headers) in seqs.items():
+        yield ordinal, (sep.join(headers), seq)
 
 
 def unpack(gen, sep):
@@ -550,17 +1194,279 @@ def unpack(gen, sep):
             yield FastaEntry(header=header, seq=seq.seq)
 
 
-def uniq_headers(gen, removed=False):
-    seqs = collections.OrderedDict()
-    for seq in gen:
-        if seq.header in seqs:
-            if removed:
-                seq.print(color=False, out=args.removed)
-        else:
-            seqs[seq.header] = seq.seq
-    for header, sequence in seqs.items():
-        seq = FastaEntry(header=header, seq=sequence)
-        yield seq
+def uniq_headers(gen, removed=None, memory=None, tmpdir=None):
+    """
+    Yield the first entry with each header as soon as it is seen, holding
+    only a 128-bit digest of each header (see DigestIndex). The later
+    entries with a header already seen are written to the open file removed,
+    if given, one write per entry into its buffer. With a memory limit (in
+    bytes), the entries are partitioned by header into temporary files in
+    tmpdir (see _external).
+    """
+    if memory:
+        entries = (
+            (FastaEntry(header=header, seq=seq), first)
+            for header, seq, first in _external(
+                gen,
+                _uniq_headers_part,
+                key=operator.itemgetter(1),
+                memory=memory,
+                tmpdir=tmpdir,
+            )
+        )
+    else:
+        index = DigestIndex()
+        entries = ((seq, index.add(_digest128(seq.header, ""))[1]) for seq in gen)
+    for seq, first in entries:
+        if first:
+            yield seq
+        elif removed:
+            removed.write(seq.get_pretty_string() + "\n")
+    if removed:
+        removed.flush()
+
+
+def _uniq_headers_part(part):
+    """
+    Yield (ordinal, (header, seq, first)) for each entry of a part, where
+    first is False for the entries whose header was seen before
+    """
+    seen = set()
+    for ordinal, header, seq in part:
+        yield ordinal, (header, seq, header not in seen)
+        seen.add(header)
+
+
+def sort_entries(gen, key, reverse=False, memory=None, tmpdir=None):
+    """
+    Yield the entries sorted (stably) by key(entry). With a memory limit (in
+    bytes), the entries are read in runs of up to a quarter of it in text,
+    each run is sorted and spilled to a temporary file in tmpdir (see
+    _spill), and the runs are merged back (see _merge_runs).
+    """
+    if not memory:
+        for seq in sorted(gen, key=key, reverse=reverse):
+            yield seq
+        return
+    # items are (key, ordinal, header, seq); the ordinal breaks ties in input
+    # order, and is negated in a reverse sort so that it still does
+    sign = -1 if reverse else 1
+    items = ((key(seq), sign * i, seq.header, seq.seq) for i, seq in enumerate(gen))
+    runs = []
+    run = []
+    size = 0
+    for item in items:
+        run.append(item)
+        size += len(item[2]) + len(item[3])
+        if size > memory // 4:
+            run.sort(reverse=reverse)
+            runs.append(_spill(run, tmpdir))
+            run = []
+            size = 0
+    run.sort(reverse=reverse)
+    if runs:
+        runs.append(_spill(run, tmpdir))
+        run = _merge_runs(runs, tmpdir, reverse=reverse)
+    for k, ordinal, header, seq in run:
+        yield FastaEntry(header=header, seq=seq)
+
+
+def sort_files(paths, key, reverse=False):
+    """
+    Yield the entries of the fasta files sorted (stably) by key(entry),
+    holding only the key and location of each entry rather than its
+    sequence. The files are memory-mapped and scanned once for the keys;
+    the entries are then read back from the maps in sorted order.
+    """
+    files = []
+    maps = []
+    keys = []
+    # the file, the span of the text holding the entry, and its number
+    # within that text (which is almost always a single entry)
+    sources = array("I")
+    starts = array("Q")
+    ends = array("Q")
+    numbers = array("I")
+    try:
+        for i, path in enumerate(paths):
+            f = open(path, "rb")
+            files.append(f)
+            if os.fstat(f.fileno()).st_size == 0:
+                maps.append(b"")
+                continue
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            maps.append(data)
+            for start, end in _fasta_spans(data):
+                for n, seq in enumerate(_read_span(data, start, end, path)):
+                    if not (seq.header or seq.seq) and end < len(data):
+                        # read_fasta skips an empty entry unless it ends the file
+                        continue
+                    keys.append(key(seq))
+                    sources.append(i)
+                    starts.append(start)
+                    ends.append(end)
+                    numbers.append(n)
+        order = sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+        del keys
+        for j in order:
+            seqs = _read_span(maps[sources[j]], starts[j], ends[j], paths[sources[j]])
+            yield next(itertools.islice(seqs, numbers[j], None))
+    finally:
+        for data in maps:
+            if data:
+                data.close()
+        for f in files:
+            f.close()
+
+
+def _fasta_spans(data):
+    """
+    Yield the (start, end) byte offsets of the text of each entry in a fasta
+    buffer, splitting it before each '>' that starts a line. The first span
+    also holds anything before the first header.
+    """
+    start = 0
+    while True:
+        end = data.find(b"\n>", start)
+        if end == -1:
+            if start < len(data):
+                yield start, len(data)
+            return
+        yield start, end + 1
+        start = end + 1
+
+
+def _read_span(data, start, end, filename=None):
+    """
+    Parse the entries in the text of data[start:end], as read_fasta would
+    """
+    lines = data[start:end].decode().split("\n")
+    return read_fasta_str(lines, filename=filename)
+
+
+def _external(gen, process, key, memory=None, tmpdir=None, fanout=64):
+    """
+    Apply process to the entries in parts that fit in memory, and yield its
+    results in the order of the input.
+
+    Each entry is numbered and given to process as (ordinal, header, seq).
+    process must yield (ordinal, result) pairs, in order of ordinal, and the
+    result must depend only on entries with the same key(entry). Without a
+    memory limit the whole input is one part. Otherwise the entries are
+    partitioned by the hash of their key into fanout temporary files in
+    tmpdir, and any partition larger than a quarter of memory (in bytes of
+    text, about what it takes once read back) is partitioned again, by the
+    next bits of the hash (see _partitions). The results of each part are
+    spilled to a temporary file, and the files are merged back by ordinal
+    (see _merge_runs).
+    """
+    numbered = ((i, seq.header, seq.seq) for i, seq in enumerate(gen))
+    if not memory:
+        for ordinal, result in process(numbered):
+            yield result
+        return
+    parts = _partitions(numbered, key, memory // 4, tmpdir, fanout)
+    runs = _merge_runs(
+        (_spill(process(part), tmpdir) for part in parts), tmpdir, fanout
+    )
+    for ordinal, result in runs:
+        yield result
+
+
+def _partitions(items, key, limit, tmpdir=None, fanout=64, depth=0):
+    """
+    Split (ordinal, header, seq) items into parts of at most about limit
+    bytes of text, each holding all the items of the keys in it. Items that
+    fit are yielded as one list. Otherwise they are partitioned into fanout
+    temporary files by the 64-bit hash of their key, using the next 8 bits
+    of the hash at each depth, and each file is split again in turn. Once
+    the hash is used up, or if all the items fall in one file, a part is
+    yielded however large it is.
+    """
+    items = iter(items)
+    held = []
+    size = 0
+    for item in items:
+        held.append(item)
+        size += len(item[1]) + len(item[2])
+        if size > limit and depth < 8:
+            break
+    else:
+        yield held
+        return
+
+    files = [tempfile.TemporaryFile(dir=tmpdir) for _ in range(fanout)]
+    counts = [0] * fanout
+    # items are pickled in chunks of up to 1000 items or 64kB of text
+    chunks = [[] for _ in range(fanout)]
+    sizes = [0] * fanout
+    shift = 8 * depth
+    n = 0
+    for n, item in enumerate(itertools.chain(held, items), 1):
+        i = (_hash64(key(item)) >> shift) % fanout
+        chunks[i].append(item)
+        counts[i] += 1
+        sizes[i] += len(item[1]) + len(item[2])
+        if sizes[i] > 2**16 or len(chunks[i]) == 1000:
+            pickle.dump(chunks[i], files[i])
+            chunks[i] = []
+            sizes[i] = 0
+    del held
+    for f, chunk in zip(files, chunks):
+        if chunk:
+            pickle.dump(chunk, f)
+    for f, count in zip(files, counts):
+        if count == n:
+            # all in one file, so (almost surely) all of one key
+            yield _unspill(f)
+            continue
+        for part in _partitions(_unspill(f), key, limit, tmpdir, fanout, depth + 1):
+            yield part
+
+
+def _spill(items, tmpdir=None):
+    """
+    Pickle items to a temporary file (in tmpdir), in chunks of up to 1000,
+    and return it unread (see _unspill)
+    """
+    f = tempfile.TemporaryFile(dir=tmpdir)
+    for chunk in _batches(items, 1000):
+        pickle.dump(chunk, f)
+    return f
+
+
+def _unspill(f):
+    """
+    Yield the items of a file written by _spill, and close it
+    """
+    for chunk in _unpickle_all(f):
+        for item in chunk:
+            yield item
+
+
+def _merge_runs(runs, tmpdir=None, fanin=64, reverse=False):
+    """
+    Merge sorted runs (temporary files of items, see _spill) into
+    one sorted iterator, descending if reverse. Runs are merged fanin at a
+    time as they arrive, so no more than about fanin runs are open per level
+    of merging, and each item is copied once per level.
+    """
+    levels = []
+    for run in runs:
+        level = 0
+        while True:
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(run)
+            if len(levels[level]) < fanin:
+                break
+            merged = heapq.merge(*map(_unspill, levels[level]), reverse=reverse)
+            run = _spill(merged, tmpdir)
+            levels[level] = []
+            level += 1
+    return heapq.merge(
+        *[_unspill(run) for level in levels for run in level], reverse=reverse
+    )
 
 
 # =================
@@ -568,6 +1474,20 @@ def uniq_headers(gen, removed=False):
 # =================
 
 
+def _char_set(text, short=500):
+    """
+    The set of characters in a string. Sequences are mostly letters, so in a
+    long one each ASCII letter is found by a (memchr) search and only the
+    other characters are hashed.
+    """
+    if len(text) < short:
+        return set(text)
+    rest = text.encode("utf-8", "surrogatepass").translate(None, _TypeTables.LETTERS)
+    chars = set(rest.decode("utf-8", "surrogatepass"))
+    chars.update(c for c in string.ascii_letters if c in text)
+    return chars
+
+
 def _counter_caser(counter, lower=False):
     """
     Sums cases in Collections.Counter object
@@ -589,6 +1509,53 @@ def _counter_caser(counter, lower=False):
     return out
 
 
+def _char_counts(texts, by_entry=True):
+    """
+    Count the characters of a list of strings with one numpy.bincount call
+    over their character codes (bytes, for ASCII text). Returns (chars,
+    table), where chars is sorted and table[i, j] is the number of chars[j]
+    in texts[i], or, if by_entry is False, table[j] is the total. If numpy is
+    not installed, the strings are counted with Counters and table is a list.
+    """
+    try:
+        import numpy
+    except ImportError:
+        if by_entry:
+            counters = [collections.Counter(text) for text in texts]
+            chars = sorted(set().union(*counters))
+            return chars, [[c[char] for char in chars] for c in counters]
+        else:
+            counter = collections.Counter("".join(texts))
+            chars = sorted(counter)
+            return chars, [counter[char] for char in chars]
+    text = "".join(texts)
+    try:
+        codes = numpy.frombuffer(text.encode("ascii"), dtype=numpy.uint8)
+        points = None
+        k = 256
+    except UnicodeEncodeError:
+        points = numpy.frombuffer(
+            text.encode("utf-32-le", "surrogatepass"), dtype=numpy.uint32
+        )
+        points, codes = numpy.unique(points, return_inverse=True)
+        k = len(points)
+    if by_entry:
+        n = len(texts)
+        lengths = numpy.fromiter(map(len, texts), dtype=numpy.int64, count=n)
+        # offset the codes of the ith string by i * k
+        codes = numpy.repeat(numpy.arange(0, n * k, k), lengths) + codes
+        table = numpy.bincount(codes, minlength=n * k).reshape(n, k)
+        present = table.any(axis=0).nonzero()[0]
+        table = table[:, present]
+    else:
+        table = numpy.bincount(codes, minlength=k)
+        present = table.nonzero()[0]
+        table = table[present]
+    if points is not None:
+        present = points[present]
+    return [chr(c) for c in present.tolist()], table
+
+
 def _sum_lower(counter):
     lc = [v for k, v in counter.items() if k in string.ascii_lowercase]
     return sum(lc)
@@ -598,10 +1565,15 @@ def _guess_type(counts):
     """
     Predict sequence type from character counts (dna|rna|prot|ambiguous|illegal)
     """
+    if isinstance(counts, FastaEntry):
+        counts = counts.seq
     if isinstance(counts, str):
-        counts = collections.Counter(counts)
-    elif isinstance(counts, FastaEntry):
-        counts = collections.Counter(counts.seq)
+        try:
+            data = counts.encode("ascii")
+        except UnicodeEncodeError:
+            counts = collections.Counter(counts)
+        else:
+            return _guess_ascii_type(data)
 
     # Convert all to upper case
     counts = _counter_caser(counts)
@@ -642,6 +1614,31 @@ def _guess_type(counts):
     return stype
 
 
+def _guess_ascii_type(seq):
+    """
+    _guess_type for an ASCII sequence (bytes), classified as _guess_type
+    classifies its character counts. Each test deletes the characters of an
+    alphabet from the sequence, in C, with bytes.translate.
+    """
+    t = _TypeTables
+    seq = seq.translate(t.UPPER, t.GAP)
+    n = len(seq)
+    if not seq.translate(None, t.DNA):
+        return "ambiguous" if n < 3 else "dna"
+    if not seq.translate(None, t.RNA):
+        return "rna"
+    is_prot = not seq.translate(None, t.PROT)
+    if len(seq.translate(None, t.PROT_EXC)) < n:
+        return "prot" if is_prot else "illegal"
+    if not is_prot:
+        return "illegal"
+    if (n - len(seq.translate(None, t.NUCL))) / n > 0.8:
+        if b"U" in seq:
+            return "illegal" if b"T" in seq else "rna"
+        return "dna"
+    return "ambiguous"
+
+
 def _headtailtrunk(seq, first=None, last=None):
     """
     This function is used by the Head and Tail classes to portray partial
@@ -686,6 +1683,176 @@ def _err(msg):
     sys.exit(msg)
 
 
+def _batches(gen, size):
+    """
+    Group an iterator into lists of at most size items
+    """
+    gen = iter(gen)
+    while True:
+        batch = list(itertools.islice(gen, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _suffix_array(text, block=2**20):
+    """
+    Sort the suffixes of text (bytes) by prefix doubling, in numpy arrays of
+    fixed width: 32-bit positions and ranks below 2**31 characters, 64-bit
+    above, so about 9 (or 17) bytes per character plus the temporaries of a
+    block.
+
+    Suffixes are first sorted by their leading 7 bytes, one first byte at a
+    time, into groups of equal prefixes. Then, as in Larsson and Sadakane's
+    qsufsort, only the groups of more than one suffix are sorted again, by
+    the rank of the suffix k places on, with k doubling each pass. The rank
+    of a suffix is the place in the array of the first suffix of its group,
+    so it is updated in place as groups split, and the groups are sorted in
+    blocks of about block suffixes. Without numpy, falls back to sorting
+    lists (see _suffix_array_lists), which takes about 150 bytes per
+    character.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return array("q", _suffix_array_lists(text))
+
+    n = len(text)
+    itype = numpy.int32 if n < 2**31 else numpy.int64
+    codes = numpy.frombuffer(text, dtype=numpy.uint8)
+    sa = numpy.empty(n, dtype=itype)
+    rank = numpy.empty(n, dtype=itype)
+    # the (first place, size) of every group of more than one suffix
+    groups = []
+
+    def split(places, keys):
+        """
+        Given the places of a run of sorted suffixes and their keys, rank
+        the suffixes by group and return the groups left to sort
+        """
+        new = numpy.empty(len(keys), dtype=bool)
+        new[0] = True
+        numpy.not_equal(keys[1:], keys[:-1], out=new[1:])
+        rank[sa[places]] = numpy.maximum.accumulate(numpy.where(new, places, 0))
+        heads = numpy.flatnonzero(new)
+        sizes = numpy.diff(numpy.append(heads, len(keys)))
+        more = sizes > 1
+        return places[heads[more]], sizes[more]
+
+    # sort by the leading 7 bytes, as 9-bit codes (byte + 1, or 0 past the
+    # end of text), by first byte
+    offset = 0
+    for c in numpy.flatnonzero(numpy.bincount(codes, minlength=256)):
+        pos = numpy.flatnonzero(codes == c).astype(itype)
+        keys = numpy.zeros(len(pos), dtype=numpy.uint64)
+        for j in range(7):
+            keys <<= numpy.uint64(9)
+            ahead = pos + j
+            inside = ahead < n
+            keys[inside] |= codes[ahead[inside]].astype(numpy.uint64) + 1
+        order = numpy.argsort(keys)
+        places = numpy.arange(offset, offset + len(pos), dtype=itype)
+        sa[places] = pos[order]
+        groups.append(split(places, keys[order]))
+        offset += len(pos)
+
+    k = 7
+    while groups:
+        firsts = numpy.concatenate([g[0] for g in groups])
+        sizes = numpy.concatenate([g[1] for g in groups])
+        groups = []
+        ends = numpy.cumsum(sizes)
+        i = 0
+        while i < len(sizes):
+            # a block of whole groups, at least one
+            j = max(int(numpy.searchsorted(ends, ends[i] - sizes[i] + block)), i + 1)
+            size = sizes[i:j]
+            total = int(size.sum())
+            starts = numpy.cumsum(size) - size
+            places = numpy.repeat((firsts[i:j] - starts).astype(itype), size)
+            places += numpy.arange(total, dtype=itype)
+            pos = sa[places]
+            # the rank of the suffix k on, or -1 past the end of text
+            ahead = pos.astype(numpy.int64) + k
+            after = numpy.full(total, -1, dtype=numpy.int64)
+            inside = ahead < n
+            after[inside] = rank[ahead[inside]]
+            # within each group, sort by it
+            keys = numpy.repeat(numpy.arange(j - i, dtype=numpy.int64), size)
+            keys *= n + 1
+            keys += after + 1
+            order = numpy.argsort(keys)
+            sa[places] = pos[order]
+            groups.append(split(places, keys[order]))
+            i = j
+        groups = [g for g in groups if len(g[0])]
+        k *= 2
+    return sa
+
+
+def _suffix_array_lists(text):
+    """
+    Sort the suffixes of text by prefix doubling: suffixes are first ranked by
+    their leading 16 characters, then the rank pairs (rank[i], rank[i + k])
+    are sorted with k doubling until every rank is distinct
+    """
+    n = len(text)
+    k = 16
+    sa = sorted(range(n), key=lambda i: text[i : i + k])
+    rank = [0] * n
+    r = 0
+    for j in range(1, n):
+        if text[sa[j] : sa[j] + k] != text[sa[j - 1] : sa[j - 1] + k]:
+            r += 1
+        rank[sa[j]] = r
+    while r < n - 1:
+        key = lambda i: (rank[i], rank[i + k] if i + k < n else -1)
+        sa.sort(key=key)
+        new = [0] * n
+        r = 0
+        for j in range(1, n):
+            if key(sa[j]) != key(sa[j - 1]):
+                r += 1
+            new[sa[j]] = r
+        rank = new
+        k *= 2
+    return sa
+
+
+def _gap_table(text):
+    """
+    Index the gap runs in an aligned sequence. Returns the ungapped position
+    at which each run of '-' begins and the cumulative gap length up to and
+    including that run. Built once per sequence, the table lets any ungapped
+    interval be mapped onto the gapped sequence by bisection.
+    """
+    starts = []
+    offsets = []
+    total = 0
+    for g in re.finditer(r"-+", text):
+        g0, g1 = g.span()
+        starts.append(g0 - total)
+        total += g1 - g0
+        offsets.append(total)
+    return (starts, offsets)
+
+
+def _gapped_span(table, a, b):
+    """
+    Map the ungapped interval [a, b) onto the gapped sequence indexed in table.
+    Gaps at or before the start shift the whole interval, gaps strictly inside
+    the interval extend its end.
+    """
+    starts, offsets = table
+    i = bisect.bisect_right(starts, a)
+    j = max(i, bisect.bisect_left(starts, b))
+    if i:
+        a += offsets[i - 1]
+    if j:
+        b += offsets[j - 1]
+    return (a, b)
+
+
 def ambiguous2perl(pattern):
     DNA_AMB = {
         "R": "AG",
@@ -798,8 +1965,254 @@ class Alphabet:
     RNA_UNK = set("N")
     RNA_AMB = set("RYSWKMDBHV")
     GAP = set(".-_")
+    # Named alphabets for `smof stat --alphabet`
+    NAMED = {
+        "dna": "".join(sorted(DNA | DNA_AMB | set("U") | GAP)),
+        "protein": "".join(sorted(PROT | PROT_AMB | GAP)),
+        "ascii": "".join(chr(i) for i in range(33, 127)),
+    }
     STOP = {"TAG", "TAA", "TGA", "UAG", "UAA", "UGA"}
     START = {"ATG", "AUG"}
+    # IUPAC nucleotide codes as 4-bit masks of the bases they allow
+    # (A=1, C=2, G=4, T/U=8)
+    IUPAC_MASKS = {
+        "A": 1,
+        "C": 2,
+        "G": 4,
+        "T": 8,
+        "U": 8,
+        "R": 5,
+        "Y": 10,
+        "S": 6,
+        "W": 9,
+        "K": 12,
+        "M": 3,
+        "B": 14,
+        "D": 13,
+        "H": 11,
+        "V": 7,
+        "N": 15,
+    }
+
+
+def _ascii_set(chars):
+    return "".join(sorted(chars)).encode("ascii")
+
+
+class _TypeTables:
+    # a translation table that upper cases ASCII
+    UPPER = bytes.maketrans(
+        string.ascii_lowercase.encode("ascii"), string.ascii_uppercase.encode("ascii")
+    )
+    GAP = _ascii_set(Alphabet.GAP)
+    DNA = _ascii_set(Alphabet.DNA)
+    RNA = _ascii_set(Alphabet.RNA)
+    PROT_EXC = _ascii_set(Alphabet.PROT_EXC)
+    PROT = _ascii_set(Alphabet.PROT | Alphabet.PROT_AMB)
+    NUCL = b"ACGTUN"
+    LETTERS = _ascii_set(string.ascii_letters)
+
+
+class IUPACPattern:
+    """
+    A nucleotide pattern matched by IUPAC ambiguity codes on both sides: a
+    pattern position matches a sequence position if the sets of bases they
+    allow intersect (so 'R' matches 'A', and 'A' matches 'N'). Matching is
+    case-insensitive and 'U' is read as 'T'.
+
+    Each base is a 4-bit mask. For every base, the sequence is encoded as an
+    integer bitset of the positions that allow it, and the hits are the bits
+    that survive ANDing the shifted bitset of every pattern position. This
+    runs in C-level integer operations, independent of the number of
+    ambiguous positions, but building the bitsets has a fixed cost per
+    sequence, and each hit is then found in Python. So the bitmask engine is
+    used only on sequences of at least MIN_LENGTH characters, for patterns
+    expected to hit at most once in 128 positions of a random sequence, and
+    with numpy installed (which builds the bitsets); otherwise the pattern
+    is matched with the equivalent regular expression (see regex).
+
+    Supports the search, match and finditer methods of compiled regular
+    expressions, so it can be used wherever GrepSearch uses a pattern.
+    """
+
+    MASKS = Alphabet.IUPAC_MASKS
+
+    # For each base bit, a byte table marking the characters that allow it
+    TABLES = [
+        bytes(
+            b"01"[bool(Alphabet.IUPAC_MASKS.get(chr(i).upper(), 0) & bit)]
+            for i in range(256)
+        )
+        for bit in (1, 2, 4, 8)
+    ]
+
+    # A byte table giving the base mask of each character
+    MASK_TABLE = bytes(Alphabet.IUPAC_MASKS.get(chr(i).upper(), 0) for i in range(256))
+
+    MIN_LENGTH = 2048
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.masks = [IUPACPattern.MASKS[c] for c in pattern.upper()]
+        self._regex = self.regex()
+        # the chance of a hit at a position of a uniform random sequence
+        rate = 1.0
+        for mask in self.masks:
+            rate *= bin(mask).count("1") / 4
+        try:
+            import numpy
+        except ImportError:
+            # the bitsets are then built in Python, slower than the regex
+            self.bitmask = False
+        else:
+            self.bitmask = rate <= 1 / 128
+
+    def __repr__(self):
+        return "IUPACPattern({!r})".format(self.pattern)
+
+    def __eq__(self, other):
+        return isinstance(other, IUPACPattern) and self.pattern == other.pattern
+
+    def __hash__(self):
+        return hash(self.pattern)
+
+    def regex(self):
+        """
+        The equivalent regular expression: each pattern position becomes the
+        class of every code, in either case, whose bases intersect its own
+        """
+        classes = []
+        for mask in self.masks:
+            codes = "".join(c for c, x in sorted(self.MASKS.items()) if x & mask)
+            classes.append("[{}{}]".format(codes, codes.lower()))
+        return re.compile("".join(classes))
+
+    @classmethod
+    def is_iupac(cls, pattern):
+        """
+        Tests if a pattern consists only of IUPAC nucleotide codes
+        """
+        return bool(pattern) and all(c in cls.MASKS for c in pattern.upper())
+
+    def hits(self, text):
+        """
+        Bitset of every position where the pattern matches (overlaps allowed)
+        """
+        bases = _iupac_bitsets(text)
+        columns = {}
+        hits = -1
+        for j, mask in enumerate(self.masks):
+            if mask not in columns:
+                column = 0
+                for k in range(4):
+                    if mask & (1 << k):
+                        column |= bases[k]
+                columns[mask] = column
+            hits &= columns[mask] >> j
+            if not hits:
+                break
+        return hits
+
+    def _use_bitmask(self, text):
+        return self.bitmask and len(text) >= IUPACPattern.MIN_LENGTH
+
+    def finditer(self, text):
+        if not self._use_bitmask(text):
+            return self._regex.finditer(text)
+        return self._finditer(text)
+
+    def _finditer(self, text):
+        hits = self.hits(text)
+        data = hits.to_bytes((hits.bit_length() + 7) // 8, "little")
+        m = len(self.masks)
+        i = _next_bit(data, 0)
+        while i != -1:
+            yield _IUPACMatch(text, i, i + m)
+            # hits are reported without overlap, as by re.finditer
+            i = _next_bit(data, i + m)
+
+    def search(self, text):
+        if not self._use_bitmask(text):
+            return self._regex.search(text)
+        hits = self.hits(text)
+        if hits:
+            i = (hits & -hits).bit_length() - 1
+            return _IUPACMatch(text, i, i + len(self.masks))
+        return None
+
+    def match(self, text):
+        if not self._use_bitmask(text):
+            return self._regex.match(text)
+        if self.hits(text) & 1:
+            return _IUPACMatch(text, 0, len(self.masks))
+        return None
+
+
+class _IUPACMatch:
+    """
+    The parts of a regular expression match object used by GrepSearch
+    """
+
+    def __init__(self, text, start, end):
+        self.string = text
+        self._span = (start, end)
+
+    def start(self, group=0):
+        return self._span[0]
+
+    def end(self, group=0):
+        return self._span[1]
+
+    def span(self, group=0):
+        return self._span
+
+    def group(self, group=0):
+        return self.string[self._span[0] : self._span[1]]
+
+
+@functools.lru_cache(maxsize=2)
+def _iupac_bitsets(text):
+    """
+    Encode a sequence as four integer bitsets (A, C, G, T), where bit i is set
+    if the character at position i allows that base. The two most recent
+    sequences are cached, so several patterns, or a forward and reverse
+    strand, share the encoding.
+    """
+    data = text.encode("ascii", "replace")
+    try:
+        import numpy
+    except ImportError:
+        data = data[::-1]
+        return [int(data.translate(table) or b"0", 2) for table in IUPACPattern.TABLES]
+    # the base masks of the characters, packed a bit per position
+    masks = numpy.frombuffer(data.translate(IUPACPattern.MASK_TABLE), dtype=numpy.uint8)
+    del data
+    bitsets = []
+    for bit in (1, 2, 4, 8):
+        packed = numpy.packbits(masks & bit, bitorder="little")
+        bitsets.append(int.from_bytes(packed.tobytes(), "little"))
+    return bitsets
+
+
+_NONZERO_BYTE = re.compile(b"[^\x00]")
+
+
+def _next_bit(data, start):
+    """
+    The position of the first set bit at or after start in a bitset stored
+    as little-endian bytes, or -1. Zero bytes are skipped by a (C-level)
+    regular expression search.
+    """
+    k = start // 8
+    if k < len(data):
+        byte = data[k] >> (start % 8)
+        if byte:
+            return start + (byte & -byte).bit_length() - 1
+    found = _NONZERO_BYTE.search(data, k + 1)
+    if found is None:
+        return -1
+    byte = data[found.start()]
+    return 8 * found.start() + (byte & -byte).bit_length() - 1
 
 
 class Colors:
@@ -960,10 +2373,221 @@ class ColorString:
         return new_obj
 
 
+class CompactHashSet:
+    """
+    An exact set of 64-bit hashes, kept in an open addressing table (linear
+    probing) of 8-byte slots that is at most half full. A zero slot is
+    empty, so a hash of zero is stored as one.
+    """
+
+    def __init__(self, capacity=1024):
+        # capacity must be a power of two
+        self.table = array("Q", bytes(8 * capacity))
+        self.size = 0
+
+    def add(self, h):
+        h = h or 1
+        table = self.table
+        mask = len(table) - 1
+        i = h & mask
+        x = table[i]
+        while x:
+            if x == h:
+                return
+            i = (i + 1) & mask
+            x = table[i]
+        table[i] = h
+        self.size += 1
+        if 2 * self.size > len(table):
+            self._grow()
+
+    def _grow(self):
+        old = self.table
+        table = self.table = array("Q", bytes(16 * len(old)))
+        mask = len(table) - 1
+        for h in old:
+            if h:
+                i = h & mask
+                while table[i]:
+                    i = (i + 1) & mask
+                table[i] = h
+
+    def update(self, hashes):
+        for h in hashes:
+            if h:
+                self.add(h)
+
+    def merge(self, other):
+        self.update(other)
+        return self
+
+    def __iter__(self):
+        return (h for h in self.table if h)
+
+    def __len__(self):
+        return self.size
+
+    def to_dict(self):
+        return {"type": "exact", "hashes": list(self)}
+
+    @classmethod
+    def from_dict(cls, d):
+        hashes = cls()
+        hashes.update(d["hashes"])
+        return hashes
+
+
+class DigestIndex:
+    """
+    Numbers distinct 128-bit digests (16 bytes) 0, 1, 2, ... in the order
+    they are first added. The digests are kept in two arrays of 64-bit
+    halves, in order, and found through an open addressing table (linear
+    probing) of 4-byte slots, each empty (zero) or holding a number plus
+    one, that is at most half full: about 24 bytes per digest in all.
+    """
+
+    _HALVES = struct.Struct("<QQ")
+
+    def __init__(self, capacity=1024):
+        # capacity must be a power of two
+        self.high = array("Q")
+        self.low = array("Q")
+        self.slots = array("I", bytes(4 * capacity))
+
+    def add(self, digest):
+        """
+        Return the number of a digest, and whether it was new
+        """
+        low, high = self._HALVES.unpack(digest)
+        slots = self.slots
+        mask = len(slots) - 1
+        i = low & mask
+        k = slots[i]
+        while k:
+            if self.low[k - 1] == low and self.high[k - 1] == high:
+                return k - 1, False
+            i = (i + 1) & mask
+            k = slots[i]
+        n = len(self.low)
+        self.high.append(high)
+        self.low.append(low)
+        slots[i] = n + 1
+        if 2 * (n + 1) > len(slots):
+            self._grow()
+        return n, True
+
+    def _grow(self):
+        slots = self.slots = array("I", bytes(8 * len(self.slots)))
+        mask = len(slots) - 1
+        for k, low in enumerate(self.low, 1):
+            i = low & mask
+            while slots[i]:
+                i = (i + 1) & mask
+            slots[i] = k
+
+    def __len__(self):
+        return len(self.low)
+
+
+class DistinctCount:
+    """
+    The number of distinct hashes in a set whose members were not kept, as
+    in a finished FastaDescription; it cannot be merged
+    """
+
+    def __init__(self, size=0):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def to_dict(self):
+        return {"type": "count", "size": self.size}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["size"])
+
+
+class HyperLogLog:
+    """
+    An approximate count of distinct 64-bit hashes (Flajolet et al., 2007) in
+    2^p one-byte registers. The relative standard error is 1.04 / 2^(p/2),
+    0.8% for the default p=14 (16kB).
+    """
+
+    def __init__(self, p=14):
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def add(self, h):
+        # the first p bits choose the register, which keeps the largest
+        # position of the first one bit seen in the remaining bits
+        rest = 64 - self.p
+        i = h >> rest
+        rank = rest - (h & ((1 << rest) - 1)).bit_length() + 1
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def merge(self, other):
+        if other.p != self.p:
+            _err("Cannot merge distinct counts of different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small counts
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+    def __len__(self):
+        return round(self.estimate())
+
+    def to_dict(self):
+        return {"type": "hll", "p": self.p, "registers": self.registers.hex()}
+
+    @classmethod
+    def from_dict(cls, d):
+        hll = cls(p=d["p"])
+        hll.registers = bytearray.fromhex(d["registers"])
+        return hll
+
+
+def _digest128(header, seq):
+    """
+    A 128-bit digest (16 bytes) of the header and sequence of an entry
+    """
+    digest = hashlib.md5()
+    digest.update(header.encode("utf-8", "surrogatepass"))
+    # neither a header nor a sequence contains a newline
+    digest.update(b"\n")
+    digest.update(seq.encode("utf-8", "surrogatepass"))
+    return digest.digest()
+
+
+def _hash64(text):
+    """
+    A 64-bit hash of a header or sequence
+    """
+    digest = hashlib.md5(text.encode("utf-8", "surrogatepass")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
 class FastaDescription:
-    def __init__(self):
-        self.seqs = set()
-        self.headers = set()
+    def __init__(self, approx=False):
+        # hashes of the sequences and headers, to count the distinct ones
+        # exactly (about 16-32 bytes each) or approximately (in 16kB)
+        self.approx = approx
+        # True if this describes a sample of the input (see sniff_sample)
+        self.sampled = False
+        distinct = HyperLogLog if approx else CompactHashSet
+        self.seqs = distinct()
+        self.headers = distinct()
         self.ntype = {"prot": 0, "dna": 0, "rna": 0, "illegal": 0, "ambiguous": 0}
         self.ncase = {"uppercase": 0, "lowercase": 0, "mixedcase": 0}
         self.pfeat = {
@@ -982,39 +2606,36 @@ class FastaDescription:
         Calculates properties for one sequence
         @type seq: FastaEntry object
         """
-        # Add md5 hashes of sequences and headers to respective sets
-        self.seqs.update([hashlib.md5(bytes(seq.seq, "ascii")).digest()])
-        self.headers.update([hashlib.md5(bytes(seq.header, "ascii")).digest()])
+        self.seqs.add(_hash64(seq.seq))
+        self.headers.add(_hash64(seq.header))
 
-        counts = collections.Counter(seq.seq)
+        # The one pass over the characters, shared by every test below
+        chars = _char_set(seq.seq)
 
         # Ungapped the sequence is required for downstream analysis
-        is_gapped = self._handle_gaps(seq, counts)
-        if is_gapped:
+        if self._handle_gaps(chars):
             seq.ungap()
-            counts = collections.Counter(seq.seq)
+            chars -= Alphabet.GAP
 
-        scase = self._handle_case(counts)
-        # Sum upper and lowercase
-        if scase not in "upper":
-            counts = _counter_caser(counts)
+        self._handle_case(chars)
+        chars = {c.upper() for c in chars}
 
         s = seq.seq.upper()
 
         # ('prot'|'dna'|'rna'|'amb'|'bad')
-        stype = self._handle_type(counts)
+        stype = self._handle_type(seq.seq)
 
         if stype == "prot":
-            tstop = "*" == s[-1]
+            tstop = s[-1:] == "*"
             self.pfeat["terminal-stop"] += tstop
-            self.pfeat["internal-stop"] += (counts["*"] - tstop) > 0
-            self.pfeat["selenocysteine"] += "U" in counts
-            self.pfeat["initial-Met"] += "M" == s[0]
-            self.ufeat["unknown"] += "X" in counts
-            self.ufeat["ambiguous"] += bool(Alphabet.PROT_AMB & set(counts))
+            self.pfeat["internal-stop"] += s.find("*", 0, len(s) - 1) != -1
+            self.pfeat["selenocysteine"] += "U" in chars
+            self.pfeat["initial-Met"] += s[:1] == "M"
+            self.ufeat["unknown"] += "X" in chars
+            self.ufeat["ambiguous"] += bool(Alphabet.PROT_AMB & chars)
         elif stype in ("dna", "rna"):
-            self.ufeat["unknown"] += bool("N" in counts)
-            self.ufeat["ambiguous"] += bool(Alphabet.DNA_AMB & set(counts))
+            self.ufeat["unknown"] += "N" in chars
+            self.ufeat["ambiguous"] += bool(Alphabet.DNA_AMB & chars)
 
             start = self._has_start(s)
             stop = self._has_stop(s)
@@ -1024,14 +2645,69 @@ class FastaDescription:
             profile = "".join([str(int(x)) for x in (start, stop, triple, sense)])
             self.nfeat[profile] += 1
 
+    def merge(self, other):
+        """
+        Add the description of another part of the same input. Exact
+        descriptions can be merged into approximate ones, but not the reverse.
+        """
+        if DistinctCount in (type(self.seqs), type(other.seqs)):
+            _err("Cannot merge finished distinct counts")
+        if other.approx and not self.approx:
+            _err("Cannot merge approximate distinct counts into exact ones")
+        if self.approx and not other.approx:
+            for h in other.seqs:
+                self.seqs.add(h)
+            for h in other.headers:
+                self.headers.add(h)
+        else:
+            self.seqs.merge(other.seqs)
+            self.headers.merge(other.headers)
+        for name in ("ntype", "ncase", "pfeat", "nfeat", "ufeat"):
+            d = getattr(self, name)
+            for k, v in getattr(other, name).items():
+                d[k] += v
+        return self
+
+    def to_dict(self, finished=False):
+        """
+        The description as JSON data. If finished, exact sets of hashes are
+        replaced by their sizes (see DistinctCount), as in FastaStat.to_dict.
+        """
+        d = {"format": "smof-sniff", "version": 1}
+        for name in ("ntype", "ncase", "pfeat", "nfeat", "ufeat"):
+            d[name] = getattr(self, name)
+        for name in ("seqs", "headers"):
+            distinct = getattr(self, name)
+            if finished and isinstance(distinct, CompactHashSet):
+                distinct = DistinctCount(len(distinct))
+            d[name] = distinct.to_dict()
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        if d.get("format") != "smof-sniff" or d.get("version") != 1:
+            _err("Not a smof sniff partial (version 1)")
+        distinct = {
+            "exact": CompactHashSet,
+            "hll": HyperLogLog,
+            "count": DistinctCount,
+        }[d["seqs"]["type"]]
+        seqsum = cls(approx=distinct is HyperLogLog)
+        for name in ("ntype", "ncase", "pfeat", "nfeat", "ufeat"):
+            getattr(seqsum, name).update(d[name])
+        seqsum.seqs = distinct.from_dict(d["seqs"])
+        seqsum.headers = distinct.from_dict(d["headers"])
+        return seqsum
+
     def get_nseqs(self):
         return sum(self.ntype.values())
 
     def count_degenerate_headers(self):
-        return self.get_nseqs() - len(self.headers)
+        # an estimate may exceed the true count
+        return max(0, self.get_nseqs() - len(self.headers))
 
     def count_degenerate_seqs(self):
-        return self.get_nseqs() - len(self.seqs)
+        return max(0, self.get_nseqs() - len(self.seqs))
 
     @classmethod
     def _has_start(cls, s):
@@ -1054,24 +2730,30 @@ class FastaDescription:
         """
         return len(s) % 3 == 0
 
+    # matches up to the first STOP codon in the first frame
+    _FIRST_STOP = re.compile(
+        "(?:...)*?(?:{})".format("|".join(sorted(Alphabet.STOP))), re.DOTALL
+    )
+
     @classmethod
     def _is_sense(cls, s):
         """
-        Tests if there are no internal STOP codons in the first frame
+        Tests if there are no internal STOP codons in the first frame,
+        assumes uppercase
         """
-        codons = set(s[i : i + 3] for i in range(0, len(s) - 3, 3))
-        return bool(not codons & Alphabet.STOP)
+        m = cls._FIRST_STOP.match(s)
+        return m is None or m.end() == len(s)
 
-    def _handle_gaps(self, seq, counts):
+    def _handle_gaps(self, chars):
         # Handle gaps
-        if Alphabet.GAP & set(counts):
+        if Alphabet.GAP & chars:
             self.ufeat["gapped"] += 1
             return True
         return False
 
-    def _handle_case(self, counts):
-        has_lower = set(string.ascii_lowercase) & set(counts)
-        has_upper = set(string.ascii_uppercase) & set(counts)
+    def _handle_case(self, chars):
+        has_lower = set(string.ascii_lowercase) & chars
+        has_upper = set(string.ascii_uppercase) & chars
         if has_lower and has_upper:
             case = "mixedcase"
         elif has_lower:
@@ -1081,8 +2763,8 @@ class FastaDescription:
         self.ncase[case] += 1
         return case
 
-    def _handle_type(self, counts):
-        stype = _guess_type(counts)
+    def _handle_type(self, seq):
+        stype = _guess_type(seq)
         self.ntype[stype] += 1
         return stype
 
@@ -1093,14 +2775,26 @@ class FastaDescription:
         result = []
 
         # Print number of uniq and total sequences
-        if self.count_degenerate_seqs():
+        if self.sampled:
+            result.append(
+                "Sampled {} sequences (with 95% confidence intervals)".format(nseqs)
+            )
+        elif self.approx:
+            uniq = nseqs - self.count_degenerate_seqs()
+            result.append("about {} uniq sequences ({} total)".format(uniq, nseqs))
+        elif self.count_degenerate_seqs():
             uniq = nseqs - self.count_degenerate_seqs()
             result.append("{} uniq sequences ({} total)".format(uniq, nseqs))
         else:
             result.append("Total sequences: {}".format(nseqs))
 
         # Warn if there are any duplicate headers
-        if self.count_degenerate_headers():
+        if self.sampled:
+            pass
+        elif self.approx:
+            uniq = nseqs - self.count_degenerate_headers()
+            result.append("about {} uniq headers".format(uniq))
+        elif self.count_degenerate_headers():
             uniq = nseqs - self.count_degenerate_headers()
             result.append("WARNING: headers are not unique ({}/{})".format(uniq, nseqs))
 
@@ -1108,6 +2802,12 @@ class FastaDescription:
         if self.ntype["illegal"]:
             result.append("WARNING: illegal characters found")
 
+        def write_count(k, v, N):
+            line = "  {:<20} {:<10} {:>7.4%}".format(k + ":", v, v / N)
+            if self.sampled:
+                line += "  ({:.1%}-{:.1%})".format(*_wilson_interval(v, N))
+            result.append(line)
+
         def write_dict(d, name, N):
             # Print keys if value is greater than 0
             uniq = [[k, v] for k, v in d.items() if v > 0]
@@ -1118,57 +2818,461 @@ class FastaDescription:
             else:
                 result.append("{}:".format(name))
                 for k, v in sorted(uniq, key=lambda x: -x[1]):
-                    result.append("  {:<20} {:<10} {:>7.4%}".format(k + ":", v, v / N))
+                    write_count(k, v, N)
+
+        def write_feat(d, text, N, drop=False):
+            # If no sequences are of this type (e.g. 'prot'), do nothing
+            if N == 0:
+                return
+            result.append("%s" % text)
+            # Sort the dictionary by value
+            for k, v in sorted(list(d.items()), key=lambda x: -x[1]):
+                # If the key is represented, print its count and proportion
+                if (drop and v != 0) or not drop:
+                    write_count(k, v, N)
+
+        write_dict(self.ntype, "Sequence types", nseqs)
+        write_dict(self.ncase, "Sequences cases", nseqs)
+
+        nnucl = self.ntype["dna"] + self.ntype["rna"]
+        nprot = self.ntype["prot"]
+        write_feat(self.nfeat, "Nucleotide Features", nnucl, drop=True)
+        write_feat(self.pfeat, "Protein Features:", nprot)
+        write_feat(self.ufeat, "Universal Features:", nseqs)
+
+        result.append("")
+
+        return "\n".join(result)
+
+
+class QuantileSketch:
+    """
+    A KLL quantile sketch (Karnin, Lang and Liberty, 2016) of a stream of
+    numbers, held in a fixed amount of memory (a few times k items). Items
+    are kept in levels, an item on level h standing for 2^h of the input.
+    When a level is full it is sorted and every other item, starting at a
+    random offset, is promoted to the next level. With the default k=200,
+    the rank of an estimated quantile is within 1% of the number of items,
+    with high probability. Sketches of different streams can be merged.
+    """
+
+    def __init__(self, k=200, seed=42):
+        import random
+
+        self.k = k
+        self.n = 0
+        self.levels = [[]]
+        self._random = random.Random(seed)
+
+    def _capacity(self, h):
+        # the top level holds k items, each level below it 2/3 as many
+        return int(math.ceil(self.k * (2 / 3) ** (len(self.levels) - h - 1))) + 1
+
+    def _full(self):
+        size = sum(len(level) for level in self.levels)
+        return size >= sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _compress(self):
+        while self._full():
+            for h, level in enumerate(self.levels):
+                if len(level) >= self._capacity(h):
+                    if h + 1 == len(self.levels):
+                        self.levels.append([])
+                    level.sort()
+                    # an odd item out stays on this level
+                    keep = [level.pop()] if len(level) % 2 else []
+                    offset = self._random.randrange(2)
+                    self.levels[h + 1].extend(level[offset::2])
+                    self.levels[h] = keep
+                    break
+
+    def update(self, x):
+        self.levels[0].append(x)
+        self.n += 1
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def extend(self, xs):
+        n = len(self.levels[0])
+        self.levels[0].extend(xs)
+        self.n += len(self.levels[0]) - n
+        self._compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in zip(self.levels, other.levels):
+            level.extend(items)
+        self.n += other.n
+        self._compress()
+
+    def weighted(self):
+        """
+        The retained items, sorted, each paired with the number of input
+        items it stands for
+        """
+        return sorted((x, 2**h) for h, level in enumerate(self.levels) for x in level)
+
+    def quantile(self, q):
+        if len(self.levels) == 1 and self.levels[0]:
+            # nothing has been compacted yet, so the quantile is exact
+            return _quantile(self.levels[0], q)
+        items = self.weighted()
+        if not items:
+            return float("nan")
+        target = q * sum(w for x, w in items)
+        rank = 0
+        for x, w in items:
+            rank += w
+            if rank >= target:
+                return x
+        return items[-1][0]
+
+    def to_dict(self):
+        return {"k": self.k, "n": self.n, "levels": self.levels}
+
+    @classmethod
+    def from_dict(cls, d):
+        sketch = cls(k=d["k"])
+        sketch.n = d["n"]
+        sketch.levels = [list(level) for level in d["levels"]]
+        return sketch
+
+
+class LengthHistogram:
+    """
+    Counts of lengths in log-scale buckets, held in a bounded amount of memory
+    (a few hundred kB for lengths up to 2^64). Lengths below 1024 each have
+    their own bucket; a longer length shares its bucket with those that agree
+    in their leading 10 bits, so there are 512 buckets, each 0.2% wide, per
+    doubling. The buckets are re-binned into display columns by columns().
+    The total length in each bucket is kept as well, which places the N50.
+    """
+
+    def __init__(self):
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
 
-        def write_feat(d, text, N, drop=False):
-            # If no sequences are of this type (e.g. 'prot'), do nothing
-            if N == 0:
-                return
-            result.append("%s" % text)
-            # Sort the dictionary by value
-            for k, v in sorted(list(d.items()), key=lambda x: -x[1]):
-                # If the key is represented, print its count and proportion
-                if (drop and v != 0) or not drop:
-                    result.append("  {:<20} {:<10} {:>7.4%}".format(k + ":", v, v / N))
+        # the count and total length of bucket i, in numpy arrays if numpy is
+        # installed
+        if numpy is None:
+            self.counts = []
+            self.sums = []
+        else:
+            self.counts = numpy.zeros(0, dtype=numpy.int64)
+            self.sums = numpy.zeros(0, dtype=numpy.int64)
+
+    def _reserve(self, size):
+        if size <= len(self.counts):
+            return
+        if isinstance(self.counts, list):
+            self.counts.extend([0] * (size - len(self.counts)))
+            self.sums.extend([0] * (size - len(self.sums)))
+        else:
+            import numpy
 
-        write_dict(self.ntype, "Sequence types", nseqs)
-        write_dict(self.ncase, "Sequences cases", nseqs)
+            counts = numpy.zeros(size, dtype=numpy.int64)
+            counts[: len(self.counts)] = self.counts
+            self.counts = counts
+            sums = numpy.zeros(size, dtype=numpy.int64)
+            sums[: len(self.sums)] = self.sums
+            self.sums = sums
+
+    def update(self, lengths):
+        if isinstance(self.counts, list):
+            for x in lengths:
+                shift = max(x.bit_length() - 10, 0)
+                i = shift * 512 + (x >> shift)
+                if i >= len(self.counts):
+                    self._reserve(i + 1)
+                self.counts[i] += 1
+                self.sums[i] += x
+        elif len(lengths):
+            import numpy
 
-        nnucl = self.ntype["dna"] + self.ntype["rna"]
-        nprot = self.ntype["prot"]
-        write_feat(self.nfeat, "Nucleotide Features", nnucl, drop=True)
-        write_feat(self.pfeat, "Protein Features:", nprot)
-        write_feat(self.ufeat, "Universal Features:", nseqs)
+            x = numpy.asarray(lengths, dtype=numpy.int64)
+            # frexp gives the bit length of each (positive) integer
+            shift = numpy.maximum(numpy.frexp(x)[1] - 10, 0)
+            i = shift * 512 + (x >> shift)
+            counts = numpy.bincount(i)
+            # float64 sums of integer lengths are exact below 2^53
+            sums = numpy.bincount(i, weights=x).astype(numpy.int64)
+            self._reserve(len(counts))
+            self.counts[: len(counts)] += counts
+            self.sums[: len(sums)] += sums
+
+    def merge(self, other):
+        self._reserve(len(other.counts))
+        for i, count in other.items():
+            self.counts[i] += count
+            self.sums[i] += int(other.sums[i])
+        return self
+
+    def items(self):
+        """
+        The (bucket, count) pairs of the nonempty buckets
+        """
+        counts = self.counts
+        if not isinstance(counts, list):
+            counts = counts.tolist()
+        return [(i, count) for i, count in enumerate(counts) if count]
 
-        result.append("")
+    @staticmethod
+    def bucket_range(i):
+        """
+        The least and greatest length in bucket i
+        """
+        if i < 1024:
+            return i, i
+        shift = i // 512 - 1
+        top = i - shift * 512
+        return top << shift, ((top + 1) << shift) - 1
 
-        return "\n".join(result)
+    def columns(self, low, high, width, log=False):
+        """
+        Count the lengths (or log2 lengths) in width equal columns between the
+        least and greatest length, low and high. The count of a bucket that
+        spans several columns is spread evenly over them.
+        """
+        buckets = self.items()
+        if log and buckets and buckets[0][0] == 0:
+            # zero lengths have no log
+            buckets = buckets[1:]
+        if not buckets:
+            return [0] * width
+        low = max(low, self.bucket_range(buckets[0][0])[0])
+
+        def scale(x):
+            return math.log2(x) if log else x
+
+        # as in numpy.histogram, a single value is centered in its range
+        lo, hi = scale(low), scale(high)
+        if lo == hi:
+            lo, hi = lo - 0.5, hi + 0.5
+        step = (hi - lo) / width
+
+        def column(x):
+            return min(width - 1, int((x - lo) / step))
+
+        y = [0] * width
+        for i, count in buckets:
+            a, b = self.bucket_range(i)
+            a, b = scale(max(a, low)), scale(min(b, high))
+            if a == b:
+                y[column(a)] += count
+                continue
+            for j in range(column(a), column(b) + 1):
+                overlap = min(b, lo + (j + 1) * step) - max(a, lo + j * step)
+                y[j] += count * max(overlap, 0) / (b - a)
+        return y
+
+    def N50(self):
+        """
+        The N50 of the lengths: the bucket in which the cumulative length,
+        summing from the longest, first exceeds half the total is known
+        exactly, so the mean length of that bucket is within its width (0.2%)
+        of the N50, and is exact below 1024 or if the bucket holds one length
+        """
+        buckets = self.items()
+        half = sum(int(self.sums[i]) for i, count in buckets) / 2
+        total = 0
+        for i, count in reversed(buckets):
+            total += int(self.sums[i])
+            if total > half:
+                return int(self.sums[i]) // count
+        return float("nan")
+
+    def to_dict(self):
+        # JSON object keys are strings
+        return {str(i): [count, int(self.sums[i])] for i, count in self.items()}
+
+    @classmethod
+    def from_dict(cls, d):
+        hist = cls()
+        items = sorted((int(i), count, total) for i, (count, total) in d.items())
+        if items:
+            hist._reserve(items[-1][0] + 1)
+        for i, count, total in items:
+            hist.counts[i] += count
+            hist.sums[i] += total
+        return hist
 
 
 class FastaStat:
-    def __init__(self):
+    def __init__(self, approx=False):
         self.counts = collections.Counter()
         self.nseqs = 0
-        self.lengths = []
+        self.total = 0
+        # for histograms
+        self.hist = LengthHistogram()
+        # the summary of the lengths (see _summary) of statistics loaded in
+        # their finished form, without the lengths, which cannot be merged
+        self.summary = None
+        if approx:
+            # lengths are summarized in fixed memory: the quantiles by a
+            # sketch, the N50 from the length buckets, the rest exactly
+            self.lengths = None
+            self.sketch = QuantileSketch()
+            self.min = None
+            self.max = None
+            # running mean and sum of squared deviations (Welford)
+            self.mean = 0.0
+            self.m2 = 0.0
+        else:
+            # 64-bit integers, 8 bytes per sequence
+            self.lengths = array("q")
+            self.sketch = None
+
+    def _add_lengths(self, lengths):
+        self.hist.update(lengths)
+        if self.sketch is None:
+            self.lengths.extend(lengths)
+            self.nseqs += len(lengths)
+            self.total += sum(lengths)
+        elif lengths:
+            self.sketch.extend(lengths)
+            mean = sum(lengths) / len(lengths)
+            m2 = sum((x - mean) ** 2 for x in lengths)
+            self._add_moments(
+                len(lengths), sum(lengths), mean, m2, min(lengths), max(lengths)
+            )
+
+    def _add_moments(self, n, total, mean, m2, low, high):
+        """
+        Fold the summary of n more lengths into the running statistics (Chan
+        et al.)
+        """
+        N = self.nseqs + n
+        delta = mean - self.mean
+        self.mean += delta * n / N
+        self.m2 += m2 + delta**2 * self.nseqs * n / N
+        self.nseqs = N
+        self.total += total
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
 
     def add_seq(self, stat):
         if stat.counts:
-            self.counts += stat.counts
-        self.nseqs += 1
-        self.lengths.append(stat.length)
+            self.counts.update(stat.counts)
+        self._add_lengths([stat.length])
+
+    def add_batch(self, seqs, count=True):
+        """
+        Add a list of FastaEntry objects, counting all their characters with
+        one numpy.bincount call where possible
+        """
+        texts = [seq.seq for seq in seqs]
+        if count:
+            chars, table = _char_counts(texts, by_entry=False)
+            if not isinstance(table, list):
+                table = table.tolist()
+            self.counts.update(dict(zip(chars, table)))
+        self._add_lengths([len(text) for text in texts])
+
+    def merge(self, other):
+        """
+        Add the statistics of another FastaStat, for example of another part
+        of the same input. Exact statistics can be merged into approximate
+        ones, but not the reverse.
+        """
+        if self.summary is not None or other.summary is not None:
+            _err("Cannot merge finished length statistics")
+        self.counts.update(other.counts)
+        if other.sketch is None:
+            self._add_lengths(other.lengths)
+        elif self.sketch is None:
+            _err("Cannot merge approximate length statistics into exact ones")
+        elif other.nseqs:
+            self.hist.merge(other.hist)
+            self.sketch.merge(other.sketch)
+            self._add_moments(
+                other.nseqs, other.total, other.mean, other.m2, other.min, other.max
+            )
+        return self
+
+    def counted(self):
+        """
+        Test whether the characters of every sequence were counted
+        """
+        return sum(self.counts.values()) == self.total
+
+    def to_dict(self, finished=False):
+        """
+        The statistics as JSON data. If finished, exact lengths are replaced
+        by their summary, which is all a report on this input alone needs,
+        and takes a fixed size, but which cannot be merged with others.
+        """
+        d = {
+            "format": "smof-stat",
+            "version": 1,
+            "counts": dict(self.counts),
+            "nseqs": self.nseqs,
+            "total": self.total,
+            "hist": self.hist.to_dict(),
+        }
+        if self.summary is not None:
+            d["summary"] = self.summary
+        elif self.sketch is None and finished and self.nseqs > 1:
+            d["summary"] = self._summary()
+        elif self.sketch is None:
+            d["lengths"] = self.lengths.tolist()
+        else:
+            d["sketch"] = self.sketch.to_dict()
+            d.update(min=self.min, max=self.max, mean=self.mean, m2=self.m2)
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        if d.get("format") != "smof-stat" or d.get("version") != 1:
+            _err("Not a smof stat partial (version 1)")
+        g = cls(approx="sketch" in d)
+        g.counts.update(d["counts"])
+        g.nseqs = d["nseqs"]
+        g.total = d["total"]
+        if "summary" in d:
+            g.lengths = None
+            g.summary = d["summary"]
+        elif g.sketch is None:
+            g.lengths.extend(d["lengths"])
+        else:
+            g.sketch = QuantileSketch.from_dict(d["sketch"])
+            g.min, g.max, g.mean, g.m2 = d["min"], d["max"], d["mean"], d["m2"]
+        if "hist" in d:
+            g.hist = LengthHistogram.from_dict(d["hist"])
+        elif g.sketch is None:
+            g.hist.update(g.lengths)
+        return g
+
+    def _summary(self):
+        if self.summary is not None:
+            return self.summary
+        if self.sketch is None:
+            return _summary(self.lengths)
+        return {
+            "min": self.min,
+            "max": self.max,
+            "1st_qu": self.sketch.quantile(0.25),
+            "median": self.sketch.quantile(0.5),
+            "3rd_qu": self.sketch.quantile(0.75),
+            "mean": self.mean,
+            "sd": (self.m2 / (self.nseqs - 1)) ** 0.5,
+            "N50": self.hist.N50(),
+            "total": self.total,
+        }
 
     def get_length(self):
         lines = []
-        total = sum(self.lengths)
-        N = len(self.lengths)
+        N = self.nseqs
         if N > 1:
-            s = _summary(self.lengths)
+            s = self._summary()
 
             # Yield total number of sequences
-            lines.append("{:10s} {}".format("nseq:", len(self.lengths)))
+            lines.append("{:10s} {}".format("nseq:", N))
 
             # lines.append totla number of letters
-            lines.append("{:10s} {}".format("nchars:", sum(self.lengths)))
+            lines.append("{:10s} {}".format("nchars:", s["total"]))
 
             # lines.append five number summary of sequence lengths
             fivesum = [
@@ -1185,29 +3289,32 @@ class FastaStat:
 
             # lines.append N50
             lines.append("{:10s} {}".format("N50:", s["N50"]))
+        elif self.sketch is not None:
+            lines.append("nchars: {}".format(self.total if N else ""))
         else:
             lstr = ", ".join([str(x) for x in sorted(self.lengths)])
             lines.append("nchars: {}".format(lstr))
         return "\n".join(lines)
 
     def get_hist(self, title=None, height=10, width=60, log=False):
+        """
+        Draw a histogram of the lengths (or log2 lengths) from the length
+        buckets counted in the pass, which are exact below 1024
+        """
         lines = []
-        try:
-            import numpy
-        except ImportError:
-            _err("Please install numpy (needed for histograms)")
-
         if title:
             lines.append("")
             lines.append(title)
 
-        if log:
-            lengths = [math.log(x, 2) for x in self.lengths]
+        if self.summary is not None:
+            low, high = self.summary["min"], self.summary["max"]
+        elif self.sketch is not None:
+            low, high = self.min, self.max
         else:
-            lengths = self.lengths
-
-        y = numpy.histogram(lengths, bins=width)[0]
-        y = [height * x / max(y) for x in y]
+            low, high = min(self.lengths, default=0), max(self.lengths, default=0)
+        y = self.hist.columns(low, high, width, log=log)
+        top = max(y) or 1
+        y = [height * x / top for x in y]
 
         for row in reversed(range(height)):
             out = "".join([_ascii_histchar(h - row) for h in y])
@@ -1222,11 +3329,15 @@ class FastaStat:
 
         colorAA = ColorAA()
         aacols = []
+        counts = self.counts
+        if not case_sensitive:
+            counts = _counter_caser(counts)
+        maxcount = max(counts.values())
         for chars, group, color in colorAA.group:
             for c in chars:
                 if not case_sensitive and c.islower():
                     continue
-                cheight = height * self.counts[c] / max(self.counts.values())
+                cheight = height * counts[c] / maxcount
                 aacols.append([c, cheight, color])
         # Draw histogram
         for row in reversed(range(height)):
@@ -1248,16 +3359,17 @@ class FastaStat:
         proportion=False,
     ):
         lines = []
-        lower = _sum_lower(self.counts) if count_lower else None
+        chars = self.counts
+        lower = _sum_lower(chars) if count_lower else None
         if not case_sensitive:
-            self.counts = _counter_caser(self.counts)
+            chars = _counter_caser(chars)
 
         if type:
-            lines.append(_guess_type(self.counts))
+            lines.append(_guess_type(chars))
 
-        N = sum(self.lengths)
-        slen = str(len(str(max(self.counts.values()))) + 2)
-        count_iter = sorted(self.counts.items(), key=lambda x: -x[1])
+        N = self.total
+        slen = str(len(str(max(chars.values()))) + 2)
+        count_iter = sorted(chars.items(), key=lambda x: (-x[1], x[0]))
         if counts ^ proportion:
             for k, v in count_iter:
                 val = v / N if proportion else v
@@ -1508,7 +3620,8 @@ def _stream_entries(entries, *args, **kwargs):
 
         # maybe it is a fasta file?
         elif isinstance(entry, str) or isinstance(entry, io.TextIOWrapper):
-            for seq in read_fasta(entry, *args, **kwargs):
+            filename = entry if isinstance(entry, str) else entry.name
+            for seq in read_fasta(entry, filename=filename, *args, **kwargs):
                 yield seq
 
         else:
@@ -1516,6 +3629,313 @@ def _stream_entries(entries, *args, **kwargs):
             raise ShitInput
 
 
+# The searched text of an entry and the file it came from
+_TextField = collections.namedtuple("_TextField", ["filename", "text"])
+
+
+def _stream_fields(entries, sequence=False, purge_color=False):
+    """
+    Like _stream_entries, but yield _TextField records holding only the
+    header (or, if sequence is True, the sequence) of each entry, with any
+    ANSI color codes removed if purge_color is True
+    """
+    if (
+        not hasattr(entries, "__iter__")
+        or isinstance(entries, str)
+        or isinstance(entries, io.TextIOWrapper)
+    ):
+        entries = [entries]
+
+    for entry in entries:
+        if isinstance(entry, tuple):
+            yield _TextField(None, entry[1] if sequence else entry[0])
+        elif isinstance(entry, FastaEntry):
+            yield _TextField(entry.filename, entry.seq if sequence else entry.header)
+        elif isinstance(entry, str) or isinstance(entry, io.TextIOWrapper):
+            filename = entry if isinstance(entry, str) else entry.name
+            f = open(entry, "r") if isinstance(entry, str) else entry
+            try:
+                for field in _read_fasta_fields(
+                    f, filename=filename, sequence=sequence
+                ):
+                    if purge_color:
+                        field = field._replace(text=FastaEntry._clear_color(field.text))
+                    yield field
+            finally:
+                f.close()
+        else:
+            print("Can't handle this type:" + str(type(entry)), file=sys.stderr)
+            raise ShitInput
+
+
+class StatCache:
+    """
+    Summaries (e.g. FastaStat.to_dict()) of input files, cached as JSON in a
+    sidecar file next to each input (INPUT.smof.json) or, if a directory is
+    given, in that directory. A cached summary is used only while the path,
+    size, modification time and a fingerprint of the content (a hash of the
+    first and last 64kB) of the file are unchanged.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    def filename(self, path):
+        if self.directory is None:
+            return path + ".smof.json"
+        key = hashlib.md5(os.path.abspath(path).encode("utf-8"))
+        return os.path.join(self.directory, key.hexdigest() + ".json")
+
+    @staticmethod
+    def identity(path, block=2**16):
+        stat = os.stat(path)
+        fingerprint = hashlib.md5(str(stat.st_size).encode("ascii"))
+        with open(path, "rb") as f:
+            fingerprint.update(f.read(block))
+            f.seek(max(0, stat.st_size - block))
+            fingerprint.update(f.read(block))
+        return {
+            "path": os.path.abspath(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "fingerprint": fingerprint.hexdigest(),
+        }
+
+    def _read(self, path, identity):
+        try:
+            with open(self.filename(path)) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cached.get("version") != 1 or cached.get("identity") != identity:
+            return {}
+        return cached.get("summaries", {})
+
+    def load(self, path):
+        """
+        The identity of a file and its cached summaries, by kind, read once
+        for any number of gets and a save
+        """
+        identity = self.identity(path)
+        return identity, self._read(path, identity)
+
+    def save(self, path, identity, summaries):
+        filename = self.filename(path)
+        try:
+            if self.directory is not None:
+                os.makedirs(self.directory, exist_ok=True)
+            # write and rename, so that a reader never sees a partial file
+            partial = "{}.{}.tmp".format(filename, os.getpid())
+            with open(partial, "w") as f:
+                cached = {"version": 1, "identity": identity, "summaries": summaries}
+                json.dump(cached, f)
+            os.replace(partial, filename)
+        except OSError:
+            # the cache is only an optimization, e.g. a read-only directory
+            # just means recomputing next time
+            pass
+
+    def get(self, path, kind):
+        """
+        The cached summary of a kind (e.g. 'stat') for a file, or None
+        """
+        identity, summaries = self.load(path)
+        return summaries.get(kind)
+
+    def put(self, path, kind, summary):
+        identity, summaries = self.load(path)
+        summaries[kind] = summary
+        self.save(path, identity, summaries)
+
+    def summarize(self, path, kind, cls, compute, usable=None):
+        """
+        Load the cls object (FastaStat or FastaDescription) of a kind for a
+        file from the cache, if it is there and usable, or else compute and
+        cache it
+        """
+        identity, summaries = self.load(path)
+        cached = summaries.get(kind)
+        if cached is not None:
+            summary = cls.from_dict(cached)
+            if usable is None or usable(summary):
+                return summary
+        summary = compute(path)
+        # raw lengths and hashes would make the cache file as slow to read as
+        # the input, so only the finished summary is kept
+        summaries[kind] = summary.to_dict(finished=True)
+        self.save(path, identity, summaries)
+        return summary
+
+    def counts(self, path):
+        """
+        The number of entries and total sequence length of a file, from a
+        cached 'wc' summary, or else from the totals of a cached stat summary
+        (approximate or exact), or else from a new approximate one, which
+        takes fixed memory. The 'wc' summary is saved for next time.
+        """
+        identity, summaries = self.load(path)
+        counts = summaries.get("wc")
+        if counts is None:
+            cached = summaries.get("stat-approx") or summaries.get("stat")
+            if cached is None:
+                g = stat_file(read_fasta(path, filename=path), approx=True)
+                cached = summaries["stat-approx"] = g.to_dict()
+            counts = {"nseqs": cached["nseqs"], "total": cached["total"]}
+            summaries["wc"] = counts
+            self.save(path, identity, summaries)
+        return counts["nseqs"], counts["total"]
+
+
+class FastaIndex:
+    """
+    A suffix array over the (uppercased) sequences of a FASTA file, stored on
+    disk so that literal sequence searches can be answered repeatedly
+    without rescanning the file. Locating a pattern takes O(m log n) time for
+    a pattern of length m, plus the number of hits.
+
+    File layout: an 8 byte magic string, the length of a JSON metadata block
+    (8 bytes, little-endian), the metadata (source file, its size and
+    modification time, headers, sequence starts and lengths), the concatenated sequences separated by NUL bytes,
+    padding to 8 bytes, and the suffix array as native 64-bit integers. The
+    text and the suffix array are memory-mapped when loaded.
+    """
+
+    MAGIC = b"SMOFSA01"
+
+    def __init__(
+        self, headers, starts, lengths, text, sa, source=None, source_stat=None
+    ):
+        self.headers = headers
+        self.starts = starts
+        self.lengths = lengths
+        self.text = text
+        self.sa = sa
+        self.source = source
+        # the size and modification time of the source file when indexed
+        self.source_stat = source_stat
+
+    @staticmethod
+    def _stat(source):
+        stat = os.stat(source)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def stale(self):
+        """
+        True if the source file has changed since it was indexed. A source
+        that no longer exists cannot be checked, and the index (which holds
+        the sequences) is still usable.
+        """
+        if self.source is None or self.source_stat is None:
+            return False
+        try:
+            return FastaIndex._stat(self.source) != self.source_stat
+        except OSError:
+            return False
+
+    @classmethod
+    def build(cls, gen, source=None):
+        """
+        Index a stream of entries. The text is held once, as it is built,
+        and the suffix array is sorted in fixed-width arrays (see
+        _suffix_array).
+        """
+        # taken before reading, so that a change while indexing is caught
+        source_stat = None if source is None else FastaIndex._stat(source)
+        headers = []
+        starts = []
+        lengths = []
+        text = bytearray()
+        for seq in gen:
+            s = seq.seq.upper().encode("ascii", "replace")
+            if headers:
+                text += b"\x00"
+            headers.append(seq.header)
+            starts.append(len(text))
+            lengths.append(len(s))
+            text += s
+        sa = _suffix_array(text)
+        return cls(
+            headers, starts, lengths, text, sa, source=source, source_stat=source_stat
+        )
+
+    def write(self, filename):
+        meta = json.dumps(
+            {
+                "source": self.source,
+                "source_stat": self.source_stat,
+                "headers": self.headers,
+                "starts": self.starts,
+                "lengths": self.lengths,
+                "text_length": len(self.text),
+            }
+        ).encode("utf-8")
+        with open(filename, "wb") as f:
+            f.write(FastaIndex.MAGIC)
+            f.write(struct.pack("<Q", len(meta)))
+            f.write(meta)
+            f.write(self.text)
+            f.write(b"\x00" * (-f.tell() % 8))
+            if isinstance(self.sa, array):
+                self.sa.tofile(f)
+            else:
+                # numpy positions, written as 64-bit a block at a time
+                for i in range(0, len(self.sa), 2**20):
+                    f.write(self.sa[i : i + 2**20].astype("int64").tobytes())
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            if f.read(8) != FastaIndex.MAGIC:
+                _err("'{}' is not a smof index".format(filename))
+            size = struct.unpack("<Q", f.read(8))[0]
+            meta = json.loads(f.read(size).decode("utf-8"))
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = 16 + size
+        n = meta["text_length"]
+        text = memoryview(data)[offset : offset + n]
+        offset += n + (-(offset + n) % 8)
+        sa = memoryview(data)[offset : offset + 8 * n].cast("q")
+        return cls(
+            meta["headers"],
+            meta["starts"],
+            meta["lengths"],
+            text,
+            sa,
+            source=meta["source"],
+            source_stat=meta.get("source_stat"),
+        )
+
+    def _bound(self, pattern, upper=False):
+        """
+        Index of the first suffix whose prefix is not less than (or, if upper
+        is True, greater than) pattern
+        """
+        m = len(pattern)
+        lo, hi = 0, len(self.sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = self.sa[mid]
+            prefix = bytes(self.text[i : i + m])
+            if prefix < pattern or (upper and prefix == pattern):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def locate(self, pattern):
+        """
+        Yield (record index, start) for every, possibly overlapping,
+        occurrence of pattern (case-insensitive)
+        """
+        pattern = pattern.upper().encode("ascii", "replace")
+        if not pattern or b"\x00" in pattern:
+            return
+        for k in range(self._bound(pattern), self._bound(pattern, upper=True)):
+            pos = int(self.sa[k])
+            record = bisect.bisect_right(self.starts, pos) - 1
+            yield (record, pos - self.starts[record])
+
+
 class FastaEntryStat:
     def __init__(self, seq, count=True):
         self.counts = collections.Counter(seq.seq) if count else None
@@ -1627,6 +4047,38 @@ def _quantile(xs, q, issorted=False):
 
 
 def _summary(xs):
+    """
+    Summarize a sequence of numbers (with numpy, if it is installed)
+    """
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is not None:
+        xs = numpy.sort(numpy.asarray(xs))
+        total = xs.sum().item()
+        mean = total / len(xs)
+        if len(xs) > 1:
+            sd = (((xs - mean) ** 2).sum().item() / (len(xs) - 1)) ** 0.5
+        else:
+            sd = float("nan")
+        # the N50 is the length at which the cumulative sum of lengths,
+        # summing from the longest, first exceeds half the total
+        cumsum = numpy.cumsum(xs[::-1])
+        n50 = xs[len(xs) - 1 - numpy.searchsorted(cumsum, total / 2, side="right")]
+        return {
+            "min": xs[0].item(),
+            "max": xs[-1].item(),
+            "1st_qu": _quantile(xs, 0.25, issorted=True).item(),
+            "median": _quantile(xs, 0.50, issorted=True).item(),
+            "3rd_qu": _quantile(xs, 0.75, issorted=True).item(),
+            "mean": mean,
+            "sd": sd,
+            "N50": n50.item(),
+            "total": total,
+        }
+
     xs = sorted(xs)
     out = {
         "min": xs[0],
@@ -1637,21 +4089,259 @@ def _summary(xs):
         "mean": _mean(xs),
         "sd": _sd(xs),
         "N50": _N50(xs, issorted=True),
+        "total": sum(xs),
     }
     return out
 
 
 class GrepSearch:
+    # number of records sent to a worker at a time with --jobs
+    batch_size = 1000
+
     def __init__(self, args):
         self.clean_args = self._process_arguments(args)
         pat, wrapper = self._get_pattern(self.clean_args)
-        self.matcher = self._create_matcher(self.clean_args, pat, wrapper)
+        self.pattern = (pat, wrapper)
+        # -c and --count-matches need only the number of hits per entry
+        self.counting = bool(self.clean_args.count or self.clean_args.count_matches)
+        self.matcher = self._compile(self.clean_args, pat, wrapper)
         self.generator = self._makegen(self.clean_args)
 
-    def search(self, gen):
-        for item in self.generator(gen, self.matcher):
+    def search(self, gen, ninputs=None):
+        """
+        Search a stream of FastaEntry objects, or a list of streams, one per
+        input file. If the number of input files (ninputs) is known, reading
+        stops as soon as --max-count (or -l/-L) has settled the answer for
+        every file. Given a list, the stream of each file is dropped as soon
+        as its own answer is settled. Given a list of filenames, with --jobs
+        the worker processes read byte ranges of the files themselves.
+        """
+        paths = _file_names(gen)
+        if paths and _pool_size(self.clean_args.jobs, paths) > 1:
+            return self._run(paths, len(paths))
+        if paths and self.counting:
+            sequence = self.clean_args.match_sequence
+            return self.count([_stream_fields(x, sequence=sequence) for x in paths])
+        if paths:
+            gen = [_stream_entries(x) for x in paths]
+        if self.counting:
+            field = "seq" if self.clean_args.match_sequence else "header"
+            fields = operator.attrgetter("filename", field)
+            if isinstance(gen, list):
+                gen = [(_TextField(*fields(seq)) for seq in g) for g in gen]
+            else:
+                gen = (_TextField(*fields(seq)) for seq in gen)
+        return self._run(gen, ninputs)
+
+    def count(self, fields, ninputs=None):
+        """
+        Count matches in a stream of _TextField records (see _stream_fields),
+        or a list of streams, one per input file, holding only the searched
+        text of each entry. Requires -c or --count-matches.
+        """
+        if not self.counting:
+            _err("GrepSearch.count requires the count or count_matches option")
+        return self._run(fields, ninputs)
+
+    def _run(self, gen, ninputs):
+        args = self.clean_args
+        if args.files_with_matches or args.files_without_match:
+            # the answer for a file is known after its first match
+            limit = 1
+        else:
+            limit = args.max_count
+        paths = _file_names(gen)
+        if paths:
+            inputs = []
+        elif isinstance(gen, list):
+            inputs = gen
+            if ninputs is None:
+                ninputs = len(inputs)
+        else:
+            inputs = [gen]
+        finished = set()
+        if limit:
+            gen = self._skip_finished(inputs, finished, ninputs)
+        else:
+            gen = itertools.chain.from_iterable(inputs)
+        jobs = _pool_size(args.jobs)
+        if args.index:
+            matched = self._match_index()
+        elif paths:
+            matched = self._match_ranges(paths, finished, jobs)
+        elif jobs > 1:
+            matched = self._match_parallel(gen, jobs)
+        else:
+            matched = ((seq, self.matcher(seq)) for seq in gen)
+        if limit:
+            matched = self._limit_matches(matched, limit, finished, ninputs)
+        for item in self.generator(matched):
             yield item
 
+    def _match_index(self):
+        """
+        Answer a literal sequence search from a FastaIndex rather than the
+        input, yielding (entry, matches) pairs for the entries with hits, as
+        the scanning matchers would
+        """
+        args = self.clean_args
+        idx = FastaIndex.load(args.index)
+        if idx.stale():
+            _err(
+                "'{}' has changed since the index '{}' was built, please rebuild it with `smof index`".format(
+                    idx.source, args.index
+                )
+            )
+        strands = []
+        if not args.reverse_only:
+            strands.append("+" if args.both_strands else ".")
+        if args.reverse_only or args.both_strands:
+            strands.append("-")
+
+        # hits[record][strand] holds a list of [start, end] intervals in the
+        # coordinates of the scanned text (the reverse complement for '-')
+        hits = collections.defaultdict(lambda: {s: [] for s in strands})
+        # patterns are iterated in the same order as by the scanning matcher
+        for p in self.pattern[0]:
+            literal = re.sub(r"\\(.)", r"\1", p.pattern, flags=re.DOTALL)
+            for strand in strands:
+                if strand == "-":
+                    query = FastaEntry.getrevcomp(literal)
+                else:
+                    query = literal
+                located = collections.defaultdict(list)
+                for record, start in idx.locate(query):
+                    located[record].append(start)
+                m = len(query)
+                for record, starts in located.items():
+                    if strand == "-":
+                        # the reverse strand is scanned from the right end
+                        L = idx.lengths[record]
+                        starts = sorted(L - (x + m) for x in starts)
+                    else:
+                        starts.sort()
+                    # keep leftmost non-overlapping hits, as re.finditer does
+                    end = 0
+                    for x in starts:
+                        if x >= end:
+                            end = x + m
+                            hits[record][strand].append([x, end])
+
+        counting = args.count or args.count_matches
+        source = idx.source
+        if counting and 0 not in hits:
+            # report the file even if there are no hits at all
+            yield (_TextField(source, ""), 0)
+
+        for record in sorted(hits):
+            L = idx.lengths[record]
+            matches = []
+            for strand, intervals in hits[record].items():
+                for a, b in intervals:
+                    a = max(0, a - args.before_context)
+                    b = min(L, b + args.after_context)
+                    if strand == "-":
+                        a, b = L - b, L - a
+                    matches.append({"pos": [a, b], "strand": strand})
+            if counting:
+                n = len(matches) if args.count_matches else int(bool(matches))
+                yield (_TextField(source, ""), n)
+            else:
+                yield (FastaEntry(idx.headers[record], "", filename=source), matches)
+
+    @staticmethod
+    def _skip_finished(inputs, finished, ninputs):
+        """
+        Drop entries from files that need no more matching. If each of the
+        input streams holds one file (there are ninputs of them), a stream
+        is closed as soon as its file is finished, before the next entry is
+        read.
+        """
+        per_file = len(inputs) == ninputs
+        for entries in inputs:
+            for seq in entries:
+                if seq.filename in finished:
+                    continue
+                yield seq
+                if ninputs and len(finished) >= ninputs:
+                    return
+                if per_file and seq.filename in finished:
+                    break
+            if hasattr(entries, "close"):
+                entries.close()
+
+    def _limit_matches(self, matched, limit, finished, ninputs):
+        """
+        Pass on at most limit selected entries per file, marking a file as
+        finished when its limit is reached
+        """
+        args = self.clean_args
+        invert = args.invert_match and not (
+            args.files_with_matches or args.files_without_match
+        )
+        nselected = collections.Counter()
+        for seq, matches in matched:
+            # with --jobs, entries that were in flight may still arrive
+            if seq.filename in finished:
+                continue
+            if bool(matches) != invert:
+                nselected[seq.filename] += 1
+                if nselected[seq.filename] >= limit:
+                    finished.add(seq.filename)
+            yield (seq, matches)
+            if ninputs and len(finished) >= ninputs:
+                return
+
+    def _worker_args(self):
+        # File handles and subcommand callbacks cannot be sent to workers
+        args = GrepOptions()
+        args.__dict__.update(
+            (k, v)
+            for k, v in vars(self.clean_args).items()
+            if k not in ("file", "fh", "func")
+        )
+        return (args,) + self.pattern
+
+    def _match_parallel(self, gen, jobs):
+        """
+        Match records in a pool of worker processes, yielding (seq, matches)
+        pairs in input order. Each worker compiles its own matcher once;
+        records are sent in batches and at most two batches per worker are in
+        flight at any time, so memory stays bounded on large inputs.
+        """
+        for batch, matches in _pool_imap(
+            _grep_worker_match,
+            _batches(gen, self.batch_size),
+            jobs,
+            initializer=_grep_worker_init,
+            initargs=self._worker_args(),
+        ):
+            for pair in zip(batch, matches):
+                yield pair
+
+    def _match_ranges(self, paths, finished, jobs):
+        """
+        Match the entries of files in a pool of worker processes, each of
+        which reads and parses byte ranges of the files, yielding in input
+        order the (seq, matches) pairs that can change the output (see
+        _grep_worker_range). No more ranges of a file are handed out once it
+        is finished.
+        """
+        tasks = (task for task in _byte_ranges(paths, jobs) if task[0] not in finished)
+        for task, pairs in _pool_imap(
+            _grep_worker_range,
+            tasks,
+            jobs,
+            initializer=_grep_worker_init,
+            initargs=self._worker_args(),
+        ):
+            if self.counting:
+                for pair in pairs:
+                    yield pair
+                continue
+            for (header, seq, filename), matches in pairs:
+                yield FastaEntry(header, seq, filename=filename), matches
+
     @staticmethod
     def _process_arguments(args):
         # Stop if there are any incompatible options
@@ -1670,6 +4360,24 @@ class GrepSearch:
         if args.fastain:
             args.match_sequence = True
 
+        if args.index:
+            args.match_sequence = True
+            if any(
+                (
+                    args.perl_regexp,
+                    args.ambiguous_nucl,
+                    args.wrap,
+                    args.case_sensitive,
+                    args.exact,
+                    args.line_regexp,
+                    args.gapped,
+                    args.invert_match,
+                )
+            ):
+                _err("--index supports only literal, case-insensitive searches")
+            if not (args.gff or args.count or args.count_matches):
+                _err("--index requires --gff, --count or --count-matches")
+
         if not args.match_sequence and (
             args.both_strands or args.ambiguous_nucl or args.reverse_only
         ):
@@ -1748,16 +4456,23 @@ class GrepSearch:
             # read pattern from command line
             pat.update([args.pattern])
 
+        if not pat and not (args.fastain or args.file):
+            _err("Please provide a pattern")
+
+        # Plain IUPAC patterns are searched with the bitmask engine, which
+        # honours ambiguity codes in the sequence as well as the pattern.
+        # Patterns using regex syntax are translated to perl character
+        # classes.
+        iupac = set()
         if args.ambiguous_nucl:
             apat = set()
             for p in pat:
-                perlpat = ambiguous2perl(p)
-                apat.update([perlpat])
+                if not args.case_sensitive and IUPACPattern.is_iupac(p):
+                    iupac.add(IUPACPattern(p))
+                else:
+                    apat.add(ambiguous2perl(p))
             pat = apat
 
-        if not pat and not (args.fastain or args.file):
-            _err("Please provide a pattern")
-
         # TODO searching for perfect matches would be faster without using
         # regex (just <str>.find(pat))
         if not (args.perl_regexp or args.wrap or args.exact):
@@ -1771,191 +4486,229 @@ class GrepSearch:
             wrapper = None
 
         if not (args.wrap or args.exact):
-            pat = set((re.compile(p, flags=flags) for p in pat))
+            pat = set((re.compile(p, flags=flags) for p in pat)) | iupac
 
         return (pat, wrapper)
 
     @staticmethod
-    def _create_matcher(args, pat, wrapper):
-
-        # Select a search space preparation function
-        if args.match_sequence:
-            if args.gapped:
-                gettext = lambda x: "".join(re.split(r"-+", x.seq))
-            else:
-                gettext = lambda x: x.seq
+    def _compile(args, pat, wrapper):
+        if args.count or args.count_matches:
+            return GrepSearch._create_counter(args, pat, wrapper)
         else:
-            gettext = lambda x: x.header
+            return GrepSearch._create_matcher(args, pat, wrapper)
 
-        def context(func):
-            has_context = args.before_context or args.after_context
-            if has_context:
-
-                def inner(seq, **kw):
-                    text = gettext(seq)
-                    matches = []
-                    for m in func(text, **kw):
-                        m["pos"][0] = max(0, m["pos"][0] - args.before_context)
-                        m["pos"][1] = min(len(text), m["pos"][1] + args.after_context)
-                        matches.append(m)
-                    return matches
+    @staticmethod
+    def _create_counter(args, pat, wrapper):
+        """
+        Build a function that maps a _TextField to its number of hits. With
+        --count-matches, non-overlapping hits are counted; otherwise the
+        function only tests for the existence of a hit (1 or 0). No match
+        positions are recorded.
+        """
+        if args.exact:
 
-            else:
+            def count(text):
+                return int(text in pat)
 
-                def inner(seq, **kw):
-                    text = gettext(seq)
-                    return func(text, **kw)
+        elif args.line_regexp:
 
-            return inner
+            def count(text):
+                for p in pat:
+                    m = p.match(text)
+                    if m and m.end() == len(text):
+                        return 1
+                return 0
 
-        def seqtotext(func):
-            def inner(seq, **kw):
-                text = gettext(seq)
-                return func(text, **kw)
+        elif wrapper and args.count_matches:
 
-            return inner
+            def count(text):
+                return sum(m.group(1) in pat for m in wrapper.finditer(text))
 
-        # Check existence for matches to wrapper captures
-        @seqtotext
-        def swrpmatcher(text, **kw):
-            for m in re.finditer(wrapper, text):
-                if m.group(1) in pat:
-                    return True
-            return False
+        elif wrapper:
 
-        # Check existence of matches
-        @seqtotext
-        def spatmatcher(text, **kw):
-            for p in pat:
-                if re.search(p, text):
-                    return True
-            return False
+            def count(text):
+                for m in wrapper.finditer(text):
+                    if m.group(1) in pat:
+                        return 1
+                return 0
 
-        # Check if pattern matches entire text
-        @seqtotext
-        def linematcher(text, **kw):
-            for p in pat:
-                m = re.match(p, text)
-                if m and m.end() == len(text):
-                    return True
-            return False
+        elif args.count_matches:
 
-        @seqtotext
-        def exactmatcher(text, **kw):
-            return text in pat
+            def count(text):
+                n = 0
+                for p in pat:
+                    for m in p.finditer(text):
+                        n += 1
+                return n
 
-        @context
-        def gwrpmatcher(text, strand="."):
-            pos = []
-            for m in re.finditer(wrapper, text):
-                if m.group(1) in pat:
-                    match = {"pos": [m.start(1), m.end(1)], "strand": strand}
-                    pos.append(match)
-            return pos
-
-        @context
-        def gpatmatcher(text, strand="."):
-            pos = []
-            for p in pat:
-                for m in re.finditer(p, text):
-                    match = {"pos": [m.start(), m.end()], "strand": strand}
-                    pos.append(match)
-            return pos
+        else:
 
-        # the matchers are of two types:
-        # 1. boolean - is the pattern present in the given sequence?
-        # 2. position - where are the patterns located?
-        # this flag records which type of pattern is used
-        by_position = False
+            def count(text):
+                for p in pat:
+                    if p.search(text):
+                        return 1
+                return 0
+
+        revcomp = FastaEntry.getrevcomp
+        if args.reverse_only:
+            stranded = lambda text: count(revcomp(text))
+        elif args.both_strands and args.count_matches:
+            stranded = lambda text: count(text) + count(revcomp(text))
+        elif args.both_strands:
+            stranded = lambda text: count(text) or count(revcomp(text))
+        else:
+            stranded = count
 
-        # Select a base regular expression function
-        if args.exact:
-            matcher = exactmatcher
-        elif args.line_regexp:
-            matcher = linematcher
-        elif args.gff or args.count_matches or args.color_output or args.only_matching:
-            matcher = gwrpmatcher if wrapper else gpatmatcher
-            by_position = True
+        if args.match_sequence and args.gapped:
+            return lambda field: stranded(field.text.replace("-", ""))
         else:
-            matcher = swrpmatcher if wrapper else spatmatcher
+            return lambda field: stranded(field.text)
 
-        # Prepare gapped or ungapped search function
-        def search_function(matcher, **kw):
-            if not args.gapped or not by_position:
+    @staticmethod
+    def _create_matcher(args, pat, wrapper):
+        """
+        Build a function that maps a FastaEntry to its matches: a boolean when
+        only the presence of a hit matters, otherwise a list of
+        {"pos": [start, end], "strand": strand} dicts. Every option is resolved
+        here, once, so the returned function makes as few calls per entry as
+        the option combination allows.
+        """
+        revcomp = FastaEntry.getrevcomp
 
-                def inner(seq, **kw):  # ungapped
-                    return matcher(seq, **kw)
+        # Select the searched text
+        if not args.match_sequence:
+            gettext = operator.attrgetter("header")
+        elif args.gapped:
+            gettext = lambda seq: seq.seq.replace("-", "")
+        else:
+            gettext = operator.attrgetter("seq")
 
-            else:
+        # the matchers are of two types:
+        # 1. boolean - is the pattern present in the given sequence?
+        # 2. position - where are the patterns located?
+        by_position = not (args.exact or args.line_regexp) and (
+            args.gff or args.count_matches or args.color_output or args.only_matching
+        )
 
-                def inner(seq, **kw):  # gapped
-                    """
-                    Maps from positions on an ungapped sequence to positions on a
-                    gapped sequence. For example, it can convert the ATA match to
-                    'GATACA' on (1,3), to the '-GA--TACA' match on (2,5).
-                    """
-                    matches = matcher(seq, **kw)
-                    gaps = list(re.finditer(r"-+", seq.seq))
-                    if not gaps:
-                        return matches
-                    for g in gaps:
-                        g0 = g.span()[0]
-                        g1 = g.span()[1]
-                        glen = g1 - g0
-                        for m in matches:
-                            if m["pos"][0] >= g0:
-                                m["pos"][0] += glen
-                                m["pos"][1] += glen
-                        for m in matches:
-                            if (m["pos"][0] < g0) and (m["pos"][1] > g0):
-                                m["pos"][1] += glen
-                    return matches
-
-            return inner
-
-        # Process functions that include reverse complements
-        def stranded_function(matcher, by_position):
-            if by_position:
-
-                def rev(matcher, seq):
-                    rmatch = []
-                    text_length = len(seq.seq) if args.gapped else len(gettext(seq))
-                    for d in matcher(FastaEntry.getrevcomp(seq), strand="-"):
-                        d["pos"] = text_length - d["pos"][1], text_length - d["pos"][0]
-                        rmatch.append(d)
-                    return rmatch
-
-                if args.reverse_only:
-
-                    def rmatcher(seq):
-                        return rev(matcher, seq)
+        if not by_position:
+            if args.exact:
+                test = pat.__contains__
+            elif args.line_regexp:
+                # Check if pattern matches entire text
+                def test(text):
+                    for p in pat:
+                        m = p.match(text)
+                        if m and m.end() == len(text):
+                            return True
+                    return False
+
+            elif wrapper:
+                # Check existence for matches to wrapper captures
+                def test(text):
+                    for m in wrapper.finditer(text):
+                        if m.group(1) in pat:
+                            return True
+                    return False
+
+            elif len(pat) == 1:
+                search = next(iter(pat)).search
+
+                def test(text):
+                    return search(text) is not None
 
-                else:
+            else:
 
-                    def rmatcher(seq):
-                        fmatch = matcher(seq, strand="+")
-                        rmatch = rev(matcher, seq)
-                        return fmatch + rmatch
+                def test(text):
+                    for p in pat:
+                        if p.search(text):
+                            return True
+                    return False
 
+            if args.reverse_only:
+                return lambda seq: test(revcomp(gettext(seq)))
+            elif args.both_strands:
+                return lambda seq: test(revcomp(gettext(seq))) or test(gettext(seq))
             else:
-                f = lambda x: matcher(x, strand="+")
-                r = lambda x: matcher(FastaEntry.getrevcomp(x), strand="-")
-                if args.reverse_only:
+                return lambda seq: test(gettext(seq))
 
-                    def rmatcher(seq):
-                        return r(seq)
+        def finder(strand):
+            if wrapper:
 
-                else:
+                def find(text):
+                    return [
+                        {"pos": [m.start(1), m.end(1)], "strand": strand}
+                        for m in wrapper.finditer(text)
+                        if m.group(1) in pat
+                    ]
 
-                    def rmatcher(seq):
-                        return r(seq) or f(seq)
+            elif len(pat) == 1:
+                finditer = next(iter(pat)).finditer
 
-            return rmatcher
+                def find(text):
+                    return [
+                        {"pos": [m.start(), m.end()], "strand": strand}
+                        for m in finditer(text)
+                    ]
 
-        matcher = search_function(matcher)
+            else:
 
-        if args.reverse_only or args.both_strands:
-            matcher = stranded_function(matcher, by_position)
+                def find(text):
+                    return [
+                        {"pos": [m.start(), m.end()], "strand": strand}
+                        for p in pat
+                        for m in p.finditer(text)
+                    ]
+
+            return find
+
+        before = args.before_context
+        after = args.after_context
+        gapped = args.match_sequence and args.gapped
+
+        if not (args.reverse_only or args.both_strands):
+            find = finder(".")
+            if not (before or after or gapped):
+                return lambda seq: find(gettext(seq))
+            forward, reverse = find, None
+        elif args.reverse_only:
+            forward, reverse = None, finder("-")
+        else:
+            forward, reverse = finder("+"), finder("-")
+
+        def locate(find, gapped_text):
+            # Match, add context (in ungapped coordinates), then map the
+            # positions from the ungapped to the gapped sequence. For example,
+            # the ATA match to 'GATACA' on (1,3) maps to '-GA--TACA' on (2,5).
+            text = gapped_text.replace("-", "") if gapped else gapped_text
+            matches = find(text)
+            if matches and (before or after):
+                n = len(text)
+                for m in matches:
+                    pos = m["pos"]
+                    pos[0] = max(0, pos[0] - before)
+                    pos[1] = min(n, pos[1] + after)
+            if matches and gapped:
+                table = _gap_table(gapped_text)
+                if table[0]:
+                    for m in matches:
+                        m["pos"] = list(_gapped_span(table, *m["pos"]))
+            return matches
+
+        # sequences are searched as stored (with gaps, if gapped) since
+        # locate removes the gaps
+        getraw = operator.attrgetter("seq" if args.match_sequence else "header")
+
+        def matcher(seq):
+            raw = getraw(seq)
+            matches = locate(forward, raw) if forward else []
+            if reverse:
+                # reverse strand positions are flipped onto the forward strand
+                n = len(raw)
+                for m in locate(reverse, revcomp(raw)):
+                    pos = m["pos"]
+                    pos[0], pos[1] = n - pos[1], n - pos[0]
+                    matches.append(m)
+            return matches
 
         return matcher
 
@@ -1964,7 +4717,7 @@ class GrepSearch:
 
         if args.gff:
 
-            def sgen(gen, matcher):
+            def sgen(matched):
                 source = "smof-{}".format(__version__)
                 gfftype = args.gff_type
                 row = [
@@ -1978,9 +4731,8 @@ class GrepSearch:
                     ".",  # 8 phase
                     ".",  # 9 attributes
                 ]
-                for seq in gen:
+                for seq, matches in matched:
                     row[0] = _parse_header_firstword(seq.header)
-                    matches = list(matcher(seq))
                     for m in matches:
                         row[3] = m["pos"][0] + 1
                         row[4] = m["pos"][1]
@@ -1989,20 +4741,15 @@ class GrepSearch:
 
         elif args.count or args.count_matches:
 
-            def sgen(gen, matcher):
+            def sgen(matched):
                 seqcount = collections.OrderedDict()
                 seqmatch = collections.OrderedDict()
-                for seq in gen:
-                    m = matcher(seq)
+                for seq, n in matched:
                     if seq.filename not in seqcount:
                         seqcount[seq.filename] = 0
                         seqmatch[seq.filename] = 0
-                    if m:
-                        try:
-                            seqmatch[seq.filename] += len(m)
-                            seqcount[seq.filename] += 1
-                        except TypeError:
-                            pass
+                    seqmatch[seq.filename] += n
+                    seqcount[seq.filename] += bool(n) != args.invert_match
                 for filename, count in seqcount.items():
                     match = seqmatch[filename]
                     if args.count or args.count_matches:
@@ -2022,27 +4769,25 @@ class GrepSearch:
                                 yield match
 
         elif args.files_without_match or args.files_with_matches:
-            print("C")
 
-            def sgen(gen, matcher):
+            def sgen(matched):
                 seqmat = collections.OrderedDict()
-                for seq in gen:
-                    matched = matcher(seq)
+                for seq, matches in matched:
                     if seq.filename not in seqmat:
                         seqmat[seq.filename] = False
-                    if matched:
+                    if matches and not seqmat[seq.filename]:
                         seqmat[seq.filename] = True
-                for filename, matched in seqmat.items():
-                    if (not matched and args.files_without_match) or (
-                        matched and args.files_with_matches
-                    ):
-                        yield filename
+                        if args.files_with_matches:
+                            yield seq.filename
+                if args.files_without_match:
+                    for filename, matched in seqmat.items():
+                        if not matched:
+                            yield filename
 
         elif args.only_matching:
 
-            def sgen(gen, matcher):
-                for seq in gen:
-                    matches = matcher(seq)
+            def sgen(matched):
+                for seq, matches in matched:
                     text = seq.seq if args.match_sequence else seq.header
                     for m in matches:
                         match = text[m["pos"][0] : m["pos"][1]]
@@ -2059,9 +4804,8 @@ class GrepSearch:
 
         else:
 
-            def sgen(gen, matcher):
-                for seq in gen:
-                    matches = matcher(seq)
+            def sgen(matched):
+                for seq, matches in matched:
                     if (matches and not args.invert_match) or (
                         not matches and args.invert_match
                     ):
@@ -2076,6 +4820,48 @@ class GrepSearch:
         return sgen
 
 
+_grep_worker_matcher = None
+_grep_worker_args = None
+
+
+def _grep_worker_init(args, pat, wrapper):
+    global _grep_worker_matcher, _grep_worker_args
+    _grep_worker_matcher = GrepSearch._compile(args, pat, wrapper)
+    _grep_worker_args = args
+
+
+def _grep_worker_match(batch):
+    return [_grep_worker_matcher(seq) for seq in batch]
+
+
+def _grep_worker_range(task):
+    """
+    Read and match the entries of a (path, start, end) byte range, returning
+    only the (seq, matches) pairs that can change the output: the selected
+    entries, and the first, so that the file is reported even if nothing in
+    it is selected. To pickle quickly, seq is a (header, sequence, filename)
+    tuple, or with -c/-m a _TextField holding just the filename.
+    """
+    args = _grep_worker_args
+    counting = args.count or args.count_matches
+    field = "seq" if args.match_sequence else "header"
+    invert = args.invert_match and not (
+        args.files_with_matches or args.files_without_match
+    )
+    pairs = []
+    for i, seq in enumerate(_read_fasta_range(*task)):
+        if counting:
+            seq = _TextField(seq.filename, getattr(seq, field))
+        matches = _grep_worker_matcher(seq)
+        if i == 0 or bool(matches) != invert:
+            if counting:
+                seq = _TextField(seq.filename, "")
+            else:
+                seq = (seq.header, seq.seq, seq.filename)
+            pairs.append((seq, matches))
+    return pairs
+
+
 def md5sum(
     gen,
     ignore_case=False,
@@ -1,4 +1,5 @@
 import argparse
+import json
 import math
 import re
 import sys
@@ -13,6 +14,7 @@ from collections import OrderedDict
 from smof.functions import *
 from smof.functions import _headtailtrunk
 from smof.functions import _stream_entries
+from smof.functions import _stream_fields
 from smof.functions import _err
 from smof.version import __version__
 
@@ -28,6 +30,23 @@ def counting_number(i):
     return i
 
 
+def byte_size(x):
+    """
+    A number of bytes, with an optional K, M or G suffix (powers of 1024)
+    """
+    units = {"K": 2**10, "M": 2**20, "G": 2**30}
+    try:
+        if x[-1:].upper() in units:
+            size = int(float(x[:-1]) * units[x[-1].upper()])
+        else:
+            size = int(x)
+    except ValueError:
+        raise argparse.ArgumentTypeError("%s is an invalid size" % x)
+    if size < 1:
+        raise argparse.ArgumentTypeError("%s is an invalid size" % x)
+    return size
+
+
 def positive_int(i):
     i = int(i)
     if i < 0:
@@ -35,6 +54,19 @@ def positive_int(i):
     return i
 
 
+def metric_list(x):
+    """
+    A comma-separated list of stat --table metrics
+    """
+    metrics = x.split(",")
+    for metric in metrics:
+        if metric not in TABLE_METRICS:
+            raise argparse.ArgumentTypeError(
+                "'{}' is not one of {}".format(metric, ", ".join(TABLE_METRICS))
+            )
+    return metrics
+
+
 # ================
 # Argument Parsing
 # ================
@@ -80,6 +112,7 @@ def parse(argv=None):
         Grep,
         Md5sum,
         Head,
+        Index,
         Permute,
         Reverse,
         Sample,
@@ -125,6 +158,76 @@ def parse(argv=None):
     return args
 
 
+def _input_files(args, gen):
+    """
+    The input filenames, for functions that read parts of the files
+    themselves (with --jobs or --sample), or else the entry stream
+    """
+    if args.fh and all(isinstance(x, str) for x in args.fh):
+        return args.fh
+    return gen
+
+
+def _add_cache_arguments(parser):
+    parser.add_argument(
+        "--cache",
+        help="reuse the statistics of each file, cached in INPUT.smof.json",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="like --cache, but keep the cache files in DIR",
+        metavar="DIR",
+    )
+
+
+def _cache(args):
+    """
+    The StatCache selected by --cache or --cache-dir, if the input is files
+    """
+    if not (args.cache or args.cache_dir) or not _regular_files(args):
+        return None
+    return StatCache(directory=args.cache_dir)
+
+
+def _summary_cache(args):
+    """
+    The StatCache for stat or sniff, if the cached summaries can make the
+    report: exact summaries are cached finished, so they cannot be merged
+    across files or written as partials
+    """
+    if not args.approx and (len(args.fh) > 1 or args.partial):
+        return None
+    return _cache(args)
+
+
+def _regular_files(args):
+    """
+    Whether the input is named regular files (rather than STDIN or pipes)
+    """
+    return bool(args.fh) and all(
+        isinstance(x, str) and os.path.isfile(x) for x in args.fh
+    )
+
+
+def _load_partials(paths, cls):
+    """
+    Read the JSON partial aggregates (FastaStat or FastaDescription) written
+    by `--partial`
+    """
+    if not paths:
+        _err("Please give the partial files to merge")
+    parts = []
+    for path in paths:
+        with open(path) as f:
+            try:
+                parts.append(cls.from_dict(json.load(f)))
+            except ValueError:
+                _err("Could not read partial file '{}'".format(path))
+    return parts
+
+
 # ====================
 # ONE-BY-ONE FUNCTIONS
 # ====================
@@ -634,6 +737,46 @@ class Sniff(Subcommand):
             metavar="INPUT",
             nargs="*",
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            help="describe entries in up to N worker processes, one per CPU (default=1)",
+            metavar="N",
+            type=counting_number,
+            default=1,
+        )
+        sample = parser.add_mutually_exclusive_group()
+        sample.add_argument(
+            "--sample",
+            help="describe only about N entries, sampled evenly across the input",
+            metavar="N",
+            type=counting_number,
+        )
+        sample.add_argument(
+            "--bytes",
+            help="describe only the entries in about SIZE bytes (e.g. 10M) of the input",
+            metavar="SIZE",
+            type=byte_size,
+        )
+        parser.add_argument(
+            "--approx",
+            help="count distinct sequences and headers approximately, in fixed memory",
+            default=False,
+            action="store_true",
+        )
+        parser.add_argument(
+            "--partial",
+            help="write the description as JSON, for a later --merge",
+            default=False,
+            action="store_true",
+        )
+        parser.add_argument(
+            "--merge",
+            help="read and combine the JSON files written by --partial",
+            default=False,
+            action="store_true",
+        )
+        _add_cache_arguments(parser)
         parser.set_defaults(func=self.func)
 
     def generator(self, args, gen):
@@ -644,9 +787,45 @@ class Sniff(Subcommand):
         This function basically just formats and prints the information in a
         FastaDescription object
         """
-        seqsum = sniff(gen)
+        if args.sample or args.bytes:
+            if args.jobs > 1 or args.partial or args.merge or args.approx:
+                _err(
+                    "--sample and --bytes cannot be used with --jobs, --partial, --merge or --approx"
+                )
+            if args.cache or args.cache_dir:
+                _err("--sample and --bytes cannot be used with --cache")
+            seqsum = sniff_sample(
+                _input_files(args, gen), nseqs=args.sample, nbytes=args.bytes
+            )
+        elif args.merge:
+            parts = _load_partials(args.fh, FastaDescription)
+            seqsum = FastaDescription(approx=any(part.approx for part in parts))
+            for part in parts:
+                seqsum.merge(part)
+        elif _summary_cache(args):
+
+            def describe(path):
+                inputs = path if args.jobs > 1 else read_fasta(path, filename=path)
+                return sniff(inputs, jobs=args.jobs, approx=args.approx)
+
+            cache = _summary_cache(args)
+            kind = "sniff-approx" if args.approx else "sniff"
+            parts = [
+                cache.summarize(path, kind, FastaDescription, describe)
+                for path in args.fh
+            ]
+            seqsum = parts[0]
+            for part in parts[1:]:
+                seqsum.merge(part)
+        else:
+            inputs = _input_files(args, gen) if args.jobs > 1 else gen
+            seqsum = sniff(inputs, jobs=args.jobs, approx=args.approx)
 
-        out.write(str(seqsum))
+        if args.partial:
+            json.dump(seqsum.to_dict(), out)
+            out.write("\n")
+        else:
+            out.write(str(seqsum))
 
 
 class Stat(Subcommand):
@@ -662,7 +841,8 @@ class Stat(Subcommand):
             of sequence lengths (minimum, 25th quantile, median, 75th quantile,
             and maximum), 4) the mean and standard deviation of lengths, and 5)
             the N50 (if you don't know what that is, you don't need to
-            know).""",
+            know). With --approx, the quartiles are within 1% of the number
+            of sequences in rank, and the N50 within 0.2% of its length.""",
         )
         parser.add_argument(
             "fh",
@@ -741,10 +921,80 @@ class Stat(Subcommand):
             default=False,
             action="store_true",
         )
+        parser.add_argument(
+            "--alphabet",
+            help="with -q, count only the characters of this alphabet (plus 'other')",
+            choices=sorted(Alphabet.NAMED),
+        )
+        parser.add_argument(
+            "--partial",
+            help="write the statistics as JSON, for a later --merge",
+            default=False,
+            action="store_true",
+        )
+        parser.add_argument(
+            "--merge",
+            help="read and combine the JSON files written by --partial",
+            default=False,
+            action="store_true",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            help="summarize entries in up to N worker processes, one per CPU (default=1)",
+            metavar="N",
+            type=counting_number,
+            default=1,
+        )
+        parser.add_argument(
+            "--approx",
+            help="estimate the quartiles and N50 in fixed memory",
+            default=False,
+            action="store_true",
+        )
+        parser.add_argument(
+            "--table",
+            help="write a row of metrics (see --metrics) for each sequence",
+            default=False,
+            action="store_true",
+        )
+        parser.add_argument(
+            "--metrics",
+            help="the comma-separated --table metrics, from {} (default: all)".format(
+                ", ".join(TABLE_METRICS)
+            ),
+            type=metric_list,
+            default=list(TABLE_METRICS),
+        )
+        parser.add_argument(
+            "--table-file",
+            help="write the --table columns to a .npy or .npz FILE (requires numpy)",
+            metavar="FILE",
+        )
+        _add_cache_arguments(parser)
         parser.set_defaults(func=self.func)
 
     @staticmethod
     def _process_args(args):
+        if args.table_file:
+            args.table = True
+            if not args.table_file.endswith((".npy", ".npz")):
+                _err("--table-file must end in .npy or .npz")
+        if args.table and (
+            args.byseq
+            or args.partial
+            or args.merge
+            or args.cache
+            or args.cache_dir
+            or args.jobs > 1
+        ):
+            _err(
+                "--table cannot be used with -q, --partial, --merge, --cache, --cache-dir or -j"
+            )
+        if args.byseq and (args.partial or args.merge):
+            _err("--partial and --merge cannot be used with --byseq")
+        if args.byseq and args.jobs > 1:
+            _err("--jobs cannot be used with --byseq")
         # If no output options are specified, do length stats
         if not any(
             (args.counts, args.type, args.length, args.proportion, args.count_lower)
@@ -754,7 +1004,10 @@ class Stat(Subcommand):
 
     def generator(self, args, gen):
         args = self._process_args(args)
-        if args.byseq:
+        if args.table:
+            for line in self._table(args, gen):
+                yield line
+        elif args.byseq:
             g = stat_seq(
                 gen,
                 length=args.length,
@@ -762,6 +1015,7 @@ class Stat(Subcommand):
                 proportion=args.proportion,
                 case_sensitive=args.case_sensitive,
                 count_lower=args.count_lower,
+                alphabet=Alphabet.NAMED.get(args.alphabet),
             )
 
             for item in g:
@@ -778,7 +1032,51 @@ class Stat(Subcommand):
                 )
             )
 
-            g = stat_file(gen, count_characters=need_count)
+            if args.merge:
+                parts = _load_partials(args.fh, FastaStat)
+                approx = any(part.sketch is not None for part in parts)
+                g = FastaStat(approx=approx)
+                for part in parts:
+                    g.merge(part)
+                if need_count and not g.counted():
+                    _err("The partials were written without counting characters")
+            elif _summary_cache(args):
+
+                def summarize(path):
+                    inputs = path if args.jobs > 1 else read_fasta(path, filename=path)
+                    return stat_file(
+                        inputs,
+                        count_characters=need_count,
+                        approx=args.approx,
+                        jobs=args.jobs,
+                    )
+
+                cache = _summary_cache(args)
+                kind = "stat-approx" if args.approx else "stat"
+                parts = [
+                    cache.summarize(
+                        path,
+                        kind,
+                        FastaStat,
+                        summarize,
+                        usable=lambda part: part.counted() or not need_count,
+                    )
+                    for path in args.fh
+                ]
+                g = parts[0]
+                for part in parts[1:]:
+                    g.merge(part)
+            else:
+                g = stat_file(
+                    _input_files(args, gen) if args.jobs > 1 else gen,
+                    count_characters=need_count,
+                    approx=args.approx,
+                    jobs=args.jobs,
+                )
+
+            if args.partial:
+                yield json.dumps(g.to_dict())
+                return
 
             if need_count:
                 yield g.get_count(
@@ -810,6 +1108,40 @@ class Stat(Subcommand):
                 else:
                     yield g.get_aaprofile()
 
+    @staticmethod
+    def _table(args, gen):
+        batches = stat_table(gen, metrics=args.metrics)
+        if not args.table_file:
+            yield args.delimiter.join(["seqid"] + args.metrics)
+            for seqids, columns in batches:
+                columns = [c if isinstance(c, list) else c.tolist() for c in columns]
+                for row in zip(seqids, *columns):
+                    yield args.delimiter.join([str(x) for x in row])
+            return
+
+        try:
+            import numpy
+        except ImportError:
+            _err("--table-file requires numpy")
+        seqids = []
+        parts = [[] for _ in args.metrics]
+        for ids, columns in batches:
+            seqids += ids
+            for part, column in zip(parts, columns):
+                part.append(numpy.asarray(column))
+        columns = {"seqid": numpy.array(seqids, dtype=str)}
+        for metric, part in zip(args.metrics, parts):
+            columns[metric] = numpy.concatenate(part) if part else numpy.zeros(0)
+        if args.table_file.endswith(".npz"):
+            numpy.savez(args.table_file, **columns)
+        else:
+            table = numpy.zeros(
+                len(seqids), dtype=[(k, v.dtype) for k, v in columns.items()]
+            )
+            for k, v in columns.items():
+                table[k] = v
+            numpy.save(args.table_file, table)
+
 
 class Split(Subcommand):
     def _parse(self):
@@ -1059,7 +1391,11 @@ class Sort(Subcommand):
             help="sort sequences",
             description="""Sorts the entries in a fasta file. By default, it
             sorts by the header strings. `sort` reads the entire file into
-            memory, so should not be used for extremely large files.""",
+            memory, unless the input is files, in which case only the sort
+            key and offset of each entry are held and the entries are read
+            back from the files, or it is given a --memory limit, in which
+            case it sorts runs of entries that fit and merges them through
+            temporary files.""",
         )
         parser.add_argument(
             "fh",
@@ -1109,11 +1445,20 @@ class Sort(Subcommand):
             help="The separator between a tag and value  (default: '=')",
             default="=",
         )
+        parser.add_argument(
+            "--memory",
+            metavar="SIZE",
+            help="sort in about SIZE of memory (e.g. 2G), using temporary files",
+            type=byte_size,
+        )
+        parser.add_argument(
+            "--tmpdir",
+            metavar="DIR",
+            help="write temporary files in DIR (default: the system's)",
+        )
         parser.set_defaults(func=self.func)
 
     def generator(self, args, gen):
-        seqs = [s for s in gen]
-
         if args.numeric_sort and not args.regex:
             _err("--numeric does nothing unless with --regex")
 
@@ -1193,10 +1538,16 @@ class Sort(Subcommand):
             def sortterm(x):
                 return x.header
 
-        seqs.sort(key=sortterm, reverse=args.reverse)
-
-        for s in seqs:
-            yield s
+        if not args.memory and _regular_files(args):
+            # only the keys and offsets are held, the entries are read back
+            return sort_files(args.fh, key=sortterm, reverse=args.reverse)
+        return sort_entries(
+            gen,
+            key=sortterm,
+            reverse=args.reverse,
+            memory=args.memory,
+            tmpdir=args.tmpdir,
+        )
 
 
 class Consensus(Subcommand):
@@ -1366,6 +1717,46 @@ class Head(Subcommand):
         return head(gen, nseqs=nseqs, first=args.first, last=args.last, allbut=allbut)
 
 
+class Index(Subcommand):
+    def _parse(self):
+        cmd_name = "index"
+        parser = self.subparsers.add_parser(
+            cmd_name,
+            usage=self.usage.format(cmd_name),
+            help="build a sequence index for repeated searches",
+            description="""Builds a suffix array over the sequences of a fasta
+            file. The index can then be searched by `smof grep --index` for
+            literal sequence patterns without rereading the input, until the
+            input changes. By default, the index is written to INPUT.smi. The index file takes 9 bytes
+            per base. With numpy, building it takes about 0.5 seconds per Mb
+            of sequence and 13 to 21 bytes of memory per base (more where
+            long repeats are shared, and 8 more above 2 Gb); without numpy,
+            it is only practical for a few Mb.""",
+        )
+        parser.add_argument(
+            "fh",
+            help="input fasta sequence (default = stdin)",
+            metavar="INPUT",
+            nargs="*",
+        )
+        parser.add_argument(
+            "-o", "--output", help="write the index to FILE", metavar="FILE"
+        )
+        parser.set_defaults(func=self.func)
+
+    def generator(self, args, gen):
+        source = args.fh[0] if len(args.fh) == 1 else None
+        return FastaIndex.build(gen, source=source)
+
+    def write(self, args, gen, out=None):
+        output = args.output
+        if not output:
+            if len(args.fh) != 1:
+                _err("Please name the index with --output")
+            output = args.fh[0] + ".smi"
+        self.generator(args, gen).write(output)
+
+
 class Grep(Subcommand):
     def _parse(self):
         cmd_name = "grep"
@@ -1447,7 +1838,7 @@ class Grep(Subcommand):
         parser.add_argument(
             "-G",
             "--ambiguous-nucl",
-            help="parse extended nucleotide alphabet",
+            help="parse extended nucleotide alphabet (in the sequence too, unless PATTERN is a regex)",
             action="store_true",
             default=False,
         )
@@ -1590,12 +1981,56 @@ class Grep(Subcommand):
             help="Search for exact sequence matches against FASTA",
             metavar="FASTA",
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            help="match entries in up to N worker processes, one per CPU (default=1)",
+            metavar="N",
+            type=counting_number,
+            default=1,
+        )
+        parser.add_argument(
+            "--max-count",
+            help="stop reading a file after N matching entries",
+            metavar="N",
+            type=counting_number,
+        )
+        parser.add_argument(
+            "--index",
+            help="search an index built by `smof index` (literal patterns only)",
+            metavar="FILE",
+        )
         parser.set_defaults(func=self.func)
 
     def generator(self, args, gen):
         searcher = GrepSearch(args)
         self.force_color = args.force_color
-        return searcher.search(gen)
+        if args.index:
+            if any(isinstance(f, str) for f in args.fh):
+                _err("Input files cannot be given with --index")
+            # the sequences are read from the index, not the input
+            return searcher.search([], ninputs=1)
+        # with no files, input is read from STDIN
+        files = args.fh if args.fh else [sys.stdin]
+        if not all(isinstance(f, str) for f in args.fh):
+            return searcher.search(gen, ninputs=len(files))
+        if args.fh and args.jobs > 1 and not args.preserve_color:
+            # the workers read the files themselves
+            return searcher.search(list(args.fh))
+        # each file is read by its own stream, so that reading a file can
+        # stop as soon as --max-count (or -l/-L) has settled it
+        if searcher.counting:
+            # counts need only the searched text, so read it straight from
+            # the files rather than building FastaEntry objects
+            fields = [
+                _stream_fields(
+                    f, sequence=args.match_sequence, purge_color=args.preserve_color
+                )
+                for f in files
+            ]
+            return searcher.count(fields)
+        streams = [_stream_entries(f, handle_color=args.preserve_color) for f in files]
+        return searcher.search(streams)
 
 
 class Uniq(Subcommand):
@@ -1674,17 +2109,35 @@ class Uniq(Subcommand):
             help="With -f, store removed sequences in FILE",
             type=argparse.FileType("w"),
         )
+        parser.add_argument(
+            "--memory",
+            metavar="SIZE",
+            help="work in about SIZE of memory (e.g. 2G), using temporary files",
+            type=byte_size,
+        )
+        parser.add_argument(
+            "--tmpdir",
+            metavar="DIR",
+            help="write temporary files in DIR (default: the system's)",
+        )
         parser.set_defaults(func=self.func)
 
     def generator(self, args, gen):
+        external = {"memory": args.memory, "tmpdir": args.tmpdir}
         if args.first_header:
-            return uniq_headers(gen, removed=args.removed)
+            return uniq_headers(gen, removed=args.removed, **external)
         elif args.pack:
-            return pack(gen, sep=args.pack_sep)
+            return pack(gen, sep=args.pack_sep, **external)
         elif args.unpack:
             return unpack(gen, sep=args.pack_sep)
         else:
-            return uniq(gen, repeated=args.repeated, uniq=args.uniq, count=args.count)
+            return uniq(
+                gen,
+                repeated=args.repeated,
+                uniq=args.uniq,
+                count=args.count,
+                **external
+            )
 
 
 class Wc(Subcommand):
@@ -1717,10 +2170,20 @@ class Wc(Subcommand):
             action="store_true",
             default=False,
         )
+        _add_cache_arguments(parser)
         parser.set_defaults(func=self.func)
 
     def generator(self, args, gen):
         nchars, nseqs = 0, 0
+        cache = _cache(args)
+        if cache:
+            for path in args.fh:
+                n, total = cache.counts(path)
+                nseqs += n
+                nchars += total
+            yield nseqs
+            yield nchars
+            return
         for seq in gen:
             nchars += len(seq.seq)
             nseqs += 1